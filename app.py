@@ -10,7 +10,9 @@ from werkzeug.utils import secure_filename
 
 from cv2 import VideoCapture, imread, imwrite
 
-from utils import SessionManager, DataManager, Counter, Tracker, xlsxWriter, xlsxCompiler, StreetCountCompiler, Annotator
+from utils import SessionManager, DataManager, Counter, Tracker, xlsxWriter, xlsxCompiler, StreetCountCompiler, Annotator, ColumnarWriter, CompileCache, CountCube, SessionLog, JobManager, Checkpoint, BackendTuner, ModelQuantizer, CpuBudget, InferenceServer, DetectionLog, StageProfiler, MetricsRegistry, SamplingProfiler
+from utils.export import crossing_table
+from utils.reuse import job_fingerprint, link_results
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -27,12 +29,26 @@ dotenv.load_dotenv()
 # Initialize session manager
 session_manager = SessionManager()
 
-app.config['CONTENTS'] = 'contents'
+# Background jobs : one bounded pool per job kind, so compiles cannot starve video processing
+job_manager = JobManager({'process': int(os.getenv('max_processing_jobs', 4)),
+                          'compile': int(os.getenv('max_compile_jobs', 2))})
+# Cores shared by the inference of concurrent processing jobs, rebalanced when a job starts or finishes
+cpu_budget = CpuBudget(int(os.getenv('inference_cpus', 0)) or None)
+# Detection models shared by all sessions, frames of concurrent sessions are batched (inference_batch=0 gives each job its own model)
+inference_server = InferenceServer(max_batch=int(os.getenv('inference_batch', 8)), max_wait_ms=float(os.getenv('inference_batch_wait_ms', 5))) if int(os.getenv('inference_batch', 8)) else None
+
+# Uploads, models, results, logs and caches, relative to the app folder unless absolute
+app.config['CONTENTS'] = os.getenv('contents_folder', 'contents')
 
 app.config['UPLOADS_FOLDER'] = os.path.join(app.config['CONTENTS'],'uploads')
 app.config['MODELS_FOLDER'] = os.path.join(app.config['CONTENTS'],'models')
 app.config['RESULTS_FOLDER'] = os.path.join(app.config['CONTENTS'],'results')
 app.config['LOGS_FOLDER'] = os.path.join(app.config['CONTENTS'],'logs')
+# Per-report partial counts reused across compiles, location and size limit can be set in .env
+app.config['COMPILE_CACHE_FOLDER'] = os.getenv('compile_cache_folder', os.path.join(app.config['CONTENTS'],'cache','compiler'))
+app.config['COMPILE_CACHE_MAX_MB'] = int(os.getenv('compile_cache_max_mb', 512))
+# Worker processes of a single compile : the compile process budget (half the CPUs by default) is split between concurrent compile jobs
+app.config['COMPILE_WORKERS'] = max(1, int(os.getenv('max_compile_processes', max(1, (os.cpu_count() or 1) // 2))) // job_manager.max_workers['compile'])
 
 # Check directories for uploads, models, results, and logs
 os.makedirs(os.path.join(app.root_path, app.config['UPLOADS_FOLDER']), exist_ok=True)
@@ -42,6 +58,35 @@ os.makedirs(os.path.join(app.root_path, app.config['RESULTS_FOLDER']), exist_ok=
 os.makedirs(os.path.join(app.root_path, os.path.join(app.config['RESULTS_FOLDER'], 'compiler')), exist_ok=True)
 os.makedirs(os.path.join(app.root_path, app.config['LOGS_FOLDER']), exist_ok=True)
 
+# Session history : indexed SQLite log, legacy JSON logs are imported on first start
+session_log_db = SessionLog(os.path.join(app.root_path, app.config['LOGS_FOLDER'], 'session_log.db'),
+                            legacy_logs={'Counting': os.path.join(app.root_path, app.config['LOGS_FOLDER'], 'process_session_log.json'),
+                                         'Compiling': os.path.join(app.root_path, app.config['LOGS_FOLDER'], 'compile_session_log.json')})
+app.config['HISTORY_PAGE_SIZE'] = 50
+# Tracking jobs are checkpointed periodically (in seconds), so interrupted jobs can be resumed from the history page
+app.config['CHECKPOINT_INTERVAL_S'] = int(os.getenv('checkpoint_interval_s', 60))
+# Jobs identical to a previous successful job (same video, model and settings) reuse its results instead of running again
+app.config['REUSE_RESULTS'] = os.getenv('reuse_results', 'true').lower() != 'false'
+# Frames are decoded, scaled to the model input size and converted by ffmpeg instead of OpenCV (faster on 4K sources)
+app.config['FFMPEG_DECODE'] = os.getenv('ffmpeg_decode', 'false').lower() == 'true'
+# Every detection is logged to a binary file of the session, counting and exports then read it memory-mapped
+app.config['DETECTION_LOG'] = os.getenv('detection_log', 'true').lower() != 'false'
+
+# Stage timings of finished jobs, exposed by /metrics
+metrics_registry = MetricsRegistry()
+
+# Per-job count cubes, queried by /api/counts
+count_cube = CountCube()
+
+# Fastest runtime/image size/threads per model, measured on demand (see /api/autotune) and used by later jobs
+backend_tuner = BackendTuner(os.path.join(app.root_path, app.config['MODELS_FOLDER'], 'autotune.json'),
+                             os.path.join(app.root_path, app.config['MODELS_FOLDER'], 'tuned'))
+# Quantized variants of uploaded .pt models, calibrated on site footage (see /api/quantize)
+model_quantizer = ModelQuantizer(os.path.join(app.root_path, app.config['MODELS_FOLDER'], 'quantized'))
+
+compile_cache = CompileCache(os.path.join(app.root_path, app.config['COMPILE_CACHE_FOLDER']),
+                             max_bytes=app.config['COMPILE_CACHE_MAX_MB'] * 1024 * 1024)
+
 app.secret_key = 'SystraMVASingapore'  #not used
 app.config['MAX_CONTENT_LENGTH'] = 1000 * 1024 * 1024  # 1000 MB
 
@@ -60,8 +105,13 @@ def update_progress(session_id, step, percentage):
         session_manager.sessions[session_id]['progress'][session_id] = {}
     session_manager.sessions[session_id]['progress'][session_id][step] = percentage
 
+def get_checkpoint(session_id):
+    return Checkpoint(os.path.join(app.root_path, app.config['RESULTS_FOLDER'], session_id, 'checkpoint'),
+                      interval_s=app.config['CHECKPOINT_INTERVAL_S'])
+
 def process_video_task(data_manager, session_id, paths):
     with app.app_context():
+        profiler, sampling_profiler = None, None
         try:
             start_time = datetime.datetime.now()
             session_dir = paths['session_dir']
@@ -69,23 +119,55 @@ def process_video_task(data_manager, session_id, paths):
             for step in ['YOLO', 'Counting', 'Excel', 'Annotation']:
                 update_progress(session_id, step, 0)
 
+            fingerprint = job_fingerprint(data_manager)
+            if app.config['REUSE_RESULTS'] and not data_manager.do_profile and reuse_results(session_id, fingerprint, paths):
+                for step in ['YOLO', 'Counting', 'Excel', 'Annotation']:
+                    update_progress(session_id, step, 100)
+                get_checkpoint(session_id).clear()
+                session_log_db.set_fingerprint('Counting', session_id, fingerprint)
+                session_log_db.set_status('Counting', session_id, 'success')
+                return
+            if data_manager.do_profile:
+                sampling_profiler = SamplingProfiler()
+                sampling_profiler.start()
+
             # Initialize Tracker and Counter for multiple triplines
-            tracker = Tracker(data_manager, progress_callback=lambda p: update_progress(session_id, 'YOLO', p))
             counter = Counter(data_manager, progress_callback=lambda p: update_progress(session_id, 'Counting', p))
-
-            # Process video
-            tracker.process_video(data_manager)
+            profiler = StageProfiler()
+            profiler.sample_queues(job_manager.status())
+
+            # Process video, resuming from the checkpoint of an interrupted run if there is one
+            checkpoint = get_checkpoint(session_id)
+            detection_log = DetectionLog(paths['detection_log_path']) if 'detection_log_path' in paths else None
+            with cpu_budget.acquire(session_id) as cpu_lease:
+                tracker = Tracker(data_manager, progress_callback=lambda p: update_progress(session_id, 'YOLO', p), cpu_lease=cpu_lease, inference_server=inference_server, profiler=profiler)
+                with profiler.stage('tracking'):
+                    tracker.process_video(data_manager, checkpoint=checkpoint, detection_log=detection_log)
+                profiler.set_items('tracking', profiler.stages['decode']['items'])
+            if detection_log is not None:
+                with profiler.stage('detection_log_load'):
+                    detections = DetectionLog.load(paths['detection_log_path'], data_manager) # Tracks are read from the page cache instead of held in memory
+                profiler.set_items('detection_log_load', detections)
+            profiler.sample_queues(job_manager.status())
             update_progress(session_id, 'YOLO', 100)
 
             # Counting for multiple triplines
             update_progress(session_id, 'Counting', 0)
-            counter.count(data_manager)
+            with profiler.stage('count', items=len(data_manager.TRACK_DATA)):
+                counter.count(data_manager)
             update_progress(session_id, 'Counting', 100)
 
             # Export results
             update_progress(session_id, 'Excel', 0)
-            writer = xlsxWriter(progress_callback=lambda p: update_progress(session_id, 'Excel', p))
-            writer.write_to_excel(report_path, data_manager)
+            table = crossing_table(data_manager) # Shared by the Excel and columnar exports
+            with profiler.stage('excel', items=len(table)):
+                writer = xlsxWriter(progress_callback=lambda p: update_progress(session_id, 'Excel', p))
+                writer.write_to_excel(report_path, data_manager, table=table)
+            if data_manager.export_formats:
+                with profiler.stage('columnar', items=len(table)):
+                    columnar_writer = ColumnarWriter(formats=data_manager.export_formats)
+                    columnar_writer.write(paths['columnar_base_path'], data_manager, include_tracks=data_manager.do_tracks_export, table=table)
+            count_cube.write(os.path.join(session_dir, CountCube.FILENAME), data_manager, table, session_id)
             update_progress(session_id, 'Excel', 100)
 
             # Perform annotation if export_video is True
@@ -93,22 +175,78 @@ def process_video_task(data_manager, session_id, paths):
                 update_progress(session_id, 'Annotation', 0)
                 annotated_video_path = paths['annotated_video_path']
                 annotator = Annotator(data_manager, progress_callback=lambda p: update_progress(session_id, 'Annotation', p))
-                annotator.write_annotated_video(annotated_video_path)
+                with profiler.stage('annotation', items=data_manager.frame_count):
+                    annotator.write_annotated_video(annotated_video_path)
                 if not os.path.exists(paths['ffmpeg_path']):
                     logger.warning(f'ffmpeg executable not found at {paths['ffmpeg_path']}')
                 else :
-                    paths['annotated_video_path'] = annotator.reformat_video(annotated_video_path, ffmpeg_path=paths['ffmpeg_path'], cleanup=True)
+                    with profiler.stage('reformat', items=data_manager.frame_count):
+                        paths['annotated_video_path'] = annotator.reformat_video(annotated_video_path, ffmpeg_path=paths['ffmpeg_path'], cleanup=True)
                 update_progress(session_id, 'Annotation', 100)
 
             end_time = datetime.datetime.now()
+            save_profile(profiler, session_dir)
+            if sampling_profiler is not None:
+                save_sampling_profile(sampling_profiler, session_dir)
+            checkpoint.clear()
+            session_log_db.set_fingerprint('Counting', session_id, fingerprint)
+            session_log_db.set_status('Counting', session_id, 'success')
 
         except Exception as e:
+            session_log_db.set_status('Counting', session_id, 'error')
             update_progress(session_id, 'YOLO', -1)
             update_progress(session_id, 'Counting', -1)
             update_progress(session_id, 'Excel', -1)
             update_progress(session_id, 'Annotation', -1)
             session_manager.sessions[session_id]['results'][session_id] = {'error': f'Error processing video: {str(e)}'}
             logging.error(f'Error processing video: {str(e)}', exc_info=True)
+            if profiler is not None:
+                save_profile(profiler, paths['session_dir'])
+            if sampling_profiler is not None:
+                save_sampling_profile(sampling_profiler, paths['session_dir'])
+
+def save_profile(profiler, session_dir):
+    '''Saves the stage profile of a job in its session folder and adds it to the /metrics totals.'''
+    profiler.sample_queues(job_manager.status())
+    metrics_registry.record(profiler)
+    try:
+        os.makedirs(session_dir, exist_ok=True)
+        tmp_path = os.path.join(session_dir, f'{StageProfiler.FILENAME}.tmp') # Replaced rather than rewritten, the file may be linked from another session
+        profiler.save(tmp_path)
+        os.replace(tmp_path, os.path.join(session_dir, StageProfiler.FILENAME))
+    except OSError as e:
+        logging.warning(f'Could not save the profile of {session_dir}: {str(e)}')
+
+def save_sampling_profile(sampling_profiler, session_dir):
+    '''Stops the sampling profiler of a job and saves its flame graph stacks and summary in the session folder.'''
+    sampling_profiler.stop()
+    try:
+        for path in sampling_profiler.save(session_dir):
+            logging.info(f'Sampling profile saved to {path}')
+    except OSError as e:
+        logging.warning(f'Could not save the sampling profile of {session_dir}: {str(e)}')
+
+def reuse_results(session_id, fingerprint, paths):
+    '''
+    Serves a job with the results of a previous successful job with the same fingerprint,
+    by linking its files into the session folder.
+
+    Returns:
+        bool: True if previous results were reused
+    '''
+    previous_id = session_log_db.find_fingerprint('Counting', fingerprint, exclude=session_id)
+    if previous_id is None:
+        return False
+    previous_dir = os.path.join(app.root_path, app.config['RESULTS_FOLDER'], previous_id)
+    required = [os.path.basename(paths[key]) for key in ['report_path', 'annotated_video_path'] if key in paths]
+    if not link_results(previous_dir, paths['session_dir'], required, skip=[CountCube.FILENAME, StageProfiler.FILENAME, SamplingProfiler.FOLDED_FILENAME, SamplingProfiler.SUMMARY_FILENAME]):
+        return False
+    # The count cube is labelled with its session, so it is copied under the new one
+    cube_path = os.path.join(previous_dir, CountCube.FILENAME)
+    if os.path.isfile(cube_path):
+        count_cube.relabel(cube_path, os.path.join(paths['session_dir'], CountCube.FILENAME), session_id)
+    logging.info(f'Session {session_id} reused the results of identical session {previous_id}.')
+    return True
 
 @app.route('/')
 def index():
@@ -123,11 +261,19 @@ def pre_process_video(session_id):
         'site_location': request.form.get('siteLocation'),
         'inference_tracker': request.form.get('inferenceTracker'),
         'export_video': request.form.get('exportVideo') == 'on',
+        'export_columnar': request.form.get('exportColumnar') == 'on',
+        'export_tracks': request.form.get('exportTracks') == 'on',
+        'profile_job': request.form.get('profileJob') == 'on',
         'start_date': request.form.get('startDate'),
         'start_time': request.form.get('startTime'),
+        'time_windows': request.form.get('timeWindows', '').strip(), # Optional, e.g. '07:00-09:00, 16:00-19:00'
         'triplines': request.form.get('triplines'),
         'directions': request.form.get('directions')
     }
+    try:
+        DataManager.parse_time_windows(session_manager.sessions[session_id]['form_data']['time_windows'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     # Handle file uploads
     model_file = request.files.get('modelFile')
     
@@ -143,64 +289,117 @@ def pre_process_video(session_id):
 
 @app.route('/start_processing/<session_id>', methods=['POST'])
 def start_processing(session_id):
+    job = {
+        'video_path': session_manager.sessions[session_id].get('video_path'),
+        'model_path': session_manager.sessions[session_id].get('model_path'),
+        'form_data': session_manager.sessions[session_id].get('form_data'),
+        'triplines': request.get_json().get('triplines'), # Set from drawing stage
+        'directions': request.get_json().get('directions'),
+    }
+    try:
+        paths = submit_processing(session_id, job)
+    except ValueError as e: # e.g. time windows outside of the recording
+        return jsonify({'error': str(e)}), 400
+
+    response_paths = {key : os.path.basename(path) for key, path in paths.items()}
+
+    return jsonify({'status': 'Processing started', 'session_id': session_id, 'paths': response_paths})
+
+@app.route('/resume/<session_id>', methods=['POST'])
+def resume_processing(session_id):
+    '''Resubmits an interrupted counting job, which continues from its last checkpoint.'''
+    checkpoint = get_checkpoint(session_id)
+    job = checkpoint.load_job()
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'No checkpoint to resume from.'}), 404
+    if is_processing(session_id):
+        return jsonify({'status': 'error', 'message': 'Session is still processing.'}), 409
+
+    session_manager.create_session(session_id)
+    session_manager.sessions[session_id].update({'video_path': job['video_path'], 'model_path': job['model_path'], 'form_data': job['form_data']})
+    submit_processing(session_id, job)
+    session_log_db.set_status('Counting', session_id, 'submitted')
+    return jsonify({'status': 'Processing resumed', 'session_id': session_id})
+
+def is_processing(session_id):
+    session = session_manager.get_session_data(session_id)
+    return bool(session) and any(0 <= p < 100 for p in session['progress'].get(session_id, {}).values())
+
+def configure_data_manager(data_manager, job):
+    '''
+    Configures a DataManager from a job description (see submit_processing).
+
+    Raises:
+        ValueError: If the job time windows do not overlap the video
+    '''
     # Initialize DataManager with stored session data
-    form_data = session_manager.sessions[session_id].get('form_data')
-    data_manager = session_manager.sessions[session_id]['data_manager']
-    data_manager.video_path = session_manager.sessions[session_id].get('video_path')
+    form_data = job['form_data']
+    data_manager.video_path = job['video_path']
     data_manager.set_video_params(data_manager.video_path)
-    data_manager.selected_model = session_manager.sessions[session_id].get('model_path')
+    data_manager.selected_model = job['model_path']
     data_manager.set_names(data_manager.selected_model)
+    data_manager.inference_config = backend_tuner.get(data_manager.selected_model)
     
     # Set triplines from drawing stage
-    tripline_data = request.get_json().get('triplines')
-    data_manager.triplines = tripline_data
-    data_manager.set_directions(request.get_json().get('directions'))
+    data_manager.triplines = job['triplines']
+    data_manager.set_directions(job['directions'])
     
     # Set remaining parameters from stored form data
     data_manager.site_location = form_data['site_location']
     data_manager.inference_tracker = form_data['inference_tracker']
     data_manager.do_video_export = form_data['export_video']
+    data_manager.export_formats = list(ColumnarWriter.FORMATS) if form_data.get('export_columnar') else []
+    data_manager.do_tracks_export = form_data.get('export_tracks', False)
+    data_manager.do_profile = form_data.get('profile_job', False)
     data_manager.set_start_datetime(form_data['start_date'], form_data['start_time'])
+    data_manager.set_time_windows(form_data.get('time_windows'))
+    data_manager.ffmpeg_decoder = os.getenv('ffmpeg', r'C:\ffmpeg\bin\ffmpeg.exe') if app.config['FFMPEG_DECODE'] else None
+
+def submit_processing(session_id, job):
+    '''
+    Configures the session DataManager from a job description and queues its processing.
+
+    Args:
+        session_id: Session to process
+        job: Dict of video_path, model_path, form_data, triplines and directions
+
+    Returns:
+        dict: Output paths of the job
+
+    Raises:
+        ValueError: If the job time windows do not overlap the video
+    '''
+    data_manager = session_manager.sessions[session_id]['data_manager']
+    configure_data_manager(data_manager, job)
     
     # Define paths
     session_dir = os.path.join(app.root_path, app.config['RESULTS_FOLDER'], session_id)
     report_path = os.path.join(session_dir, 'report_'+ data_manager.site_location +'.xlsx')
     annotated_video_path = os.path.join(session_dir, 'annotated_'+ data_manager.site_location +'_video.mp4') if data_manager.do_video_export else None
     paths = {'session_dir' : session_dir, 'report_path' : report_path}
+    if app.config['DETECTION_LOG']:
+        paths['detection_log_path'] = os.path.join(session_dir, 'detections.bin')
+    if data_manager.export_formats:
+        paths['columnar_base_path'] = os.path.join(session_dir, 'crossings_'+ data_manager.site_location)
     if annotated_video_path:
         paths['annotated_video_path'] = annotated_video_path
         # Check for local ffmpeg path in environment variables
         paths['ffmpeg_path'] = os.getenv('ffmpeg', r'C:\ffmpeg\bin\ffmpeg.exe')
     
-    # Start processing thread
-    processing_thread = threading.Thread(target=process_video_task, 
-                                      args=(data_manager, session_id, paths))
-    processing_thread.start()
-
-    response_paths = {key : os.path.basename(path) for key, path in paths.items()}
-
-    return jsonify({'status': 'Processing started', 'session_id': session_id, 'paths': response_paths})
-
-def log_session(session_id):
-    PROCESS_LOG_FILE = os.path.join(os.path.join(app.root_path, app.config['LOGS_FOLDER']), 'process_session_log.json')
-    # Load existing log data
-    if os.path.exists(PROCESS_LOG_FILE):
-        with open(PROCESS_LOG_FILE, 'r') as f:
-            session_log = json.load(f)
-    else:
-        session_log = {}
-
-    # Add the new session data
-    session_log[session_id] = { 
+    # Queue processing job, reported at 0% while queued (no progress reads as an error on the page)
+    for step in ['YOLO', 'Counting', 'Excel', 'Annotation']:
+        update_progress(session_id, step, 0)
+    get_checkpoint(session_id).save_job(job) # Everything needed to resume the job after a restart
+    job_manager.submit('process', process_video_task, data_manager, session_id, paths)
+    return paths
+
+def log_session(session_id, status='submitted'):
+    session_log_db.log('Counting', session_id, {
         'form_data': session_manager.sessions[session_id]['form_data'],
         'model_path': session_manager.sessions[session_id]['model_path'],
         'video_path': session_manager.sessions[session_id]['video_path'],
         'first_frame_filename': session_manager.sessions[session_id]['first_frame_filename'],
-    }
-
-    # Write the updated log back to the file
-    with open(PROCESS_LOG_FILE, 'w') as f:
-        json.dump(session_log, f, indent=4)
+    }, status=status)
 
 @app.route('/initialize', methods=['POST'])
 def initialize(session_id = None):
@@ -236,7 +435,7 @@ def uploaded_file(filename):
 @app.route('/progress')
 def progress_update():
     session_id = request.args.get('session_id')
-    if session_id in session_manager.sessions[session_id]['progress']:
+    if session_id in session_manager.sessions and session_id in session_manager.sessions[session_id]['progress']:
         return jsonify(session_manager.sessions[session_id]['progress'][session_id])
     else:
         return jsonify({'YOLO': -1, 'Counting': -1, 'Excel': -1, 'Annotation': -1})
@@ -244,7 +443,7 @@ def progress_update():
 @app.route('/results')
 def get_results():
     session_id = request.args.get('session_id')
-    if session_id in session_manager.sessions[session_id]['results']:
+    if session_id in session_manager.sessions and session_id in session_manager.sessions[session_id]['results']:
         return jsonify(session_manager.sessions[session_id]['results'][session_id])
     else:
         return jsonify({'error': 'Results not available yet'}), 202
@@ -254,172 +453,344 @@ def download_file(session_id, filename):
     directory = os.path.join(os.path.join(app.root_path, app.config['RESULTS_FOLDER']), session_id)
     return send_from_directory(directory, filename, as_attachment=True)
 
+def compile_task(session_id, compiler, output_path, compile_data):
+    '''
+    Background compile job (Compiler and Street Count), reporting progress under the 'Compile' step.
+    '''
+    with app.app_context():
+        try:
+            compiler.progress_callback = lambda p: update_progress(session_id, 'Compile', p)
+            compiler.compile(output_path=output_path)
+            compile_data['status'] = 'success'
+            session_manager.sessions[session_id]['results'][session_id] = {'output_filename': compile_data['output_filename'],
+                                                                           'download_url': compile_data['download_url']}
+            update_progress(session_id, 'Compile', 100)
+        except Exception as e:
+            # Update compile_data with error details
+            compile_data['status'] = 'error'
+            compile_data['error_message'] = str(e)
+            session_manager.sessions[session_id]['results'][session_id] = {'error': f'Error compiling: {str(e)}'}
+            update_progress(session_id, 'Compile', -1)
+            logging.error(f'Error compiling: {str(e)}', exc_info=True)
+        # Log the compile session
+        log_compile_session(session_id, compile_data)
+
+def create_compile_session(output_filename):
+    '''
+    Creates a compile session with its own upload and output folders, so concurrent compiles never overwrite each other's files.
+
+    Returns:
+        tuple: (session_id, upload_dir, output_filename, output_path)
+    '''
+    session_id = session_manager.create_session()
+    update_progress(session_id, 'Compile', 0)
+
+    # Set default output filename if not provided
+    if not output_filename or not output_filename.strip():
+        output_filename = 'compiled_report.xlsx'
+    elif not output_filename.endswith('.xlsx'):
+        output_filename += '.xlsx'
+    output_filename = secure_filename(output_filename)
+
+    upload_dir = os.path.join(app.root_path, app.config['UPLOADS_FOLDER'], 'compiler', session_id)
+    output_dir = os.path.join(app.root_path, app.config['RESULTS_FOLDER'], 'compiler', session_id)
+    os.makedirs(upload_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+    return session_id, upload_dir, output_filename, os.path.join(output_dir, output_filename)
+
+def save_compile_uploads(files, upload_dir):
+    file_paths = []
+    for file in files:
+        filename = secure_filename(file.filename)
+        file_path = os.path.join(upload_dir, filename)
+        file.save(file_path)
+        file_paths.append(file_path)
+    return file_paths
+
 @app.route('/compile', methods=['GET', 'POST'])
 def compile_reports():
     if request.method == 'POST':
-        # Generate a unique session ID for this compile session
-        session_id = str(uuid.uuid1())
-        
         # Retrieve form data
-        files = request.files.getlist('filePaths')
-        output_filename = request.form.get('outputFilename')
-        
-        # Set default output filename if not provided
-        if not output_filename.strip():
-            output_filename = 'compiled_report.xlsx'
-        elif not output_filename.endswith('.xlsx'):
-            output_filename += '.xlsx'
-        
-        output_path = os.path.join(os.path.join(app.root_path, os.path.join(app.config['RESULTS_FOLDER'], 'compiler')), output_filename)
-        
+        files = [file for file in request.files.getlist('filePaths') if file.filename]
+        if not files:
+            return jsonify({'status': 'error', 'message': 'No files selected for compilation.'}), 400
+
+        # Generate a unique session ID for this compile session
+        session_id, upload_dir, output_filename, output_path = create_compile_session(request.form.get('outputFilename'))
+        file_paths = save_compile_uploads(files, upload_dir)
+
         # Initialize compile session data
         compile_data = {
             'session_id': session_id,
             'output_filename': output_filename,
             'timestamp': datetime.datetime.now(datetime.UTC),  # ISO 8601 format in UTC
-            'status': 'initiated',
-            'input_paths': [],
-            'error_message': None
+            'status': 'submitted',
+            'input_paths': file_paths,
+            'error_message': None,
+            'download_url': url_for('download_history_file', session_type='Compiling', session_id=session_id, filename=output_filename),
         }
-        
-        try:
-            if not files:
-                raise ValueError('No files selected for compilation.')
-            file_paths = []
-            for file in files:
-                filename = secure_filename(file.filename)
-                file_path = os.path.join(os.path.join(app.root_path, os.path.join(app.config['UPLOADS_FOLDER'], 'compiler')), filename)
-                file.save(file_path)
-                file_paths.append(file_path)
-            compile_data['input_paths'].extend(file_paths)
-            compiler = xlsxCompiler(file_paths=file_paths)
-        
-            
-            # Perform compilation
-            compiler.compile(output_path=output_path)
-            compile_data['status'] = 'success'
-            
-            # Log the successful compile session
-            log_compile_session(session_id, compile_data)
-            
-            # Send the compiled file as a download
-            return send_from_directory(os.path.join(app.root_path,os.path.join(app.config['RESULTS_FOLDER'], 'compiler')), output_filename, as_attachment=True)
-        
-        except Exception as e:
-            # Update compile_data with error details
-            compile_data['status'] = 'error'
-            compile_data['error_message'] = str(e)
-            
-            # Log the failed compile session
-            log_compile_session(session_id, compile_data)
+        log_compile_session(session_id, compile_data)
+
+        compiler = xlsxCompiler(file_paths=file_paths, max_workers=app.config['COMPILE_WORKERS'], cache=compile_cache)
+        job_manager.submit('compile', compile_task, session_id, compiler, output_path, compile_data)
 
-            
-            # Return error response
-            return jsonify({'status': 'error', 'message': str(e)}), 500
+        return jsonify({'status': 'Compilation started', 'session_id': session_id})
     
     return render_template('compile.html')
 
 def log_compile_session(session_id, data):
     '''
-    Logs compile session details to compile_session_log.json.
+    Logs compile session details to the session log.
     
     Args:
         session_id (str): Unique identifier for the compile session.
         data (dict): Dictionary containing compile session details.
     '''
-    COMPILE_LOG_FILE = os.path.join(os.path.join(app.root_path, app.config['LOGS_FOLDER']), 'compile_session_log.json')
-    
-    # Load existing log data
-    if os.path.exists(COMPILE_LOG_FILE):
-        with open(COMPILE_LOG_FILE, 'r') as f:
-            compile_log = json.load(f)
-    else:
-        compile_log = {}
-    
-    # Add the new compile session data
-    compile_log[session_id] = data
-    
-    # Write the updated log back to the file
-    with open(COMPILE_LOG_FILE, 'w') as f:
-        json.dump(compile_log, f, indent=4, default=str)
+    session_log_db.log('Compiling', session_id, data)
 
 @app.route('/history', methods=['GET', 'POST'])
 def history():
-    # Paths to log files
-    PROCESS_LOG_FILE = os.path.join(app.root_path, app.config['LOGS_FOLDER'], 'process_session_log.json')
-    COMPILE_LOG_FILE = os.path.join(app.root_path, app.config['LOGS_FOLDER'], 'compile_session_log.json')
-
-    # Load session data
-    process_sessions = {}
-    compile_sessions = {}
-
-    if os.path.exists(PROCESS_LOG_FILE):
-        with open(PROCESS_LOG_FILE, 'r') as f:
-            process_sessions = json.load(f)
-    if os.path.exists(COMPILE_LOG_FILE):
-        with open(COMPILE_LOG_FILE, 'r') as f:
-            compile_sessions = json.load(f)
-
-    selected_type = None
-    selected_session_id = None
+    selected_type = request.values.get('session_type')
+    selected_session_id = request.values.get('session_id')
+    search = request.values.get('search', '').strip()
+    status = request.values.get('status', '').strip()
+    page = max(1, request.values.get('page', 1, type=int))
+    per_page = app.config['HISTORY_PAGE_SIZE']
+
+    sessions, total = [], 0
     session_log = None
     triplines = None
     first_frame_path = None
     available_files = []
+    resumable = False
 
-    if request.method == 'POST':
-        selected_type = request.form.get('session_type')
-        selected_session_id = request.form.get('session_id')
+    if selected_type in SessionLog.SESSION_TYPES:
+        # Only the requested page of sessions is loaded, filtered by the database index
+        sessions, total = session_log_db.query(selected_type, search=search or None, status=status or None, page=page, per_page=per_page)
+        page_count = max(1, -(-total // per_page))
+        if page > page_count: # A stale page number past the filtered results shows the last page instead
+            page = page_count
+            sessions, total = session_log_db.query(selected_type, search=search or None, status=status or None, page=page, per_page=per_page)
+
+        if selected_session_id:
+            session_log = session_log_db.get(selected_type, selected_session_id)
 
         # Get the session log based on selected type and session ID
-        if selected_type == 'Counting' and selected_session_id in process_sessions:
-            session_log = process_sessions[selected_session_id]
+        if selected_type == 'Counting' and session_log:
             # Load first frame
             first_frame_filename = session_log['first_frame_filename'] 
             first_frame_path = url_for('download_file', filename=first_frame_filename, session_id=selected_session_id)
             # Load triplines
             triplines = json.loads(session_log['form_data']['triplines'])
-            print(triplines)
             # Determine available files for download
             session_dir = os.path.join(app.config['RESULTS_FOLDER'], selected_session_id)
             if os.path.exists(session_dir):
                 for filename in os.listdir(session_dir):
-                    available_files.append(filename)
-        elif selected_type == 'Compiling' and selected_session_id in compile_sessions:
-            session_log = compile_sessions[selected_session_id]
+                    if os.path.isfile(os.path.join(session_dir, filename)): # Skips the checkpoint folder
+                        available_files.append(filename)
+            # Interrupted jobs keep their checkpoint and can be resumed
+            resumable = get_checkpoint(selected_session_id).load_job() is not None and not is_processing(selected_session_id)
+        elif selected_type == 'Compiling' and session_log:
             # Compiled files are stored in RESULTS_FOLDER/compiler
             compiled_file = session_log.get('output_filename')
             if compiled_file:
                 available_files.append(compiled_file)
 
+    page_count = max(1, -(-total // per_page))
     return render_template('history.html',
-                           process_sessions=process_sessions,
-                           compile_sessions=compile_sessions,
+                           statuses=SessionLog.STATUSES,
+                           sessions=sessions,
+                           total=total,
+                           page=page,
+                           page_count=page_count,
+                           search=search,
+                           status=status,
                            selected_type=selected_type,
                            first_frame_path=first_frame_path,
                            triplines=triplines,
                            selected_session_id=selected_session_id,
                            session_log=session_log,
-                           available_files=available_files)
+                           available_files=available_files,
+                           resumable=resumable)
 
 @app.route('/download_history_file/<session_type>/<session_id>/<filename>')
 def download_history_file(session_type, session_id, filename):
     if session_type == 'Counting':
         directory = os.path.join(app.root_path, app.config['RESULTS_FOLDER'], session_id)
     elif session_type == 'Compiling':
-        directory = os.path.join(app.root_path, app.config['RESULTS_FOLDER'], 'compiler')
+        # Compiled files are stored per session, older sessions directly in RESULTS_FOLDER/compiler
+        directory = os.path.join(app.root_path, app.config['RESULTS_FOLDER'], 'compiler', session_id)
+        if not os.path.isdir(directory):
+            directory = os.path.join(app.root_path, app.config['RESULTS_FOLDER'], 'compiler')
     else:
         return 'Invalid session type', 400
     return send_from_directory(directory, filename, as_attachment=True)
 
+@app.route('/api/jobs')
+def api_jobs():
+    '''Running and queued jobs per kind, how the cores are shared between the running inferences, and the batching of the inference server.'''
+    return jsonify({'pools': job_manager.status(), 'cpu_budget': cpu_budget.status(),
+                    'inference_server': inference_server.status() if inference_server else None})
+
+@app.route('/metrics')
+def metrics():
+    '''Stage timings of the finished jobs and current queue depths, in the Prometheus text format.'''
+    jobs = job_manager.status()
+    budget = cpu_budget.status()
+    gauges = [('jobs_running', 'Running background jobs per kind.', {(('kind', kind),): status['running'] for kind, status in jobs.items()}),
+              ('jobs_queued', 'Queued background jobs per kind.', {(('kind', kind),): status['queued'] for kind, status in jobs.items()}),
+              ('inference_jobs', 'Processing jobs sharing the inference cores.', {(): len(budget['threads'])}),
+              ('inference_frames_per_second', 'Aggregate tracking throughput since the last rebalance.', {(): budget['throughput']})]
+    if inference_server:
+        gauges.append(('inference_server_queue_depth', 'Frames waiting for the shared inference server.',
+                       {(('model', os.path.basename(stats['model'])),): stats['queued'] for stats in inference_server.status()}))
+    return metrics_registry.render(gauges), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/api/counts')
+def api_counts():
+    '''
+    Filtered and grouped counts across counting sessions, answered from the per-job count cubes.
+
+    Query parameters (all optional, repeatable or comma-separated) :
+        session_id: Sessions to query, all sessions with a count cube by default
+        site, direction, class: Accepted values of each dimension
+        group_by: Dimensions to group by, among Session, Site, Direction and Class
+        period: '15min', 'hour', 'day' or 'week'
+        date_from, date_to: ISO dates (inclusive)
+        peak: If 'true', returns the peak hour of each day instead of counts
+    '''
+    def values(name):
+        return [value for arg in request.args.getlist(name) for value in arg.split(',') if value]
+
+    results_folder = os.path.join(app.root_path, app.config['RESULTS_FOLDER'])
+    session_ids = values('session_id')
+    if session_ids:
+        paths = [os.path.join(results_folder, secure_filename(session_id), CountCube.FILENAME) for session_id in session_ids]
+    else:
+        paths = [entry.path for entry in os.scandir(results_folder) if entry.is_dir()]
+        paths = [os.path.join(path, CountCube.FILENAME) for path in paths]
+    paths = [path for path in paths if os.path.exists(path)]
+
+    filters = {dimension: values(dimension.lower()) for dimension in ('Site', 'Direction', 'Class') if values(dimension.lower())}
+    group_by = [dimension.title() for dimension in values('group_by')]
+    try:
+        if request.args.get('peak', '').lower() == 'true':
+            counts = count_cube.peak_hours(paths, filters=filters, group_by=group_by,
+                                           date_from=request.args.get('date_from'), date_to=request.args.get('date_to'))
+        else:
+            counts = count_cube.query(paths, filters=filters, group_by=group_by, period=request.args.get('period'),
+                                      date_from=request.args.get('date_from'), date_to=request.args.get('date_to'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'sessions': len(paths), 'counts': counts})
+
+def autotune_task(session_id, model_path, clip_path):
+    try:
+        best = backend_tuner.tune(model_path, clip_path, progress_callback=lambda p: update_progress(session_id, 'Autotune', p))
+        session_manager.sessions[session_id]['results'][session_id] = best
+        update_progress(session_id, 'Autotune', 100)
+    except Exception as e:
+        session_manager.sessions[session_id]['results'][session_id] = {'error': f'Error benchmarking model: {str(e)}'}
+        update_progress(session_id, 'Autotune', -1)
+        logging.error(f'Error benchmarking model: {str(e)}', exc_info=True)
+
+@app.route('/api/autotune', methods=['GET', 'POST'])
+def api_autotune():
+    '''
+    GET : tuned configuration of a model of the models folder (query parameter 'model', its file name).
+    POST : benchmarks a model on a sample clip in the background, given either the 'session_id' of a counting
+    session (its model and video) or uploaded 'modelFile' and 'clipFile'. Progress and the best configuration
+    are then available from /progress and /results with the returned session_id.
+    '''
+    models_folder = os.path.join(app.root_path, app.config['MODELS_FOLDER'])
+    if request.method == 'GET':
+        model_path = os.path.join(models_folder, secure_filename(request.args.get('model', '')))
+        if not os.path.exists(model_path) or model_path == models_folder:
+            return jsonify({'error': 'Unknown model'}), 404
+        return jsonify({'model': os.path.basename(model_path), 'config': backend_tuner.get(model_path)})
+
+    source = session_manager.get_session_data(request.form.get('session_id', ''))
+    if source and source.get('model_path') and source.get('video_path'):
+        model_path, clip_path = source['model_path'], source['video_path']
+    else:
+        model_file, clip_file = request.files.get('modelFile'), request.files.get('clipFile')
+        if not model_file or not clip_file:
+            return jsonify({'status': 'error', 'message': 'Provide a session_id, or a modelFile and a clipFile.'}), 400
+        model_path = os.path.join(models_folder, secure_filename(model_file.filename))
+        model_file.save(model_path)
+        clip_path = os.path.join(app.root_path, app.config['UPLOADS_FOLDER'], secure_filename(clip_file.filename))
+        clip_file.save(clip_path)
+
+    session_id = session_manager.create_session()
+    update_progress(session_id, 'Autotune', 0)
+    job_manager.submit_exclusive('process', autotune_task, session_id, model_path, clip_path) # Alone, so its thread settings and timings do not mix with running jobs
+    return jsonify({'status': 'Autotune started', 'session_id': session_id}), 202
+
+def quantize_task(session_id, job, video_paths):
+    try:
+        data_manager = DataManager()
+        configure_data_manager(data_manager, job)
+        report = model_quantizer.prepare(job['model_path'], data_manager, video_paths,
+                                         progress_callback=lambda p: update_progress(session_id, 'Quantize', p))
+        session_manager.sessions[session_id]['results'][session_id] = report
+        update_progress(session_id, 'Quantize', 100)
+    except Exception as e:
+        session_manager.sessions[session_id]['results'][session_id] = {'error': f'Error quantizing model: {str(e)}'}
+        update_progress(session_id, 'Quantize', -1)
+        logging.error(f'Error quantizing model: {str(e)}', exc_info=True)
+
+@app.route('/api/quantize', methods=['GET', 'POST'])
+def api_quantize():
+    '''
+    GET : quantization report of a .pt model of the models folder (query parameter 'model', its file name).
+    POST : exports quantized variants of the .pt model of a counting session in the background, calibrated on
+    the session video and on the videos of the optional 'calibration_sessions' (comma separated session ids),
+    then evaluated on the end of the session video. Progress and the report are then available from /progress
+    and /results with the returned session_id.
+    '''
+    models_folder = os.path.join(app.root_path, app.config['MODELS_FOLDER'])
+    if request.method == 'GET':
+        model_path = os.path.join(models_folder, secure_filename(request.args.get('model', '')))
+        if not os.path.isfile(model_path):
+            return jsonify({'error': 'Unknown model'}), 404
+        return jsonify({'model': os.path.basename(model_path), 'report': model_quantizer.load_report(model_path)})
+
+    job = get_checkpoint(secure_filename(request.form.get('session_id', ''))).load_job()
+    if not job:
+        return jsonify({'status': 'error', 'message': 'No counting job found for this session.'}), 404
+    if not job['model_path'].endswith('.pt'):
+        return jsonify({'status': 'error', 'message': 'Quantized variants are exported from .pt models only.'}), 400
+    video_paths = [job['video_path']]
+    for calibration_id in filter(None, request.form.get('calibration_sessions', '').split(',')):
+        calibration_job = get_checkpoint(secure_filename(calibration_id.strip())).load_job()
+        if calibration_job and calibration_job['video_path'] not in video_paths and os.path.exists(calibration_job['video_path']):
+            video_paths.append(calibration_job['video_path'])
+
+    session_id = session_manager.create_session()
+    update_progress(session_id, 'Quantize', 0)
+    job_manager.submit('process', quantize_task, session_id, job, video_paths)
+    return jsonify({'status': 'Quantization started', 'session_id': session_id}), 202
+
+@app.route('/api/quantize/approve', methods=['POST'])
+def approve_quantized():
+    '''
+    Approves a quantized variant ('variant', e.g. openvino-int8) of a model of the models folder ('model', its
+    file name) : later jobs with the model run the variant instead.
+    '''
+    model_path = os.path.join(app.root_path, app.config['MODELS_FOLDER'], secure_filename(request.form.get('model', '')))
+    if not os.path.isfile(model_path):
+        return jsonify({'error': 'Unknown model'}), 404
+    try:
+        config = model_quantizer.approve(model_path, request.form.get('variant', ''), backend_tuner)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'model': os.path.basename(model_path), 'config': config})
+
 @app.route('/streetcount', methods=['GET', 'POST'])
 def compile_streetcount():
     if request.method == 'POST':
-        # Generate a unique session ID for this compile session
-        session_id = str(uuid.uuid1())
-        
         # Retrieve form data
-        files = request.files.getlist('filePaths')
+        files = [file for file in request.files.getlist('filePaths') if file.filename]
         site_location = request.form.get('siteLocation')
         timezone = request.form.get('timezone')
         # Convert timezone string to datetime timezone
@@ -429,48 +800,31 @@ def compile_streetcount():
             timezone_offset = datetime.timezone(datetime.timedelta(hours=hours_offset, minutes=minutes_offset))
         except Exception as e:
             return jsonify({'status': 'error', 'message': 'Invalid timezone format'}), 400
-        output_filename = request.form.get('outputFilename')
-        
-        # Set default output filename if not provided
-        if not output_filename.strip():
-            output_filename = 'compiled_report.xlsx'
-        elif not output_filename.endswith('.xlsx'):
-            output_filename += '.xlsx'
-        
-        output_path = os.path.join(os.path.join(app.root_path, os.path.join(app.config['RESULTS_FOLDER'], 'compiler')), output_filename)
+        if not files:
+            return jsonify({'status': 'error', 'message': 'No files selected for compilation.'}), 400
+
+        # Generate a unique session ID for this compile session
+        session_id, upload_dir, output_filename, output_path = create_compile_session(request.form.get('outputFilename'))
+        file_paths = save_compile_uploads(files, upload_dir)
         
         # Initialize compile session data
         compile_data = {
             'session_id': session_id,
             'output_filename': output_filename,
             'timestamp': datetime.datetime.now(datetime.UTC),  # ISO 8601 format in UTC
-            'status': 'initiated',
-            'input_paths': files,
+            'status': 'submitted',
+            'input_paths': file_paths,
             'site_location': site_location,
             'timezone': timezone,
-            'error_message': None
+            'error_message': None,
+            'download_url': url_for('download_history_file', session_type='Compiling', session_id=session_id, filename=output_filename),
         }
-        try :
-            compiler = StreetCountCompiler(file_paths=files, site_location=site_location, timezone=timezone_offset)
-            
-            # Perform compilation
-            compiler.compile(output_path=output_path)
-            compile_data['status'] = 'success'
-            log_compile_session(session_id, compile_data)
+        log_compile_session(session_id, compile_data)
 
-            # Send the compiled file as a download
-            return send_from_directory(os.path.join(app.root_path,os.path.join(app.config['RESULTS_FOLDER'], 'compiler')), output_filename, as_attachment=True)
-        
-        except Exception as e:
-                # Update compile_data with error details
-                compile_data['status'] = 'error'
-                compile_data['error_message'] = str(e)
-                
-                # Log the failed compile session
-                log_compile_session(session_id, compile_data)
-                
-                # Return error response
-                return jsonify({'status': 'error', 'message': str(e)}), 500
+        compiler = StreetCountCompiler(file_paths=file_paths, site_location=site_location, timezone=timezone_offset)
+        job_manager.submit('compile', compile_task, session_id, compiler, output_path, compile_data)
+
+        return jsonify({'status': 'Compilation started', 'session_id': session_id})
 
     return render_template('streetcount.html')
 
@@ -0,0 +1,31 @@
+'''
+Benchmark of a detection model across runtimes, image sizes and thread counts on the current machine.
+
+The fastest configuration whose detections agree with the reference run is saved to the autotune store,
+where the web app picks it up for later jobs with the same model. Results are printed as JSON.
+
+    python -m benchmarks.backend_benchmark --model contents/models/best.pt --clip sample.mp4 --sizes 640 480 320 --threads 1 4
+'''
+import os
+import json
+import argparse
+
+from utils.autotune import BackendTuner
+
+def main():
+    parser = argparse.ArgumentParser(description='Find the fastest runtime, image size and thread count for a model.')
+    parser.add_argument('--model', required=True, help='Detection model (.pt, .onnx or OpenVINO folder)')
+    parser.add_argument('--clip', required=True, help='Sample video (only its first frames are used)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[640, 480, 320], help='Image sizes to try (.pt models only)')
+    parser.add_argument('--threads', type=int, nargs='+', default=None, help='PyTorch thread counts to try (defaults to 1, half and all CPUs)')
+    parser.add_argument('--min-agreement', type=float, default=0.9, help='Minimum share of the reference detections a configuration must find')
+    parser.add_argument('--store', default=os.path.join('contents', 'models', 'autotune.json'), help='Tuned configurations file')
+    parser.add_argument('--export-dir', default=os.path.join('contents', 'models', 'tuned'), help='Folder of the exported model variants')
+    args = parser.parse_args()
+
+    tuner = BackendTuner(args.store, args.export_dir)
+    best = tuner.tune(args.model, args.clip, image_sizes=args.sizes, thread_counts=args.threads, min_agreement=args.min_agreement)
+    print(json.dumps(best, indent=4))
+
+if __name__ == '__main__':
+    main()
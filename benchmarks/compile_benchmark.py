@@ -0,0 +1,111 @@
+'''
+Benchmark of xlsxCompiler on a synthetic report set.
+
+Generates reports with the same columns as xlsxWriter's output, then times the read,
+precompile and write steps for each requested worker count. Results are printed as JSON.
+
+    python -m benchmarks.compile_benchmark --files 60 --rows 20000 --workers 1 8
+'''
+import os
+import json
+import time
+import argparse
+import tempfile
+import datetime
+import numpy as np
+import pandas as pd
+
+from utils.export.xlsx import xlsxWriter, xlsxCompiler
+from utils.export.aggregation import day_start, week_start, interval_labels
+
+SITES = ['Site A', 'Site B', 'Site C']
+CLASSES = ['car', 'bus', 'truck', 'motorbike', 'bicycle', 'pedestrian']
+DIRECTIONS = ['North', 'South', 'East', 'West']
+
+def make_report(rows, seed, start_datetime):
+    '''
+    Builds one synthetic report : rows crossings over one day, ~10% of objects crossing twice.
+
+    Returns:
+        pd.DataFrame: Report with xlsxWriter.HEADERS columns
+    '''
+    rng = np.random.default_rng(seed)
+    ids = np.arange(rows)
+    ids[rng.random(rows) < 0.1] -= 1 # Some objects cross two triplines
+    ids = np.maximum(ids, 0)
+    timestamps = pd.Series(start_datetime + pd.to_timedelta(np.sort(rng.uniform(0, 86400, rows)), unit='s'))
+    return pd.DataFrame({
+        'Site': SITES[seed % len(SITES)],
+        'Date': day_start(timestamps),
+        'First day of Week': week_start(timestamps),
+        'Week day': timestamps.dt.day_name(),
+        'Time of crossing': timestamps.dt.strftime('%H:%M:%S.%f'),
+        '15 Min Interval': interval_labels(timestamps, 15),
+        'Hour Interval': interval_labels(timestamps, 60),
+        'Direction': rng.choice(DIRECTIONS, rows),
+        'Class': rng.choice(CLASSES, rows),
+        'ID': ids,
+        'Track Confidence': rng.uniform(0.3, 1, rows).round(3),
+        'Frame Count': rng.integers(5, 300, rows),
+        'Average Confidence': rng.uniform(0.3, 1, rows).round(3),
+        'Max Consecutive Frames': rng.integers(1, 300, rows),
+    })[xlsxWriter.HEADERS]
+
+def generate_reports(folder, files, rows, file_format):
+    paths = []
+    for index in range(files):
+        report = make_report(rows, seed=index, start_datetime=datetime.datetime(2025, 1, 1) + datetime.timedelta(days=index // len(SITES)))
+        path = os.path.join(folder, f'report_{index:04d}.{file_format}')
+        if file_format == 'xlsx':
+            report.to_excel(path, index=False)
+        elif file_format == 'parquet':
+            report.to_parquet(path, index=False)
+        else:
+            report.to_csv(path, index=False)
+        paths.append(path)
+    return paths
+
+def time_compile(paths, output_path, workers):
+    compiler = xlsxCompiler(file_paths=paths, max_workers=workers)
+    timings = {}
+    start = time.perf_counter()
+    compiler.read_files()
+    timings['read_s'] = time.perf_counter() - start
+    start = time.perf_counter()
+    compiler.precompile()
+    timings['precompile_s'] = time.perf_counter() - start
+    start = time.perf_counter()
+    compiler.write_compiled_data(output_path)
+    timings['write_s'] = time.perf_counter() - start
+    timings['total_s'] = sum(timings.values())
+    timings['compiled_rows'] = len(compiler.compiled_data)
+    timings['total_count'] = int(sum(compiler.compiled_data.values()))
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark xlsxCompiler on synthetic reports.')
+    parser.add_argument('--files', type=int, default=30, help='Number of reports')
+    parser.add_argument('--rows', type=int, default=20000, help='Crossings per report')
+    parser.add_argument('--format', dest='file_format', choices=['xlsx', 'parquet', 'csv'], default='xlsx')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, os.cpu_count() or 1], help='Worker counts to compare')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        start = time.perf_counter()
+        paths = generate_reports(folder, args.files, args.rows, args.file_format)
+        results = {
+            'files': args.files,
+            'rows_per_file': args.rows,
+            'format': args.file_format,
+            'generation_s': time.perf_counter() - start,
+            'runs': [],
+        }
+        for workers in args.workers:
+            run = time_compile(paths, os.path.join(folder, f'compiled_{workers}.xlsx'), workers)
+            run['workers'] = workers
+            run['rows_per_s'] = args.files * args.rows / run['total_s']
+            results['runs'].append(run)
+    print(json.dumps(results, indent=4))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+'''
+Concurrent-user load test of the web app, with the stub detector of benchmarks.synthetic instead of YOLO.
+
+Runs app.py in this process behind a local threaded HTTP server. Its data folders, session history and caches
+are set to a temporary folder (contents_folder) before it is imported, so nothing is written to the repository. N simulated users then go through what the page does : upload a synthetic
+video (/initialize) and load its first frame, submit the form and model (/pre_process), start the job
+(/start_processing), poll /progress every --poll-s until it completes or fails, then read /results and
+download the report. Request latency percentiles per endpoint, job durations and job completion throughput
+are reported as JSON.
+
+App settings are read from the environment when app.py is imported, --env sets them for the run, e.g. :
+
+    python -m benchmarks.load_test --users 8 --frames 900 --latency-ms 20 --env max_processing_jobs=4 inference_batch=8
+'''
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from collections import defaultdict
+import numpy as np
+
+from benchmarks.synthetic import SyntheticScene, StubModel
+from benchmarks.pipeline_benchmark import environment
+
+PERCENTILES = [50, 90, 95, 99]
+
+def multipart(fields, files):
+    '''
+    Args:
+        fields: Dict of form fields
+        files: Dict {field: (filename, bytes)}
+
+    Returns:
+        tuple: (body, content type) of a multipart/form-data request
+    '''
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+class LoadTest:
+    '''
+    Simulated users of a running app, recording the latency of every request and the duration of every job.
+    '''
+    def __init__(self, base_url, scene, video, poll_s=1.0, timeout_s=3600):
+        '''
+        Args:
+            base_url: Address of the app, e.g. http://127.0.0.1:5000
+            scene: SyntheticScene of the uploaded video (triplines, directions)
+            video: Bytes of the video uploaded by each user
+            poll_s: Time between two /progress requests of a user, in seconds
+            timeout_s: Time after which a job still running is counted as failed, in seconds
+        '''
+        self.base_url = base_url
+        self.scene = scene
+        self.video = video
+        self.poll_s = poll_s
+        self.timeout_s = timeout_s
+        self.requests = defaultdict(list) # Endpoint -> list of (seconds, HTTP status)
+        self.jobs = []
+        self.lock = threading.Lock()
+
+    def request(self, endpoint, path, data=None, content_type=None):
+        '''
+        Returns:
+            tuple: (HTTP status, response body), status 0 if the connection failed
+        '''
+        request = urllib.request.Request(self.base_url + path, data=data, headers={'Content-Type': content_type} if content_type else {})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout_s) as response:
+                status, body = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, body = e.code, e.read()
+        except OSError as e:
+            status, body = 0, str(e).encode()
+        with self.lock:
+            self.requests[endpoint].append((time.perf_counter() - start, status))
+        return status, body
+
+    def request_json(self, endpoint, path, data=None, content_type=None):
+        status, body = self.request(endpoint, path, data, content_type)
+        try:
+            return status, json.loads(body)
+        except ValueError:
+            return status, {}
+
+    def run_job(self, user, index):
+        '''Goes through one job as the page does, and records its outcome.'''
+        job = {'user': user, 'job': index, 'status': 'error', 'duration_s': None}
+        body, content_type = multipart({}, {'videoFile': (f'load_{user}_{index}.avi', self.video)})
+        status, data = self.request_json('initialize', '/initialize', body, content_type)
+        if status != 200:
+            job['error'] = f'initialize: {status}'
+            return self.record(job)
+        session_id = data['session_id']
+        self.request('first_frame', data['frame_url'])
+
+        triplines = json.dumps(self.scene.triplines)
+        directions = {str(number + 1): direction for number, direction in enumerate(self.scene.directions)}
+        body, content_type = multipart({'siteLocation': f'load_{user}', 'inferenceTracker': 'iou', 'startDate': '2025-01-06', 'startTime': '07:00',
+                                        'triplines': triplines, 'directions': json.dumps(directions)},
+                                       {'videoFile': (f'load_{user}_{index}.avi', self.video), 'modelFile': ('stub.pt', b'stub')}) # The form sends the video again
+        status, _ = self.request_json('pre_process', f'/pre_process/{session_id}', body, content_type)
+        if status != 200:
+            job['error'] = f'pre_process: {status}'
+            return self.record(job)
+        status, data = self.request_json('start_processing', f'/start_processing/{session_id}',
+                                         json.dumps({'triplines': self.scene.triplines, 'directions': directions}).encode(), 'application/json')
+        if status != 200:
+            job['error'] = f'start_processing: {status}'
+            return self.record(job)
+
+        start = time.perf_counter()
+        while time.perf_counter() - start < self.timeout_s:
+            time.sleep(self.poll_s)
+            _, progress = self.request_json('progress', f'/progress?session_id={session_id}')
+            if all(progress.get(step) == 100 for step in ('YOLO', 'Counting', 'Excel')):
+                job['status'], job['duration_s'] = 'success', time.perf_counter() - start
+                self.request('results', f'/results?session_id={session_id}')
+                self.request('download', f'/download/{session_id}/{data['paths']['report_path']}')
+                break
+            if -1 in progress.values():
+                _, results = self.request_json('results', f'/results?session_id={session_id}')
+                job['error'] = results.get('error', 'processing error')
+                break
+        else:
+            job['error'] = 'timeout'
+        return self.record(job)
+
+    def record(self, job):
+        with self.lock:
+            self.jobs.append(job)
+
+    def run(self, users, jobs_per_user=1, ramp_s=0.0):
+        '''
+        Runs the users concurrently, each one starting its jobs one after the other.
+
+        Args:
+            users: Number of simulated users
+            jobs_per_user: Jobs run by each user
+            ramp_s: Time over which the users start, in seconds (all at once if 0)
+        '''
+        def user_loop(user):
+            time.sleep(ramp_s * user / users)
+            for index in range(jobs_per_user):
+                self.run_job(user, index)
+
+        self.start = time.perf_counter()
+        threads = [threading.Thread(target=user_loop, args=(user,), name=f'user-{user}') for user in range(users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.wall_s = time.perf_counter() - self.start
+
+    def summary(self):
+        '''
+        Returns:
+            dict: Latency percentiles (ms) and errors per endpoint, job duration percentiles and job throughput
+        '''
+        def percentiles(values):
+            return {f'p{p}': float(np.percentile(values, p)) for p in PERCENTILES} | {'max': float(max(values))} if values else {}
+
+        endpoints = {}
+        for endpoint, samples in sorted(self.requests.items()):
+            latencies = [seconds * 1000 for seconds, _ in samples]
+            endpoints[endpoint] = {'requests': len(samples), 'errors': sum(1 for _, status in samples if not 200 <= status < 300 and status != 202),
+                                   'mean_ms': float(np.mean(latencies)), **{f'{key}_ms': value for key, value in percentiles(latencies).items()}}
+        completed = [job for job in self.jobs if job['status'] == 'success']
+        durations = [job['duration_s'] for job in completed]
+        return {
+            'wall_s': self.wall_s,
+            'jobs': {'submitted': len(self.jobs), 'completed': len(completed), 'failed': len(self.jobs) - len(completed),
+                     'errors': sorted({job['error'] for job in self.jobs if job.get('error')}),
+                     'jobs_per_min': 60 * len(completed) / self.wall_s if self.wall_s else 0.0,
+                     'frames_per_s': len(completed) * self.scene.frames / self.wall_s if self.wall_s else 0.0,
+                     **{f'duration_{key}_s': value for key, value in percentiles(durations).items()}},
+            'endpoints': endpoints,
+        }
+
+def start_app(folder, scene, latency_ms):
+    '''
+    Imports app.py with its data folders, session history and caches in folder and the stub detector instead
+    of YOLO, and serves it on a free local port.
+
+    Returns:
+        tuple: (base URL, werkzeug server)
+    '''
+    # Read by app.py when imported, dotenv does not override them
+    os.environ['contents_folder'] = os.path.join(folder, 'contents')
+    os.environ['compile_cache_folder'] = os.path.join(folder, 'contents', 'cache', 'compiler')
+    from werkzeug.serving import make_server
+    import utils.data, utils.tracking, utils.inference
+    import app as server
+
+    def stub_model(model_path, task=None):
+        return StubModel(scene, latency_ms=latency_ms)
+    utils.data.YOLO = utils.tracking.YOLO = utils.inference.YOLO = stub_model
+
+    http_server = make_server('127.0.0.1', 0, server.app, threaded=True)
+    threading.Thread(target=http_server.serve_forever, name='load-test-server', daemon=True).start()
+    return f'http://127.0.0.1:{http_server.server_port}', http_server
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the web app with concurrent simulated users and a stub detector.')
+    parser.add_argument('--users', type=int, default=4, help='Concurrent simulated users')
+    parser.add_argument('--jobs-per-user', type=int, default=1, help='Jobs each user runs one after the other')
+    parser.add_argument('--ramp-s', type=float, default=0, help='Time over which the users start')
+    parser.add_argument('--poll-s', type=float, default=1.0, help='Progress polling interval (the page polls every second)')
+    parser.add_argument('--timeout-s', type=float, default=3600, help='Time after which a running job is counted as failed')
+    parser.add_argument('--frames', type=int, default=900, help='Length of the uploaded video')
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--density', type=float, default=8, help='Mean number of objects on screen')
+    parser.add_argument('--triplines', type=int, default=1)
+    parser.add_argument('--latency-ms', type=float, default=0, help='Simulated inference time per model call')
+    parser.add_argument('--env', nargs='*', default=[], metavar='KEY=VALUE', help='App settings (.env keys) for the run')
+    parser.add_argument('--output', help='JSON file to write, printed if not set')
+    args = parser.parse_args()
+
+    # Jobs of the run are all identical : reusing results would skip them
+    settings = {'reuse_results': 'false', **dict(setting.split('=', 1) for setting in args.env)}
+    os.environ.update(settings)
+    logging.disable(logging.WARNING) # Keep the output machine-readable
+
+    scene = SyntheticScene(args.frames, args.width, args.height, args.density, args.triplines)
+    folder = tempfile.mkdtemp(prefix='load_test_')
+    try:
+        with open(scene.write_video(os.path.join(folder, 'scene.avi')), 'rb') as f:
+            video = f.read()
+        base_url, http_server = start_app(folder, scene, args.latency_ms)
+        load_test = LoadTest(base_url, scene, video, poll_s=args.poll_s, timeout_s=args.timeout_s)
+        load_test.run(args.users, args.jobs_per_user, args.ramp_s)
+        http_server.shutdown()
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    results = {
+        'benchmark': 'load_test',
+        'environment': environment(),
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'env')},
+        'settings': settings,
+        **load_test.summary(),
+    }
+    text = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text + '\n')
+
+if __name__ == '__main__':
+    main()
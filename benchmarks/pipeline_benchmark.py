@@ -0,0 +1,134 @@
+'''
+Benchmark of the processing pipeline stages on a synthetic scene, with a deterministic stub model instead of YOLO.
+
+Generates a scene (see benchmarks.synthetic) of the requested length, resolution, object density and tripline
+count, writes its video, then times Tracker.process_video, Counter.count, Counter.analyze_track (every track),
+xlsxWriter.write_to_excel, xlsxCompiler.compile (copies of the report) and Annotator.write_annotated_video
+separately. Each stage is repeated and its median kept. Results are JSON, with the commit and machine, so runs
+of different commits can be compared without a GPU or real footage.
+
+    python -m benchmarks.pipeline_benchmark --frames 900 --width 1280 --height 720 --density 8 --triplines 2 --output before.json
+    python -m benchmarks.pipeline_benchmark --dataset-only --frames 108000 --density 20 # Ground truth tracks, no video
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+from utils import Tracker, Counter, xlsxWriter, xlsxCompiler, Annotator
+from utils.iou_tracker import IoUTracker
+from utils.export import crossing_table
+from benchmarks.synthetic import SyntheticScene, StubModel
+
+STAGES = ['tracking', 'count', 'analyze_track', 'excel', 'compile', 'annotation']
+
+def environment():
+    '''
+    Returns:
+        dict: Commit, Python, platform and CPU count of the run
+    '''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+    return {'commit': commit, 'dirty': dirty, 'python': platform.python_version(), 'platform': platform.platform(),
+            'cpus': os.cpu_count()}
+
+def timed(stages, name, items, function, *args, **kwargs):
+    '''Runs function once, adding its duration and processed items to stages[name].'''
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    stages.setdefault(name, {'runs_s': [], 'items': items})['runs_s'].append(time.perf_counter() - start)
+    return result
+
+def run_once(scene, args, folder, video_path, stages):
+    '''Runs every stage once on a fresh DataManager.'''
+    data_manager = scene.data_manager(video_path)
+    if video_path is None:
+        scene.load_tracks(data_manager)
+    else:
+        data_manager.inference_tracker = IoUTracker.NAME if args.tracker == 'iou' else 'stub' # Stub : ground truth IDs from the model
+        tracker = Tracker(data_manager, model=StubModel(scene, latency_ms=args.latency_ms))
+        timed(stages, 'tracking', scene.frames, tracker.process_video, data_manager)
+
+    counter = Counter(data_manager)
+    timed(stages, 'count', len(data_manager.TRACK_DATA), counter.count, data_manager)
+    tracks = list(data_manager.TRACK_DATA.values())
+    timed(stages, 'analyze_track', len(tracks), lambda: [counter.analyze_track(track) for track in tracks])
+
+    table = crossing_table(data_manager)
+    report_path = os.path.join(folder, 'report.xlsx')
+    if os.path.exists(report_path):
+        os.remove(report_path)
+    timed(stages, 'excel', len(table), xlsxWriter().write_to_excel, report_path, data_manager, table=table)
+
+    report_paths = [report_path]
+    for index in range(1, args.reports):
+        report_paths.append(shutil.copy(report_path, os.path.join(folder, f'report_{index:03d}.xlsx')))
+    compiled_path = os.path.join(folder, 'compiled.xlsx')
+    timed(stages, 'compile', len(table) * args.reports, xlsxCompiler(file_paths=report_paths).compile, compiled_path)
+    for path in report_paths[1:] + [compiled_path]:
+        os.remove(path)
+
+    if video_path is not None and not args.no_annotation:
+        timed(stages, 'annotation', scene.frames, Annotator(data_manager).write_annotated_video, os.path.join(folder, 'annotated.mp4'))
+    return {'tracks': len(data_manager.TRACK_DATA), 'crossings': len(table), 'total_count': sum(Counter.totals(data_manager).values())}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the processing stages on a synthetic scene with a stub model.')
+    parser.add_argument('--frames', type=int, default=900, help='Scene length in frames')
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--density', type=float, default=8, help='Mean number of objects on screen')
+    parser.add_argument('--triplines', type=int, default=1, help='Number of triplines')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tracker', choices=['iou', 'stub'], default='iou', help='IoU tracker on the stub detections, or the stub ground truth IDs')
+    parser.add_argument('--latency-ms', type=float, default=0, help='Simulated inference time per frame')
+    parser.add_argument('--reports', type=int, default=8, help='Copies of the report compiled together')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of each stage, the median is reported')
+    parser.add_argument('--dataset-only', action='store_true', help='Use the ground truth tracks : no video, tracking or annotation')
+    parser.add_argument('--no-annotation', action='store_true', help='Skip the annotated video')
+    parser.add_argument('--output', help='JSON file to write, printed if not set')
+    args = parser.parse_args()
+    logging.disable(logging.INFO) # Keep the output machine-readable
+
+    scene = SyntheticScene(args.frames, args.width, args.height, args.density, args.triplines, args.fps, args.seed)
+    with tempfile.TemporaryDirectory() as folder:
+        start = time.perf_counter()
+        video_path = None if args.dataset_only else scene.write_video(os.path.join(folder, 'scene.avi'))
+        generation_s = time.perf_counter() - start
+
+        stages = {}
+        for _ in range(args.repeat):
+            outputs = run_once(scene, args, folder, video_path, stages)
+
+    for name, stage in stages.items():
+        stage['median_s'] = statistics.median(stage['runs_s'])
+        stage['min_s'] = min(stage['runs_s'])
+        stage['items_per_s'] = stage['items'] / stage['median_s'] if stage['median_s'] else 0.0
+    results = {
+        'benchmark': 'pipeline',
+        'environment': environment(),
+        'parameters': {key: value for key, value in vars(args).items() if key != 'output'},
+        'scene': {'detections': len(scene.detections), 'objects': len(set(scene.detections['id'].tolist())), 'generation_s': generation_s},
+        'outputs': outputs,
+        'stages': {name: stages[name] for name in STAGES if name in stages},
+    }
+    text = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text + '\n')
+
+if __name__ == '__main__':
+    main()
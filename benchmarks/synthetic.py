@@ -0,0 +1,222 @@
+'''
+Synthetic traffic scenes for the benchmarks : ground truth tracks, the matching video, and a deterministic
+stub model standing in for YOLO, so the pipeline can be timed without a GPU, a model or real footage.
+
+Objects (boxes colored by class) cross the frame in straight lines from one edge to the opposite one.
+Each frame carries its number as a binary stripe of 8x8 blocks in its top-left corner, which the stub
+model reads back to return that frame's ground truth boxes.
+'''
+import time
+import datetime
+from types import SimpleNamespace
+from collections import defaultdict
+import cv2
+import numpy as np
+
+from utils import CLASS_COLORS, DataManager
+from utils.frame_index import FrameIndex
+
+CLASS_NAMES = {0: 'car', 1: 'bus', 2: 'truck', 3: 'motorbike', 4: 'bicycle', 5: 'pedestrian'}
+CLASS_WEIGHTS = [0.55, 0.05, 0.1, 0.12, 0.08, 0.1]
+CLASS_SIZES = {0: (60, 40), 1: (140, 60), 2: (120, 60), 3: (30, 20), 4: (30, 20), 5: (16, 30)} # Width and height at 1280x720
+STRIPE_BITS = 24
+STRIPE_BLOCK = 8 # Block side in pixels, JPEG-aligned so the stripe survives MJPG compression
+BACKGROUND = 90
+
+# One ground truth detection
+DETECTION_DTYPE = np.dtype([('frame', np.int64), ('id', np.int64), ('x', np.float32), ('y', np.float32),
+                            ('w', np.float32), ('h', np.float32), ('conf', np.float32), ('cls', np.int32)])
+
+class SyntheticScene:
+    '''
+    Ground truth of a synthetic scene : objects crossing the frame and triplines across their paths.
+    Everything is derived from the seed, so scenes with the same parameters are identical.
+    '''
+    def __init__(self, frames=900, width=1280, height=720, density=8, triplines=1, fps=30, seed=0):
+        '''
+        Args:
+            frames: Length of the scene, in frames
+            width, height: Resolution, at least STRIPE_BITS * STRIPE_BLOCK pixels wide
+            density: Mean number of objects on screen
+            triplines: Number of triplines, alternately vertical (crossed by horizontal traffic) and horizontal
+            fps: Frame rate
+            seed: Random seed
+        '''
+        if width < STRIPE_BITS * STRIPE_BLOCK or height < 2 * STRIPE_BLOCK:
+            raise ValueError(f'Synthetic scenes need at least {STRIPE_BITS * STRIPE_BLOCK}x{2 * STRIPE_BLOCK} pixels.')
+        self.frames, self.width, self.height, self.fps = frames, width, height, fps
+        self.density, self.seed = density, seed
+        self.triplines, self.directions = self.make_triplines(triplines)
+        self.detections = self.make_detections(np.random.default_rng(seed))
+        self.offsets = np.searchsorted(self.detections['frame'], np.arange(frames + 1))
+
+    def make_triplines(self, count):
+        vertical = (count + 1) // 2
+        horizontal = count - vertical
+        triplines = [{'start': {'x': self.width * (i + 1) / (vertical + 1), 'y': 0}, 'end': {'x': self.width * (i + 1) / (vertical + 1), 'y': self.height}}
+                     for i in range(vertical)]
+        triplines += [{'start': {'x': 0, 'y': self.height * (i + 1) / (horizontal + 1)}, 'end': {'x': self.width, 'y': self.height * (i + 1) / (horizontal + 1)}}
+                      for i in range(horizontal)]
+        directions = ['Eastbound', 'Westbound'] if count == 1 else [f'Tripline {i + 1}' for i in range(count)]
+        return triplines, directions
+
+    def make_detections(self, rng):
+        '''
+        Returns:
+            numpy.ndarray: DETECTION_DTYPE records of every object on every frame, sorted by frame then ID
+        '''
+        scale = min(self.width / 1280, self.height / 720)
+        crossing_frames = 4 * self.fps # Mean time on screen
+        objects = rng.poisson(self.density / crossing_frames * (self.frames + crossing_frames)) # Objects already on screen at the start included
+        records = []
+        for object_id in range(1, objects + 1):
+            cls = int(rng.choice(len(CLASS_NAMES), p=CLASS_WEIGHTS))
+            w, h = (size * scale * rng.uniform(0.8, 1.2) for size in CLASS_SIZES[cls])
+            duration = max(2, int(crossing_frames * rng.uniform(0.5, 1.5)))
+            first = int(rng.integers(-crossing_frames, self.frames))
+            t = np.linspace(0, 1, duration)
+            if rng.random() < 0.5: # Horizontal crossing, either way
+                lane = rng.uniform(0.2, 0.8) * self.height
+                x = -w + t * (self.width + 2 * w)
+                x, y = (x if rng.random() < 0.5 else x[::-1]), np.full(duration, lane)
+            else:
+                lane = rng.uniform(0.2, 0.8) * self.width
+                y = -h + t * (self.height + 2 * h)
+                x, y = np.full(duration, lane), (y if rng.random() < 0.5 else y[::-1])
+            frames = first + np.arange(duration)
+            visible = (frames >= 0) & (frames < self.frames) & (x > 0) & (x < self.width) & (y > 0) & (y < self.height)
+            if not visible.any():
+                continue
+            count = int(visible.sum())
+            track = np.empty(count, dtype=DETECTION_DTYPE)
+            track['frame'], track['id'] = frames[visible], object_id
+            track['x'], track['y'], track['w'], track['h'] = x[visible], y[visible], w, h
+            track['conf'] = np.clip(rng.normal(0.75, 0.1, count), 0.3, 0.99)
+            # Some frames are misclassified, as a model would
+            track['cls'] = np.where(rng.random(count) < 0.1, rng.integers(0, len(CLASS_NAMES), count), cls)
+            records.append(track)
+        detections = np.concatenate(records) if records else np.empty(0, dtype=DETECTION_DTYPE)
+        return detections[np.lexsort((detections['id'], detections['frame']))]
+
+    def frame_detections(self, frame_nb):
+        '''
+        Returns:
+            numpy.ndarray: DETECTION_DTYPE records of a frame
+        '''
+        if not 0 <= frame_nb < self.frames:
+            return self.detections[:0]
+        return self.detections[self.offsets[frame_nb]:self.offsets[frame_nb + 1]]
+
+    def render(self, frame_nb):
+        '''
+        Returns:
+            numpy.ndarray: BGR image of a frame, with its number encoded in the top-left stripe
+        '''
+        frame = np.full((self.height, self.width, 3), BACKGROUND, dtype=np.uint8)
+        for record in self.frame_detections(frame_nb):
+            x1, y1 = int(record['x'] - record['w'] / 2), int(record['y'] - record['h'] / 2)
+            x2, y2 = int(record['x'] + record['w'] / 2), int(record['y'] + record['h'] / 2)
+            cv2.rectangle(frame, (x1, y1), (x2, y2), CLASS_COLORS[int(record['cls']) % len(CLASS_COLORS)], -1)
+        bits = (frame_nb >> np.arange(STRIPE_BITS)) & 1
+        stripe = np.repeat(bits * 255, STRIPE_BLOCK).astype(np.uint8)
+        frame[:STRIPE_BLOCK, :STRIPE_BITS * STRIPE_BLOCK] = stripe[None, :, None]
+        return frame
+
+    def write_video(self, path):
+        '''Writes the scene as an MJPG video (the codec OpenCV can always write).'''
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), self.fps, (self.width, self.height))
+        if not writer.isOpened():
+            raise RuntimeError(f'Could not write {path}.')
+        for frame_nb in range(self.frames):
+            writer.write(self.render(frame_nb))
+        writer.release()
+        return path
+
+    def data_manager(self, video_path=None, site_location='benchmark'):
+        '''
+        Returns:
+            DataManager: Configured for this scene (names, triplines, video parameters), without tracking data
+        '''
+        data_manager = DataManager()
+        data_manager.video_path = video_path
+        data_manager.frame_count, data_manager.fps = self.frames, self.fps
+        data_manager.width, data_manager.height = self.width, self.height
+        data_manager.selected_model = 'stub'
+        data_manager.model_type = '.onnx' # No input resizing
+        data_manager.names = dict(CLASS_NAMES)
+        data_manager.triplines = self.triplines
+        data_manager.directions = self.directions
+        data_manager.site_location = site_location
+        data_manager.start_datetime = datetime.datetime(2025, 1, 6, 7, 0)
+        return data_manager
+
+    def load_tracks(self, data_manager):
+        '''Fills the tracking data of a DataManager with the ground truth, as if tracking had been perfect.'''
+        data_manager.TRACK_DATA = defaultdict(list)
+        lengths = np.empty(len(self.detections), dtype=np.int32)
+        boxes = np.stack([self.detections[key] for key in ('x', 'y', 'w', 'h')], axis=1)
+        for index, (frame, track_id, conf, cls) in enumerate(zip(self.detections['frame'].tolist(), self.detections['id'].tolist(),
+                                                                self.detections['conf'].tolist(), self.detections['cls'].tolist())):
+            track = data_manager.TRACK_DATA[track_id]
+            track.append((frame, boxes[index], conf, cls))
+            lengths[index] = len(track)
+        data_manager.TRACK_INFO = FrameIndex.from_detections(self.detections['frame'], self.detections['id'], lengths, self.frames)
+
+def read_frame_number(frame):
+    '''Decodes the frame number of a rendered frame from its stripe.'''
+    blocks = frame[:STRIPE_BLOCK, :STRIPE_BITS * STRIPE_BLOCK].reshape(STRIPE_BLOCK, STRIPE_BITS, STRIPE_BLOCK, -1).mean(axis=(0, 2, 3))
+    return int(((blocks > 127) << np.arange(STRIPE_BITS)).sum())
+
+class StubTensor(np.ndarray):
+    '''NumPy array with the torch.Tensor methods Tracker calls on detection results.'''
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.view(np.ndarray)
+
+    def int(self):
+        return self.astype(np.int64)
+
+class StubBoxes:
+    def __init__(self, records, with_ids):
+        self.xywh = np.stack([records[key] for key in ('x', 'y', 'w', 'h')], axis=1).reshape(-1, 4).view(StubTensor)
+        self.conf = records['conf'].astype(np.float32).view(StubTensor)
+        self.cls = records['cls'].astype(np.float32).view(StubTensor)
+        self.id = records['id'].astype(np.float32).view(StubTensor) if with_ids and len(records) else None
+
+class StubResult:
+    def __init__(self, records, with_ids, speed):
+        self.boxes = StubBoxes(records, with_ids)
+        self.speed = speed
+
+class StubModel:
+    '''
+    Deterministic stand-in for an Ultralytics YOLO model on a SyntheticScene : predict returns the ground truth
+    boxes of the frame (read from its stripe), track also returns the ground truth IDs (a perfect tracker).
+    Both accept a frame or a list of frames (a batch). An optional fixed latency per call simulates the inference cost.
+    '''
+    def __init__(self, scene, latency_ms=0):
+        '''
+        Args:
+            scene: SyntheticScene the frames come from
+            latency_ms: Time each call sleeps, in milliseconds
+        '''
+        self.scene = scene
+        self.latency_s = latency_ms / 1000
+        self.model = SimpleNamespace(names=dict(CLASS_NAMES)) # As YOLO(path).model.names, read by DataManager.set_names
+
+    def detect(self, source, with_ids):
+        if self.latency_s:
+            deadline = time.perf_counter() + self.latency_s
+            while time.perf_counter() < deadline: # Busy wait : a model keeps its core busy, a sleep would not
+                pass
+        frames = source if isinstance(source, list) else [source]
+        speed = {'preprocess': 0.0, 'inference': self.latency_s * 1000 / len(frames), 'postprocess': 0.0}
+        return [StubResult(self.scene.frame_detections(read_frame_number(frame)), with_ids, speed) for frame in frames]
+
+    def predict(self, source, **args):
+        return self.detect(source, with_ids=False)
+
+    def track(self, source, **args):
+        return self.detect(source, with_ids=True)
@@ -0,0 +1,71 @@
+'''
+Benchmark of the inference trackers on the same videos : speed and count agreement.
+
+Each video is tracked and counted once per tracker, then the counts per direction and class
+are compared with those of the first tracker (the reference). Results are printed as JSON.
+
+    python -m benchmarks.tracker_benchmark --model best.onnx --videos site1.mp4 site2.mp4 \
+        --tripline 100 400 1200 400 --trackers bytetrack.yaml iou
+'''
+import json
+import time
+import argparse
+import datetime
+
+from utils import DataManager, Tracker, Counter
+
+def run_tracker(video_path, model_path, inference_tracker, tripline, directions):
+    '''
+    Tracks and counts one video with one tracker.
+
+    Returns:
+        dict: Timings, frames per second and counts per 'direction / class'
+    '''
+    data_manager = DataManager()
+    data_manager.set_video_params(video_path)
+    data_manager.selected_model = model_path
+    data_manager.set_names(model_path)
+    data_manager.inference_tracker = inference_tracker
+    data_manager.triplines = [{'start': {'x': tripline[0], 'y': tripline[1]}, 'end': {'x': tripline[2], 'y': tripline[3]}}]
+    data_manager.directions = directions
+    data_manager.site_location = 'benchmark'
+    data_manager.start_datetime = datetime.datetime(2025, 1, 1)
+
+    start = time.perf_counter()
+    Tracker(data_manager).process_video(data_manager)
+    tracking_s = time.perf_counter() - start
+    start = time.perf_counter()
+    Counter(data_manager).count(data_manager)
+    counting_s = time.perf_counter() - start
+
+    counts = Counter.totals(data_manager)
+    return {
+        'tracker': inference_tracker,
+        'tracking_s': tracking_s,
+        'counting_s': counting_s,
+        'frames_per_s': data_manager.frame_count / tracking_s,
+        'tracks': len(data_manager.TRACK_DATA),
+        'total_count': sum(counts.values()),
+        'counts': counts,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare inference trackers on the same videos.')
+    parser.add_argument('--model', required=True, help='Detection model (.pt, .onnx or OpenVINO folder)')
+    parser.add_argument('--videos', nargs='+', required=True, help='Videos to process')
+    parser.add_argument('--tripline', type=float, nargs=4, required=True, metavar=('X1', 'Y1', 'X2', 'Y2'), help='Tripline in pixels')
+    parser.add_argument('--directions', nargs=2, default=['Direction 1', 'Direction 2'], help='Names of both crossing directions')
+    parser.add_argument('--trackers', nargs='+', default=['bytetrack.yaml', 'iou'], help='Trackers to compare, the first one is the reference')
+    args = parser.parse_args()
+
+    results = []
+    for video_path in args.videos:
+        runs = [run_tracker(video_path, args.model, tracker, args.tripline, args.directions) for tracker in args.trackers]
+        for run in runs:
+            run['speedup'] = run['frames_per_s'] / runs[0]['frames_per_s']
+            run['count_agreement'] = Counter.agreement(run['counts'], runs[0]['counts'])
+        results.append({'video': video_path, 'reference': args.trackers[0], 'runs': runs})
+    print(json.dumps(results, indent=4))
+
+if __name__ == '__main__':
+    main()
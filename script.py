@@ -3,17 +3,25 @@ This file is independant of the project, it is a version of app.py without GUI
 '''
 
 import os
+import re
+import time
+import argparse
 import threading
 import datetime
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from shutil import copy2, copytree
 import subprocess
 import onnxruntime as ort
 
 import json
+import yaml
+import torch
 from cv2 import VideoCapture, imread, imwrite
 
-from utils import DataManager, Counter, Tracker, xlsxWriter, xlsxCompiler, Annotator
+from utils import DataManager, Counter, Tracker, xlsxWriter, xlsxCompiler, Annotator, ColumnarWriter, SamplingProfiler
+from utils.export import crossing_table
 import cv2
 
 def setup_logging():
@@ -71,6 +79,15 @@ def pre_process(paths, video_path, model_path):
     return video_path, model_path, report_path, frame_path
 
 def process_video_task(data_manager, paths):
+    '''
+    Tracks, counts and exports one video.
+
+    Raises:
+        Exception: Any error of the processing, after it is logged
+    '''
+    sampling_profiler = SamplingProfiler() if data_manager.do_profile else None
+    if sampling_profiler is not None:
+        sampling_profiler.start()
     try:
 
         # Initialize Tracker and Counter for multiple triplines
@@ -84,8 +101,12 @@ def process_video_task(data_manager, paths):
         counter.count(data_manager)
 
         # Export results
+        table = crossing_table(data_manager) # Shared by the Excel and columnar exports
         writer = xlsxWriter()
-        writer.write_to_excel(paths['report_path'], data_manager)
+        writer.write_to_excel(paths['report_path'], data_manager, table=table)
+        if data_manager.export_formats:
+            columnar_writer = ColumnarWriter(formats=data_manager.export_formats)
+            columnar_writer.write(os.path.join(paths['content_dir'], 'crossings'), data_manager, include_tracks=data_manager.do_tracks_export, table=table)
 
         # Perform annotation if export_video is True
         if data_manager.do_video_export:
@@ -100,6 +121,12 @@ def process_video_task(data_manager, paths):
 
     except Exception as e:
         logger.error(f'Error processing video: {str(e)}', exc_info=True)
+        raise
+    finally:
+        if sampling_profiler is not None:
+            sampling_profiler.stop()
+            for path in sampling_profiler.save(paths['content_dir']):
+                logger.info(f'Sampling profile saved to {path}')
 
 def draw_triplines(first_frame_path):
     triplines = []
@@ -171,7 +198,12 @@ def log_setup(data_manager, paths):
     'site_location': data_manager.site_location,
     'inference_tracker': data_manager.inference_tracker,
     'do_video_export': data_manager.do_video_export,
-    'start_datetime': data_manager.start_datetime.isoformat()
+    'export_formats': data_manager.export_formats,
+    'do_tracks_export': data_manager.do_tracks_export,
+    'start_datetime': data_manager.start_datetime.isoformat(),
+    'time_windows': data_manager.time_windows,
+    'ffmpeg_decoder': data_manager.ffmpeg_decoder,
+    'do_profile': data_manager.do_profile
 }
 
     setup_file_path = os.path.join(paths['content_dir'], 'setup_data.json')
@@ -180,15 +212,53 @@ def log_setup(data_manager, paths):
 
     logger.info(f'Setup data logged to {setup_file_path}')
 
-def run(params):
-    video_path = params['video_path']
-    model_path = params['model_path']
+def build_data_manager(params, video_path, model_path, triplines, directions):
+    '''
+    Configures a DataManager from the run parameters (see run).
+
+    Args:
+        params: Run parameters
+        video_path, model_path: Video and model to process
+        triplines: List of {'start': {'x', 'y'}, 'end': {'x', 'y'}} in video pixels
+        directions: Both directions of a single tripline, or one direction per tripline
+
+    Returns:
+        DataManager: Ready for process_video_task
+    '''
     site_location = params['site_location']
-    inference_tracker = params['inference_tracker'] # 2 are supported : `bytetrack.yaml` & `botsort.yaml` (BoT-SORT is slower)
+    inference_tracker = params['inference_tracker'] # 3 are supported : `bytetrack.yaml`, `botsort.yaml` (BoT-SORT is slower) & `iou` (lightweight, CPU)
     export_video = params['export_video']
     start_date = params['start_date'] # 'YYYY-MM-DD'
     start_time = params['start_time'] # 'HH:MM'
     ffmpeg_executable_path = params['ffmpeg_executable_path']
+    export_formats = params.get('export_formats', []) # Optional columnar exports : 'parquet' and/or 'csv'
+    export_tracks = params.get('export_tracks', False) # Include raw per-detection tracks in the columnar exports
+    time_windows = params.get('time_windows') # Optional periods to process, e.g. '07:00-09:00, 16:00-19:00'
+    ffmpeg_decode = params.get('ffmpeg_decode', False) # Decode and pre-scale frames with ffmpeg instead of OpenCV (faster on 4K sources)
+    profile = params.get('profile', False) # Save a sampling profile of the job (flame graph stacks) in the content directory
+
+    data_manager = DataManager()
+    data_manager.video_path = video_path
+    data_manager.set_video_params(data_manager.video_path) # Set the video parameters (fps, width, height)
+    data_manager.selected_model = model_path
+    data_manager.set_names(data_manager.selected_model) # Extract the names of the detection classes
+    data_manager.triplines = triplines
+    data_manager.directions = directions
+    data_manager.site_location = site_location
+    data_manager.inference_tracker = inference_tracker
+    data_manager.do_video_export = export_video
+    data_manager.export_formats = export_formats
+    data_manager.do_tracks_export = export_tracks
+    data_manager.set_start_datetime(start_date, start_time)
+    data_manager.set_time_windows(time_windows)
+    data_manager.ffmpeg_decoder = ffmpeg_executable_path if ffmpeg_decode else None
+    data_manager.do_profile = profile
+    return data_manager
+
+def run(params):
+    video_path = params['video_path']
+    model_path = params['model_path']
+    ffmpeg_executable_path = params['ffmpeg_executable_path']
 
     global logger
     logger = setup_logging()
@@ -211,17 +281,7 @@ def run(params):
             prompt = f'Enter the direction for tripline {count} : {tripline} >'
             directions.append(input(prompt))
     
-    data_manager = DataManager()
-    data_manager.video_path = paths['video_path']
-    data_manager.set_video_params(data_manager.video_path) # Set the video parameters (fps, width, height)
-    data_manager.selected_model = paths['model_path']
-    data_manager.set_names(data_manager.selected_model) # Extract the names of the detection classes
-    data_manager.triplines = triplines
-    data_manager.directions = directions
-    data_manager.site_location = site_location
-    data_manager.inference_tracker = inference_tracker
-    data_manager.do_video_export = export_video
-    data_manager.set_start_datetime(start_date, start_time)
+    data_manager = build_data_manager(params, paths['video_path'], paths['model_path'], triplines, directions)
 
     log_setup(data_manager, paths=paths)
 
@@ -230,27 +290,176 @@ def run(params):
     compiler = xlsxCompiler(file_paths=[paths['report_path']])
     compiler.compile(output_path=os.path.join(paths['content_dir'],'totals.xlsx'))
 
+BATCH_REQUIRED = ['video_path', 'model_path', 'site_location', 'start_date', 'start_time', 'triplines', 'directions']
+BATCH_DEFAULTS = {'inference_tracker': 'bytetrack.yaml', 'export_video': False, 'ffmpeg_executable_path': 'ffmpeg'}
+CPU_THREADS_PER_JOB = 4 # Cores per video processed in parallel on CPU
+
+def load_manifest(manifest_path):
+    '''
+    Reads a batch manifest (.json, .yaml or .yml) : a list of videos, or a dict with 'videos' and optional
+    'defaults' (parameters shared by all videos), 'output_dir' and 'compiled_report'. Each video has the
+    parameters of run, plus its triplines ([x1, y1, x2, y2] or {'start': {'x', 'y'}, 'end': {'x', 'y'}}) and
+    directions (both directions of a single tripline, or one per tripline).
+
+    Returns:
+        tuple: (list of video parameters, dict of manifest options)
+
+    Raises:
+        ValueError: If a video misses a required parameter, or its video or model file does not exist
+    '''
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f) if manifest_path.lower().endswith('.json') else yaml.safe_load(f)
+    if isinstance(manifest, list):
+        manifest = {'videos': manifest}
+
+    entries = []
+    for index, video in enumerate(manifest.get('videos') or []):
+        params = {**BATCH_DEFAULTS, **(manifest.get('defaults') or {}), **video}
+        missing = [key for key in BATCH_REQUIRED if key not in params]
+        if missing:
+            raise ValueError(f'Video {index} of {manifest_path} misses {', '.join(missing)}.')
+        for key in ('video_path', 'model_path'): # Checked before the batch starts rather than failing during the night
+            if not os.path.exists(params[key]):
+                raise ValueError(f'Video {index} of {manifest_path} : {key} {params[key]} not found.')
+        # YAML reads unquoted dates as dates and unquoted HH:MM as minutes (base 60)
+        if isinstance(params['start_date'], (datetime.date, datetime.datetime)):
+            params['start_date'] = params['start_date'].strftime('%Y-%m-%d')
+        if isinstance(params['start_time'], int):
+            params['start_time'] = f'{params['start_time'] // 60:02d}:{params['start_time'] % 60:02d}'
+        params['triplines'] = [tripline if isinstance(tripline, dict) else {'start': {'x': tripline[0], 'y': tripline[1]}, 'end': {'x': tripline[2], 'y': tripline[3]}}
+                               for tripline in params['triplines']]
+        params['directions'] = list(params['directions'].values()) if isinstance(params['directions'], dict) else list(params['directions'])
+        entries.append(params)
+    return entries, {key: value for key, value in manifest.items() if key not in ('videos', 'defaults')}
+
+def batch_slots(workers=None, devices=None):
+    '''
+    Devices of the batch worker processes, one video at a time per worker.
+
+    Args:
+        workers: Number of workers (default : one per device, or one per CPU_THREADS_PER_JOB cores without GPU)
+        devices: Devices to cycle through : GPU indexes and/or 'cpu' (default : every GPU, else the CPU)
+
+    Returns:
+        list: Device of each worker, GPU index or 'cpu'
+    '''
+    if not devices:
+        devices = list(range(torch.cuda.device_count())) if torch.cuda.is_available() else ['cpu']
+        if workers is None and devices == ['cpu']:
+            workers = max(1, (os.cpu_count() or 1) // CPU_THREADS_PER_JOB)
+    devices = [int(device) if str(device).isdigit() else str(device).lower() for device in devices]
+    return [devices[index % len(devices)] for index in range(workers or len(devices))]
+
+def init_batch_worker(slots, cpu_threads):
+    '''Takes the device of a new worker process, CPU workers share the cores evenly.'''
+    global logger, device
+    logger = setup_logging()
+    device = slots.get()
+    if device == 'cpu':
+        torch.set_num_threads(cpu_threads)
+
+def run_batch_entry(params, content_dir):
+    '''
+    Processes one video of a batch, in a worker process, with the device of the worker.
+
+    Returns:
+        dict: Video, site, device, status, report path, error and duration
+    '''
+    start = time.perf_counter()
+    os.makedirs(content_dir, exist_ok=True)
+    paths = {'content_dir': content_dir, 'ffmpeg_path': params['ffmpeg_executable_path'], 'report_path': os.path.join(content_dir, 'report.xlsx')}
+    data_manager = build_data_manager(params, params['video_path'], params['model_path'], params['triplines'], params['directions'])
+    data_manager.device_name = device
+    log_setup(data_manager, paths=paths)
+    try:
+        process_video_task(data_manager, paths)
+        error = None
+    except Exception as e: # Logged by process_video_task, the other videos go on
+        error = f'{type(e).__name__}: {str(e)}'
+    return {'video_path': params['video_path'], 'site_location': params['site_location'], 'device': device, 'content_dir': content_dir,
+            'status': 'error' if error else 'success', 'report_path': None if error else paths['report_path'], 'error': error,
+            'duration_s': time.perf_counter() - start}
+
+def run_batch(manifest_path, workers=None, devices=None):
+    '''
+    Processes every video of a manifest (see load_manifest) without any interaction, in parallel worker processes,
+    then compiles their reports into one. Each video gets its own folder in the batch output folder, with
+    batch_summary.json listing the outcome of every video.
+
+    Args:
+        manifest_path: Manifest file
+        workers, devices: Worker processes and their devices (see batch_slots)
+
+    Returns:
+        str: Path of the compiled report, None if no video was processed
+    '''
+    global logger
+    logger = setup_logging()
+    entries, options = load_manifest(manifest_path)
+    batch_dir = options.get('output_dir') or os.path.join('pure_python_runs', f'batch_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}')
+    os.makedirs(batch_dir, exist_ok=True)
+
+    slots = batch_slots(workers, devices)
+    cpu_threads = max(1, (os.cpu_count() or 1) // slots.count('cpu')) if 'cpu' in slots else 1
+    # Workers are spawned : batch_slots initialized CUDA in this process, a forked child could not use it
+    context = multiprocessing.get_context('spawn')
+    slot_queue = context.Queue()
+    for slot in slots:
+        slot_queue.put(slot)
+    logger.info(f'Processing {len(entries)} videos with {len(slots)} workers on {', '.join(map(str, slots))}.')
+
+    results = [None] * len(entries)
+    with ProcessPoolExecutor(max_workers=len(slots), mp_context=context, initializer=init_batch_worker, initargs=(slot_queue, cpu_threads)) as executor:
+        futures = {executor.submit(run_batch_entry, params, os.path.join(batch_dir, f'{index:03d}_{re.sub(r'[^\w-]+', '_', str(params['site_location']))}')): index
+                   for index, params in enumerate(entries)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                logger.error(f'Error processing {entries[index]['video_path']}: {str(e)}', exc_info=True)
+                results[index] = {'video_path': entries[index]['video_path'], 'site_location': entries[index]['site_location'], 'status': 'error', 'error': str(e)}
+            logger.info(f'{sum(result is not None for result in results)}/{len(entries)} videos done : {entries[index]['video_path']} ({results[index]['status']})')
+
+    reports = [result['report_path'] for result in results if result['status'] == 'success']
+    compiled_path = None
+    if reports:
+        compiled_path = os.path.join(batch_dir, options.get('compiled_report', 'totals.xlsx'))
+        xlsxCompiler(file_paths=reports).compile(output_path=compiled_path)
+        logger.info(f'{len(reports)} reports compiled to {compiled_path}')
+    with open(os.path.join(batch_dir, 'batch_summary.json'), 'w') as f:
+        json.dump({'manifest': manifest_path, 'workers': [str(slot) for slot in slots], 'compiled_report': compiled_path, 'videos': results}, f, indent=4)
+    return compiled_path
+
 if __name__ == '__main__':
-    params = {}
-
-    if False :
-        params['video_path'] = input(r'\path\to\your\vid>').strip().strip("'").strip('"')
-        params['model_path'] = input(r'\path\to\your\model>').strip().strip("'").strip('"')
-        params['site_location'] = input('Name of Location >').strip().strip("'").strip('"')
-        params['inference_tracker'] = input('Tracker (2 are supported : `bytetrack.yaml` & `botsort.yaml` (BoT-SORT is slower)) >').strip().strip("'").strip('"')
-        params['export_video'] = input('Do video export (True/False) >').strip().strip("'").strip('"').lower() == 'true'
-        params['start_date'] = input("Date # 'YYYY-MM-DD' >") .strip().strip("'").strip('"')
-        params['start_time'] = input("Time # 'HH:MM' >").strip().strip("'").strip('"')
-        params['ffmpeg_executable_path'] = input('FFmpeg executable path >').strip().strip("'").strip('"')
-    else :
-        params['video_path'] = r'C:\Users\adufour\SystraGroup\SIN Chee Keong - AI Training Video Set\Malaysia\MY1-short.mp4'
-        params['model_path'] = r'C:\Users\adufour\Downloads\models-20250210T083112Z-001\models\trained_model_n_nounknown\weights\best.onnx'
-        params['site_location'] = 'MY1_n_nounknown'
-        params['inference_tracker'] = 'bytetrack.yaml'
-        params['export_video'] = True
-        params['start_date'] = '2025-02-12'
-        params['start_time'] = '15:02'
-        params['ffmpeg_executable_path'] = r'C:\ffmpeg\bin\ffmpeg.exe'
-
-    run(params)
+    parser = argparse.ArgumentParser(description='Traffic counting without the web app.')
+    parser.add_argument('--manifest', help='Batch manifest (.json or .yaml) : process its videos headless and compile their reports')
+    parser.add_argument('--workers', type=int, help='Videos processed in parallel (default : one per GPU, or one per 4 cores)')
+    parser.add_argument('--devices', nargs='+', help="Devices of the workers : GPU indexes and/or 'cpu', e.g. 0 1 cpu")
+    args = parser.parse_args()
+    if args.manifest:
+        run_batch(args.manifest, workers=args.workers, devices=args.devices)
+    else:
+        params = {}
+
+        if False :
+            params['video_path'] = input(r'\path\to\your\vid>').strip().strip("'").strip('"')
+            params['model_path'] = input(r'\path\to\your\model>').strip().strip("'").strip('"')
+            params['site_location'] = input('Name of Location >').strip().strip("'").strip('"')
+            params['inference_tracker'] = input('Tracker (3 are supported : `bytetrack.yaml`, `botsort.yaml` (BoT-SORT is slower) & `iou` (lightweight, CPU)) >').strip().strip("'").strip('"')
+            params['export_video'] = input('Do video export (True/False) >').strip().strip("'").strip('"').lower() == 'true'
+            params['start_date'] = input("Date # 'YYYY-MM-DD' >") .strip().strip("'").strip('"')
+            params['start_time'] = input("Time # 'HH:MM' >").strip().strip("'").strip('"')
+            params['ffmpeg_executable_path'] = input('FFmpeg executable path >').strip().strip("'").strip('"')
+        else :
+            params['video_path'] = r'C:\Users\adufour\SystraGroup\SIN Chee Keong - AI Training Video Set\Malaysia\MY1-short.mp4'
+            params['model_path'] = r'C:\Users\adufour\Downloads\models-20250210T083112Z-001\models\trained_model_n_nounknown\weights\best.onnx'
+            params['site_location'] = 'MY1_n_nounknown'
+            params['inference_tracker'] = 'bytetrack.yaml'
+            params['export_video'] = True
+            params['start_date'] = '2025-02-12'
+            params['start_time'] = '15:02'
+            params['ffmpeg_executable_path'] = r'C:\ffmpeg\bin\ffmpeg.exe'
+
+        run(params)
     
\ No newline at end of file
@@ -0,0 +1,64 @@
+// Submits the compile form as a background job, then polls its progress until the download link is available
+document.getElementById('compileForm').addEventListener('submit', function (event) {
+    event.preventDefault();
+    const form = this;
+    const submitBtn = document.getElementById('compileBtn');
+    const progressBar = document.getElementById('progressBarCompile');
+    const result = document.getElementById('compileResult');
+
+    submitBtn.disabled = true;
+    progressBar.style.width = '0%';
+    progressBar.innerText = 'Compile: 0%';
+    progressBar.className = 'progress-bar progress-bar-striped progress-bar-animated';
+    document.getElementById('compileCard').style.display = 'block';
+    result.innerText = 'Uploading files...';
+
+    fetch(form.action, {
+        method: 'POST',
+        body: new FormData(form),
+    })
+        .then(response => response.json())
+        .then(data => {
+            if (data.status !== 'Compilation started') {
+                throw new Error(data.message);
+            }
+            const session_id = data.session_id;
+            result.innerText = `Compiling... Session ID : ${session_id}`;
+
+            const progressInterval = setInterval(() => {
+                fetch(`/progress?session_id=${session_id}`)
+                    .then(response => response.json())
+                    .then(progressData => {
+                        if (progressData.Compile >= 0 && progressData.Compile <= 100) {
+                            progressBar.style.width = progressData.Compile + '%';
+                            progressBar.innerText = 'Compile: ' + progressData.Compile + '%';
+                        }
+                        if (progressData.Compile === 100 || progressData.Compile === -1) {
+                            clearInterval(progressInterval);
+                            submitBtn.disabled = false;
+                            fetch(`/results?session_id=${session_id}`)
+                                .then(response => response.json())
+                                .then(resultData => {
+                                    if (resultData.error) {
+                                        progressBar.className = 'progress-bar bg-danger';
+                                        result.innerText = `An unexpected error occured: ${resultData.error} (Session ID : ${session_id})`;
+                                    } else {
+                                        progressBar.className = 'progress-bar bg-success';
+                                        result.innerHTML = `Compilation complete (Session ID : ${session_id}) <br>
+                                            <a href="${resultData.download_url}" class="btn btn-success mt-2">Download ${resultData.output_filename}</a>`;
+                                    }
+                                });
+                        }
+                    })
+                    .catch(error => {
+                        clearInterval(progressInterval);
+                        submitBtn.disabled = false;
+                        result.innerText = `An unexpected error occured: ${error}`;
+                    });
+            }, 1000); // Poll every second
+        })
+        .catch(error => {
+            submitBtn.disabled = false;
+            result.innerText = `An unexpected error occured: ${error.message}`;
+        });
+});
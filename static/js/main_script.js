@@ -363,6 +363,13 @@ document.getElementById('saveAndSubmitBtn').addEventListener('click', () => {
                                             else {
                                                 downloadLinks.push(' <a href="#" class="btn btn-secondary m-2 disabled">No video output</a>');
                                             }
+
+                                            // Add columnar table download links if the export was enabled
+                                            if (document.getElementById('exportColumnar').checked) {
+                                                ['parquet', 'csv'].forEach(format => {
+                                                    downloadLinks.push(`<a href="/download/${session_id}/${data.paths.columnar_base_path}.${format}" class="btn btn-success m-2">Download Crossings (${format})</a>`);
+                                                });
+                                            }
                                             document.getElementById('downloadLinks').innerHTML = downloadLinks.join('');
                                         }
                                         // Check for errors
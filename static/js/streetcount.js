@@ -5,8 +5,6 @@ document.getElementById('filePaths').addEventListener('change', function() {
     for (let i = 0; i < files.length; i++) {
         fileNames.push(files[i].name);
     }
-    document.getElementById('fileInput').innerHTML = `
-        <label for='filePaths' class='form-label'>Selected Files</label>
-        <input type='text' class='form-control' id='filePaths' name='filePaths' value='${fileNames.join(', ')}' readonly>
-    `;
-});
\ No newline at end of file
+    // Keep the file input in place so the selected files are still submitted
+    document.getElementById('selectedFiles').innerText = fileNames.join(', ');
+});
@@ -1,4 +1,4 @@
-import cv2
+import importlib
 
 # Width for console progress bars
 DESC_WIDTH = 25
@@ -55,19 +55,38 @@ class DETECTION_MODEL_CONST():
 # Initialize detection constants
 DETECTION_MODEL_CONST = DETECTION_MODEL_CONST()
 
-from .session import SessionManager
-from .data import DataManager
-from .tracking import Counter, Tracker
-from .export.xlsx import xlsxWriter, xlsxCompiler, StreetCountCompiler
-from .export.video import Annotator
+# Public classes, imported on first access : light modules (e.g. the compile workers) can import
+# utils without loading the detection and video libraries (torch, ultralytics, cv2)
+_EXPORTS = {
+    'SessionManager': '.session',
+    'SessionLog': '.logs',
+    'JobManager': '.jobs',
+    'StageProfiler': '.profiling',
+    'MetricsRegistry': '.profiling',
+    'SamplingProfiler': '.profiling',
+    'CpuBudget': '.budget',
+    'Checkpoint': '.checkpoint',
+    'DetectionLog': '.detection_log',
+    'DataManager': '.data',
+    'Counter': '.tracking',
+    'Tracker': '.tracking',
+    'BackendTuner': '.autotune',
+    'InferenceServer': '.inference',
+    'ModelQuantizer': '.quantize',
+    'xlsxWriter': '.export.xlsx',
+    'xlsxCompiler': '.export.xlsx',
+    'StreetCountCompiler': '.export.xlsx',
+    'Annotator': '.export.video',
+    'ColumnarWriter': '.export.columnar',
+    'CompileCache': '.export.cache',
+    'CountCube': '.export.cube',
+}
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
-__all__ = [
-    'SessionManager',
-    'DataManager',
-    'Counter',
-    'Tracker',
-    'xlsxWriter',
-    'xlsxCompiler',
-    'StreetCountCompiler',
-    'Annotator',
-]
\ No newline at end of file
+__all__ = list(_EXPORTS)
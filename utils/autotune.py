@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+import importlib.util
+import cv2
+import numpy as np
+import torch
+from ultralytics import YOLO
+from utils import DETECTION_MODEL_CONST
+from utils.iou_tracker import IoUTracker
+from utils.reuse import file_digest
+
+class BackendTuner:
+    '''
+    Benchmarks a detection model on a sample clip across runtimes, image sizes and thread counts,
+    and remembers the fastest configuration for later jobs with the same model.
+
+    A .pt model is also exported to the other runtimes installed (ONNX Runtime, OpenVINO), at each image size.
+    Smaller image sizes are faster but may miss objects : a configuration is only eligible if its detections
+    agree with those of the reference run (the model as uploaded, at 640) on at least min_agreement of the boxes.
+    Configurations are stored per model content hash, so re-uploading the same model reuses them.
+    '''
+    EXPORTS = {'onnx': 'onnxruntime', 'openvino': 'openvino'} # Export format -> package needed to run it
+    REFERENCE_SIZE = 640
+
+    def __init__(self, store_path, export_dir, device=''):
+        '''
+        Args:
+            store_path: JSON file of the tuned configurations (created if missing)
+            export_dir: Folder receiving the exported model variants
+            device: Inference device, as for Tracker
+        '''
+        self.store_path = store_path
+        self.export_dir = export_dir
+        self.device = device
+        self.lock = threading.Lock()
+
+    def load_store(self):
+        try:
+            with open(self.store_path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def get(self, model_path):
+        '''
+        Returns:
+            dict: Tuned configuration of the model (model_path, runtime, imgsz, threads, ...), or None if not tuned
+        '''
+        config = self.load_store().get(file_digest(model_path))
+        if config and not os.path.exists(config['model_path']):
+            logging.warning(f'Tuned model variant {config['model_path']} is missing, using the uploaded model.')
+            return None
+        return config
+
+    def save(self, model_path, config):
+        with self.lock:
+            store = self.load_store()
+            store[file_digest(model_path)] = config
+            os.makedirs(os.path.dirname(os.path.abspath(self.store_path)), exist_ok=True)
+            tmp_path = f'{self.store_path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(store, f, indent=4)
+            os.replace(tmp_path, self.store_path)
+
+    @staticmethod
+    def read_clip(clip_path, max_frames=150, max_size=None):
+        '''
+        Returns:
+            list: First max_frames frames of the clip, downscaled as they are read so their longest side is at most
+            max_size (models letterbox them to at most that size anyway), rather than kept at full resolution
+        '''
+        cap = cv2.VideoCapture(clip_path)
+        frames = []
+        while len(frames) < max_frames:
+            success, frame = cap.read()
+            if not success:
+                break
+            scale = max_size / max(frame.shape[:2]) if max_size else 1
+            if scale < 1:
+                frame = cv2.resize(frame, (round(frame.shape[1] * scale), round(frame.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+            frames.append(frame)
+        cap.release()
+        if not frames:
+            raise ValueError(f'Could not read frames from {clip_path}.')
+        return frames
+
+    def variants(self, model_path, image_sizes):
+        '''
+        Yields the (runtime, model path, image size) combinations to benchmark.
+        Only .pt models support other image sizes and exports, other formats run as uploaded.
+        '''
+        runtime = 'pt' if model_path.endswith('.pt') else 'openvino' if os.path.isdir(model_path) else 'onnx'
+        if runtime != 'pt':
+            yield runtime, model_path, self.REFERENCE_SIZE
+            return
+        for imgsz in image_sizes:
+            yield 'pt', model_path, imgsz
+        for export_format, package in self.EXPORTS.items():
+            if importlib.util.find_spec(package) is None:
+                logging.info(f'{package} is not installed, {export_format} runtime skipped.')
+                continue
+            for imgsz in image_sizes:
+                try:
+                    yield export_format, self.export(model_path, export_format, imgsz), imgsz
+                except Exception as e:
+                    logging.warning(f'Could not export {model_path} to {export_format} at {imgsz}: {str(e)}')
+
+    def export(self, model_path, export_format, imgsz):
+        '''Exports a .pt model once per format and image size, into export_dir.'''
+        stem = os.path.splitext(os.path.basename(model_path))[0]
+        target = os.path.join(self.export_dir, file_digest(model_path)[:16], f'{stem}_{imgsz}' + ('.onnx' if export_format == 'onnx' else '_openvino_model'))
+        if not os.path.exists(target):
+            exported = YOLO(model_path, task='detect').export(format=export_format, imgsz=imgsz)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(exported, target)
+        return target
+
+    def measure(self, model_path, frames, imgsz, threads=None, warmup=5):
+        '''
+        Times detection on the clip frames.
+
+        Returns:
+            tuple: (dict of frames_per_s and latency percentiles in ms, list of xywh detections per frame)
+        '''
+        previous_threads = torch.get_num_threads()
+        if threads:
+            torch.set_num_threads(threads)
+        try:
+            model = YOLO(model_path, task='detect')
+            args = dict(imgsz=imgsz, verbose=False, save=False, device=self.device, conf=DETECTION_MODEL_CONST.CONF_THRESHOLD,
+                        iou=DETECTION_MODEL_CONST.IOU_THRESHOLD, agnostic_nms=DETECTION_MODEL_CONST.AGNOSTIC_NMS)
+            for frame in frames[:warmup]:
+                model.predict(frame, **args)
+            latencies, detections = [], []
+            for frame in frames:
+                start = time.perf_counter()
+                boxes = model.predict(frame, **args)[0].boxes
+                latencies.append(time.perf_counter() - start)
+                detections.append(boxes.xywh.cpu().numpy())
+        finally:
+            torch.set_num_threads(previous_threads)
+        latencies = np.asarray(latencies) * 1000
+        return {'frames_per_s': float(len(frames) / (latencies.sum() / 1000)),
+                'latency_p50_ms': float(np.percentile(latencies, 50)),
+                'latency_p95_ms': float(np.percentile(latencies, 95))}, detections
+
+    @staticmethod
+    def agreement(detections, reference, iou_threshold=0.5):
+        '''Share of the reference boxes matched (IoU >= iou_threshold) by the detections of the same frames.'''
+        matched = total = 0
+        for boxes, reference_boxes in zip(detections, reference):
+            total += len(reference_boxes)
+            if len(boxes) and len(reference_boxes):
+                iou = IoUTracker.iou(np.asarray(reference_boxes), np.asarray(boxes))
+                matched += len(IoUTracker.greedy_match(iou, iou >= iou_threshold)[0])
+        return matched / total if total else 1.0
+
+    def tune(self, model_path, clip_path, image_sizes=(640, 480, 320), thread_counts=None, min_agreement=0.9, progress_callback=None):
+        '''
+        Benchmarks every configuration, saves and returns the fastest eligible one.
+
+        Args:
+            model_path: Uploaded model (.pt, .onnx or OpenVINO folder)
+            clip_path: Sample video of the typical footage
+            image_sizes: Image sizes to try (.pt models only)
+            thread_counts: PyTorch thread counts to try (.pt runtime only), defaults to 1, half and all CPUs
+            min_agreement: Minimum detection agreement with the reference run
+            progress_callback: Optional callback function to report progress
+
+        Returns:
+            dict: Best configuration, with the results of every run under 'runs'
+        '''
+        cpus = os.cpu_count() or 1
+        thread_counts = sorted(set(thread_counts or [1, max(1, cpus // 2), cpus]))
+        image_sizes = [self.REFERENCE_SIZE] + sorted(set(image_sizes) - {self.REFERENCE_SIZE}, reverse=True)
+        frames = self.read_clip(clip_path, max_size=max(image_sizes))
+        variants = list(self.variants(model_path, image_sizes))
+        runs_total = sum(len(thread_counts) if runtime == 'pt' else 1 for runtime, _, _ in variants)
+
+        runs, reference = [], None
+        for runtime, variant_path, imgsz in variants:
+            for threads in (thread_counts if runtime == 'pt' else [None]):
+                timings, detections = self.measure(variant_path, frames, imgsz, threads)
+                if reference is None: # The first run is the uploaded model at the reference size
+                    reference = detections
+                runs.append({'runtime': runtime, 'model_path': variant_path, 'imgsz': imgsz, 'threads': threads,
+                             **timings, 'agreement': self.agreement(detections, reference)})
+                logging.info(f'Autotune {runtime} imgsz={imgsz} threads={threads}: {timings['frames_per_s']:.1f} frames/s, agreement {runs[-1]['agreement']:.3f}')
+                if progress_callback:
+                    progress_callback(int(len(runs) / runs_total * 100))
+
+        eligible = [run for run in runs if run['agreement'] >= min_agreement]
+        best = dict(max(eligible, key=lambda run: run['frames_per_s']))
+        best['runs'] = runs
+        best['clip_frames'] = len(frames)
+        self.save(model_path, best)
+        return best
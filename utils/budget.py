@@ -0,0 +1,100 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+class CpuLease:
+    '''
+    Share of the CPU cores of one running job, updated by its CpuBudget when jobs start or finish.
+    The job polls generation to notice a new share, and counts its frames so throughput can be measured.
+    '''
+    def __init__(self, budget, job_id):
+        self.budget = budget
+        self.job_id = job_id
+        self.threads = 1
+        self.generation = 0
+        self.frames = 0 # Only written by the job thread
+
+    def release(self):
+        self.budget.release(self.job_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+class CpuBudget:
+    '''
+    Splits the CPU cores between the inference of concurrent jobs.
+
+    Left to their defaults, PyTorch intra-op threads, OpenVINO streams and ONNX Runtime threads of every job
+    each try to use all cores : with several jobs the CPU is oversubscribed and total throughput drops below
+    that of a single job. Each job instead acquires a lease whose thread count is its share of the cores,
+    recomputed whenever a job starts or finishes. The aggregate throughput of the jobs (frames/s) is measured
+    between two rebalances, so each event reports the throughput before and after it.
+    '''
+    def __init__(self, cpus=None, max_events=100):
+        '''
+        Args:
+            cpus: Number of cores to share (defaults to all CPUs)
+            max_events: Number of rebalance events kept for status
+        '''
+        self.cpus = max(1, cpus or os.cpu_count() or 1)
+        self.leases = {}
+        self.events = deque(maxlen=max_events)
+        self.lock = threading.Lock()
+        self.period_start = time.perf_counter()
+
+    def acquire(self, job_id):
+        '''
+        Returns:
+            CpuLease: Core share of the job, to release when its inference ends
+        '''
+        with self.lock:
+            lease = self.leases[job_id] = CpuLease(self, job_id)
+            self.rebalance('start', job_id)
+        return lease
+
+    def release(self, job_id):
+        with self.lock:
+            lease = self.leases.pop(job_id, None)
+            if lease is not None:
+                self.rebalance('finish', job_id, lease.frames)
+
+    def shares(self, jobs):
+        '''Splits the cores evenly, the first jobs get the remainder, every job gets at least one thread.'''
+        base, extra = divmod(self.cpus, max(1, jobs))
+        return [max(1, base + (index < extra)) for index in range(jobs)]
+
+    def throughput(self, extra_frames=0):
+        '''Aggregate frames/s of the jobs since the last rebalance (call with the lock held).'''
+        elapsed = time.perf_counter() - self.period_start
+        frames = sum(lease.frames for lease in self.leases.values()) + extra_frames
+        return frames / elapsed if elapsed > 0 else 0.0
+
+    def rebalance(self, event, job_id, released_frames=0):
+        '''Gives every job its new share and closes the throughput measurement period (call with the lock held).'''
+        throughput = self.throughput(released_frames)
+        if self.events:
+            self.events[-1]['throughput_after'] = throughput
+        for lease, threads in zip(self.leases.values(), self.shares(len(self.leases))):
+            lease.frames = 0
+            if lease.threads != threads or lease.generation == 0:
+                lease.threads = threads
+                lease.generation += 1
+        self.period_start = time.perf_counter()
+        self.events.append({'time': time.time(), 'event': event, 'job_id': job_id, 'jobs': len(self.leases),
+                            'threads': {lease.job_id: lease.threads for lease in self.leases.values()},
+                            'throughput_before': throughput, 'throughput_after': None})
+        logging.info(f'CPU budget : job {job_id} {event}, {len(self.leases)} jobs share {self.cpus} cores ({throughput:.1f} frames/s before).')
+
+    def status(self):
+        '''
+        Returns:
+            dict: Cores, threads per active job, current aggregate frames/s and recent rebalance events
+        '''
+        with self.lock:
+            return {'cpus': self.cpus, 'threads': {job_id: lease.threads for job_id, lease in self.leases.items()},
+                    'throughput': self.throughput(), 'events': list(self.events)}
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import shutil
+import logging
+import numpy as np
+from utils.frame_index import FrameIndex
+
+# One recorded detection of a checkpoint segment
+DETECTION_DTYPE = np.dtype([
+    ('frame', np.int64),
+    ('id', np.int64),
+    ('x', np.float32), # Box center
+    ('y', np.float32),
+    ('w', np.float32),
+    ('h', np.float32),
+    ('conf', np.float32),
+    ('cls', np.int32),
+])
+
+class Checkpoint:
+    '''
+    Periodic checkpoints of a tracking job, so an interrupted job resumes where it stopped.
+
+    Checkpoints are incremental : each one only appends the detections recorded since the previous one
+    (as a binary segment), then atomically updates a small state file with the frame position.
+    TRACK_DATA and TRACK_INFO are both rebuilt from the detections on resume.
+    The job configuration is saved once, so a job can be resumed after a server restart.
+    '''
+    STATE_FILE = 'state.json'
+    JOB_FILE = 'job.json'
+
+    def __init__(self, checkpoint_dir, interval_s=60, warmup_frames=60):
+        '''
+        Args:
+            checkpoint_dir: Folder holding the checkpoint (created when first saved)
+            interval_s: Minimum time between two checkpoints, in seconds
+            warmup_frames: Frames replayed before the checkpoint on resume, so the tracker state converges
+        '''
+        self.checkpoint_dir = checkpoint_dir
+        self.interval_s = interval_s
+        self.warmup_frames = warmup_frames
+        self.saved_frames = 0
+        self.segments = 0
+        self.last_save = time.monotonic()
+
+    def path(self, filename):
+        return os.path.join(self.checkpoint_dir, filename)
+
+    def write_json(self, filename, data):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        tmp_path = self.path(f'{filename}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, default=str)
+        os.replace(tmp_path, self.path(filename))
+
+    def read_json(self, filename):
+        try:
+            with open(self.path(filename), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save_job(self, job):
+        '''Saves the JSON-serializable configuration needed to restart the job.'''
+        self.write_json(self.JOB_FILE, job)
+
+    def load_job(self):
+        return self.read_json(self.JOB_FILE)
+
+    def exists(self):
+        return self.read_json(self.STATE_FILE) is not None
+
+    def due(self):
+        return time.monotonic() - self.last_save >= self.interval_s
+
+    def save(self, data_manager, frame_nb):
+        '''
+        Appends the detections of frames [last checkpoint, frame_nb) and moves the checkpoint to frame_nb.
+
+        Args:
+            data_manager: DataManager instance containing tracking data
+            frame_nb: Number of frames fully processed
+        '''
+        records = [(frame, track_id, *np.asarray(data_manager.TRACK_DATA[track_id][length - 1][1], dtype=np.float32),
+                    float(data_manager.TRACK_DATA[track_id][length - 1][2]), data_manager.TRACK_DATA[track_id][length - 1][3])
+                   for frame in range(self.saved_frames, frame_nb)
+                   for track_id, length in data_manager.TRACK_INFO[frame]]
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        # The segment is complete on disk before the state refers to it
+        np.save(self.path(f'segment_{self.segments:05d}.npy'), np.array(records, dtype=DETECTION_DTYPE), allow_pickle=False)
+        self.segments += 1
+        self.saved_frames = frame_nb
+        self.write_json(self.STATE_FILE, {'frame': frame_nb, 'segments': self.segments})
+        self.last_save = time.monotonic()
+
+    def restore(self, data_manager):
+        '''
+        Rebuilds TRACK_DATA and TRACK_INFO from the saved segments.
+
+        Returns:
+            int: Number of frames already processed (the frame to resume from)
+        '''
+        state = self.read_json(self.STATE_FILE)
+        self.saved_frames, self.segments = state['frame'], state['segments']
+        frames, ids, lengths = [], [], []
+        for segment in range(self.segments):
+            for frame, track_id, x, y, w, h, conf, cls in np.load(self.path(f'segment_{segment:05d}.npy'), allow_pickle=False).tolist():
+                track_data = data_manager.TRACK_DATA[track_id]
+                track_data.append((frame, np.array([x, y, w, h], dtype=np.float32), conf, cls))
+                frames.append(frame)
+                ids.append(track_id)
+                lengths.append(len(track_data))
+        detections = len(frames)
+        data_manager.TRACK_INFO = FrameIndex.from_detections(frames, ids, lengths, self.saved_frames) # Segments are in frame order
+        logging.info(f'Checkpoint restored : {self.saved_frames} frames, {detections} detections.')
+        self.last_save = time.monotonic()
+        return self.saved_frames
+
+    def clear(self):
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+
+def match_track_ids(recorded, detected, iou_threshold=0.5):
+    '''
+    Matches the boxes of two trackers on the same frame, greedily by decreasing IoU.
+
+    Args:
+        recorded: List of (track ID, xywh box) recorded before the interruption
+        detected: List of (track ID, xywh box) of the resumed tracker
+        iou_threshold: Minimum IoU of a match
+
+    Returns:
+        list: (detected ID, recorded ID) pairs
+    '''
+    if not recorded or not detected:
+        return []
+    def corners(boxes):
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        return np.concatenate([boxes[:, :2] - boxes[:, 2:] / 2, boxes[:, :2] + boxes[:, 2:] / 2], axis=1)
+    a, b = corners([box for _, box in recorded]), corners([box for _, box in detected])
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    areas_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    areas_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    iou = intersection / np.maximum(areas_a[:, None] + areas_b[None, :] - intersection, 1e-9)
+
+    matches = []
+    for flat in np.argsort(-iou, axis=None):
+        i, j = np.unravel_index(flat, iou.shape)
+        if iou[i, j] < iou_threshold:
+            break
+        if all(i != m_i and j != m_j for m_i, m_j, _, _ in matches):
+            matches.append((i, j, detected[j][0], recorded[i][0]))
+    return [(detected_id, recorded_id) for _, _, detected_id, recorded_id in matches]
@@ -7,6 +7,7 @@ import yaml
 import cv2
 from ultralytics import YOLO
 import onnx
+from utils.frame_index import FrameIndex
 
 class DataManager:
     '''
@@ -17,7 +18,7 @@ class DataManager:
     - Model selection and configuration
     - Tracking data storage
     - Site and timing information
-    - Export settings
+    - Export settings (Excel, annotated video, columnar formats)
     '''
     def __init__(self):
         '''Initialize data storage and default parameters.'''
@@ -27,16 +28,22 @@ class DataManager:
         self.export_path = None
         self.selected_model = None
         self.inference_tracker = None
+        self.inference_config = None # Tuned runtime, image size and threads of the model, see BackendTuner
         self.site_location = None
         self.do_video_export = False
+        self.export_formats = [] # Columnar formats written next to the Excel report ('parquet', 'csv')
+        self.do_tracks_export = False # Also write raw per-detection tracks in the columnar formats
+        self.do_profile = False # Record a sampling profile of the job (see SamplingProfiler), not part of the job fingerprint
         self.start_datetime = None
+        self.time_windows = None # Frame ranges [start, end) to process, the whole video if None
+        self.ffmpeg_decoder = None # FFmpeg executable decoding and pre-scaling the frames for tracking (see FFmpegFrameSource), OpenCV if None
         self.directions = None
 
         self.START, self.END = None, None
 
         self.CROSSED =  defaultdict(lambda: [])
         self.TRACK_DATA = defaultdict(lambda: [])
-        self.TRACK_INFO = []
+        self.TRACK_INFO = FrameIndex()
         self.TRACK_ANALYSIS = {}
 
         self.device_name = ''
@@ -50,6 +57,13 @@ class DataManager:
         self.height = 0
         self.triplines = []  # Changed from single tripline to list of triplines
 
+    def clear_tracking(self):
+        '''Discards tracking and counting results, e.g. before processing the same video again.'''
+        self.CROSSED =  defaultdict(lambda: [])
+        self.TRACK_DATA = defaultdict(lambda: [])
+        self.TRACK_INFO = FrameIndex()
+        self.TRACK_ANALYSIS = {}
+
     def set_tripline(self):
         self.tripline = (self.START, self.END)
 
@@ -59,6 +73,69 @@ class DataManager:
     def set_start_datetime(self, start_date, start_time):
         self.start_datetime = datetime.datetime.strptime(f'{start_date} {start_time}:00', r'%Y-%m-%d %H:%M:%S')
 
+    @staticmethod
+    def parse_time_windows(windows):
+        '''
+        Args:
+            windows: List of ('HH:MM', 'HH:MM') pairs, or a string such as '07:00-09:00, 16:00-19:00'
+
+        Returns:
+            list: (start, end) datetime.time pairs
+
+        Raises:
+            ValueError: On a malformed window
+        '''
+        if isinstance(windows, str):
+            windows = [window.split('-') for window in windows.replace(';', ',').split(',') if window.strip()]
+        parsed = []
+        for window in windows:
+            if len(window) != 2:
+                raise ValueError(f'Invalid time window {window!r}, expected HH:MM-HH:MM.')
+            parsed.append(tuple(datetime.datetime.strptime(str(time).strip(), r'%H:%M').time() for time in window))
+        return parsed
+
+    def set_time_windows(self, windows):
+        '''
+        Restricts processing to wall-clock time windows, repeated on each day of the recording.
+        Frame numbers stay absolute, so crossing timestamps are unchanged.
+        Requires the start datetime and video parameters to be set.
+
+        Args:
+            windows: Time windows, see parse_time_windows (a window ending before it starts spans midnight).
+                     Empty or None processes the whole video.
+
+        Raises:
+            ValueError: On a malformed window, or if no window overlaps the recording
+        '''
+        windows = self.parse_time_windows(windows or [])
+        if not windows:
+            self.time_windows = None
+            return
+        recording_end = self.start_datetime + datetime.timedelta(seconds=self.frame_count / self.fps)
+        frame_ranges = []
+        day = self.start_datetime.date() - datetime.timedelta(days=1) # Windows spanning midnight may start the day before
+        while datetime.datetime.combine(day, datetime.time()) < recording_end:
+            for start_time, end_time in windows:
+                start = datetime.datetime.combine(day, start_time)
+                end = datetime.datetime.combine(day + datetime.timedelta(days=int(end_time <= start_time)), end_time)
+                start_frame = max(0, int((start - self.start_datetime).total_seconds() * self.fps))
+                end_frame = min(self.frame_count, int((end - self.start_datetime).total_seconds() * self.fps))
+                if start_frame < end_frame:
+                    frame_ranges.append([start_frame, end_frame])
+            day += datetime.timedelta(days=1)
+        if not frame_ranges:
+            raise ValueError(f'No time window overlaps the recording ({self.start_datetime} to {recording_end}).')
+
+        # Overlapping windows are merged, so each frame is processed once
+        self.time_windows = []
+        for start_frame, end_frame in sorted(frame_ranges):
+            if self.time_windows and start_frame <= self.time_windows[-1][1]:
+                self.time_windows[-1][1] = max(self.time_windows[-1][1], end_frame)
+            else:
+                self.time_windows.append([start_frame, end_frame])
+        self.time_windows = [tuple(frame_range) for frame_range in self.time_windows]
+        logging.info(f'Processing {sum(end - start for start, end in self.time_windows)} of {self.frame_count} frames in {len(self.time_windows)} time windows.')
+
     def set_video_params(self, video_path):
         '''
         Extract and store video parameters from input file.
@@ -0,0 +1,228 @@
+import os
+import time
+import shutil
+import logging
+from collections import OrderedDict
+from collections.abc import Mapping
+import numpy as np
+from utils.checkpoint import DETECTION_DTYPE
+from utils.frame_index import FrameIndex
+
+# Fixed-size file header, followed by DETECTION_DTYPE records in frame order
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', np.uint32),
+    ('record_size', np.uint32),
+    ('fps', np.float64),
+    ('width', np.int32),
+    ('height', np.int32),
+    ('frame_count', np.int64), # -1 until the log is closed
+    ('reserved', 'V24'),
+])
+MAGIC = b'MVADLOG\0'
+VERSION = 1
+
+class DetectionLog:
+    '''
+    Append-only binary log of every tracked detection (frame, track ID, box, confidence, class) of a job.
+
+    Records have a fixed width and are written sequentially in frame order, in buffered chunks flushed at least
+    every flush_interval_s, after a small header (video fps, size and frame count). Readers open the file as a
+    read-only memory map : processes counting, annotating or exporting the same job share one page-cached
+    copy instead of each loading its own (see load). The frame index built while tracking (TRACK_INFO) is saved
+    next to the log when it is closed, and memory-mapped as well.
+    '''
+    INDEX_SUFFIX = '_index'
+
+    def __init__(self, path, flush_interval_s=5, buffer_records=8192):
+        '''
+        Args:
+            path: Log file
+            flush_interval_s: Maximum time between two writes to the file, in seconds
+            buffer_records: Records buffered in memory between two writes
+        '''
+        self.path = path
+        self.flush_interval_s = flush_interval_s
+        self.buffer = np.empty(buffer_records, dtype=DETECTION_DTYPE)
+        self.buffered = 0
+        self.file = None
+
+    def open(self, data_manager, resume_frame=0):
+        '''
+        Starts the log, or continues it from resume_frame : records of later frames (written after the
+        checkpoint of an interrupted job) are dropped.
+
+        Args:
+            data_manager: DataManager of the job (fps, width, height)
+            resume_frame: First frame to be written
+        '''
+        shutil.rmtree(self.index_folder(self.path), ignore_errors=True) # Saved for the previous log contents
+        if resume_frame and os.path.exists(self.path):
+            header, records = self.read(self.path)
+            kept = int(np.searchsorted(records['frame'], resume_frame)) # Records are in frame order
+            del records
+            self.file = open(self.path, 'r+b')
+            self.file.truncate(HEADER_DTYPE.itemsize + kept * DETECTION_DTYPE.itemsize)
+            self.file.seek(0, os.SEEK_END)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self.file = open(self.path, 'wb')
+            header = np.zeros(1, dtype=HEADER_DTYPE)
+            header[0] = (MAGIC, VERSION, DETECTION_DTYPE.itemsize, data_manager.fps, data_manager.width, data_manager.height, -1, b'')
+            self.file.write(header.tobytes())
+        self.last_flush = time.monotonic()
+
+    def append_frame(self, frame_nb, detections):
+        '''
+        Args:
+            frame_nb: Frame number
+            detections: List of (track ID, xywh box, confidence, class) of the frame
+        '''
+        for track_id, box, conf, cls in detections:
+            if self.buffered == len(self.buffer):
+                self.write_buffer()
+            x, y, w, h = np.asarray(box, dtype=np.float32)
+            self.buffer[self.buffered] = (frame_nb, track_id, x, y, w, h, float(conf), int(cls))
+            self.buffered += 1
+        if time.monotonic() - self.last_flush >= self.flush_interval_s:
+            self.flush()
+
+    def write_buffer(self):
+        self.file.write(self.buffer[:self.buffered].tobytes())
+        self.buffered = 0
+
+    def flush(self):
+        self.write_buffer()
+        self.file.flush()
+        self.last_flush = time.monotonic()
+
+    def close(self, frame_count, frame_index=None):
+        '''
+        Writes the remaining records and the final frame count.
+
+        Args:
+            frame_count: Number of frames of the job
+            frame_index: Optional FrameIndex of the logged detections (TRACK_INFO), saved next to the log
+        '''
+        if self.file is None:
+            return
+        self.flush()
+        self.file.seek(HEADER_DTYPE.fields['frame_count'][1])
+        self.file.write(np.int64(frame_count).tobytes())
+        self.file.close()
+        self.file = None
+        if frame_index is not None:
+            frame_index.save(self.index_folder(self.path))
+
+    @classmethod
+    def index_folder(cls, path):
+        '''
+        Returns:
+            str: Folder of the frame index saved with the log at path
+        '''
+        return os.path.splitext(path)[0] + cls.INDEX_SUFFIX
+
+    @staticmethod
+    def read(path):
+        '''
+        Returns:
+            tuple: (header record, read-only memory map of the detection records)
+
+        Raises:
+            ValueError: If the file is not a detection log of this version
+        '''
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+        if not len(header) or header[0]['magic'] != MAGIC.rstrip(b'\0') or header[0]['version'] != VERSION:
+            raise ValueError(f'{path} is not a detection log (version {VERSION}).')
+        records = (os.path.getsize(path) - HEADER_DTYPE.itemsize) // DETECTION_DTYPE.itemsize # A partly written last record is ignored
+        if not records:
+            return header[0], np.empty(0, dtype=DETECTION_DTYPE)
+        return header[0], np.memmap(path, dtype=DETECTION_DTYPE, mode='r', offset=HEADER_DTYPE.itemsize, shape=(records,))
+
+    @classmethod
+    def load(cls, path, data_manager):
+        '''
+        Points the tracking data of a DataManager to a log : TRACK_DATA becomes a read-only view over the
+        memory-mapped records and TRACK_INFO the memory-mapped index saved with it (rebuilt if missing or not
+        matching the log), so Counter, Annotator and the exports run on it unchanged.
+
+        Returns:
+            int: Number of detections
+        '''
+        header, records = cls.read(path)
+        tracks = LoggedTracks(records)
+        frame_count = int(header['frame_count']) if header['frame_count'] >= 0 else int(records['frame'][-1]) + 1 if len(records) else 0
+        data_manager.TRACK_DATA = tracks
+        data_manager.TRACK_INFO = cls.load_index(path, frame_count, len(records))
+        if data_manager.TRACK_INFO is None:
+            data_manager.TRACK_INFO = FrameIndex.from_detections(records['frame'], records['id'], tracks.lengths(), frame_count)
+        logging.info(f'Detection log {path} loaded : {len(records)} detections, {len(tracks)} tracks.')
+        return len(records)
+
+    @classmethod
+    def load_index(cls, path, frame_count, detections):
+        '''
+        Returns:
+            FrameIndex: Read-only memory map of the index saved with the log, None if it is missing or does not match the log
+        '''
+        folder = cls.index_folder(path)
+        if not os.path.isfile(os.path.join(folder, FrameIndex.OFFSETS_FILE)) or not os.path.isfile(os.path.join(folder, FrameIndex.ENTRIES_FILE)):
+            return None
+        try:
+            frame_index = FrameIndex.load(folder, mmap=True)
+        except ValueError as e:
+            logging.warning(f'Frame index {folder} could not be read, rebuilt from the log: {str(e)}')
+            return None
+        if len(frame_index) != frame_count or len(frame_index.entries) != detections:
+            logging.warning(f'Frame index {folder} does not match {path}, rebuilt from the log.')
+            return None
+        return frame_index
+
+class LoggedTracks(Mapping):
+    '''
+    Read-only TRACK_DATA view over the detection records of a log : track ID -> list of (frame, xywh box,
+    confidence, class), tracks in order of first appearance like the dict filled while tracking.
+    Only the record order (8 bytes per detection) is held in memory, track lists are built when accessed.
+    '''
+    CACHE_SIZE = 1024
+
+    def __init__(self, records):
+        self.records = records
+        self.order = np.argsort(records['id'], kind='stable') # Stable : each track stays in frame order
+        ids, starts = np.unique(records['id'][self.order], return_index=True)
+        by_appearance = np.argsort(self.order[starts], kind='stable') # By first record of each track
+        ends = np.append(starts[1:], len(self.order))
+        self.ids = ids[by_appearance].tolist()
+        self.slices = {track_id: (start, end) for track_id, start, end in zip(self.ids, starts[by_appearance].tolist(), ends[by_appearance].tolist())}
+        self.cache = OrderedDict() # Recently built tracks, e.g. the objects of the frames being annotated
+
+    def __getitem__(self, track_id):
+        if track_id in self.cache:
+            self.cache.move_to_end(track_id)
+            return self.cache[track_id]
+        start, end = self.slices[track_id]
+        records = self.records[self.order[start:end]]
+        boxes = np.stack([records['x'], records['y'], records['w'], records['h']], axis=1)
+        self.cache[track_id] = [(frame, box, conf, cls) for frame, box, conf, cls in zip(records['frame'].tolist(), boxes, records['conf'].tolist(), records['cls'].tolist())]
+        if len(self.cache) > self.CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return self.cache[track_id]
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, track_id):
+        return track_id in self.slices
+
+    def lengths(self):
+        '''
+        Returns:
+            numpy.ndarray: Length of its track up to each record (in record order), as TRACK_INFO entries
+        '''
+        lengths = np.empty(len(self.order), dtype=np.int32)
+        for start, end in self.slices.values():
+            lengths[self.order[start:end]] = np.arange(1, end - start + 1, dtype=np.int32)
+        return lengths
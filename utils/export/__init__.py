@@ -1,9 +1,22 @@
-from .xlsx import xlsxWriter, xlsxCompiler, StreetCountCompiler
-from .video import Annotator
+import importlib
 
-__all__ = [
-    'xlsxWriter',
-    'xlsxCompiler',
-    'StreetCountCompiler',
-    'Annotator',
-]
\ No newline at end of file
+# Imported on first access, so importing one export module does not load the others (e.g. video and cv2)
+_EXPORTS = {
+    'xlsxWriter': '.xlsx',
+    'xlsxCompiler': '.xlsx',
+    'StreetCountCompiler': '.xlsx',
+    'Annotator': '.video',
+    'ColumnarWriter': '.columnar',
+    'CompileCache': '.cache',
+    'CountCube': '.cube',
+    'crossing_table': '.crossings',
+}
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+__all__ = list(_EXPORTS)
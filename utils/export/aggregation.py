@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+
+# Supported interval sizes, in minutes : each divides an hour, so the intervals of a day nest into each other
+BIN_MINUTES = (5, 15, 30, 60)
+
+def interval_column(minutes):
+    '''Report column holding the intervals of the given size ('15 Min Interval', 'Hour Interval', ...).'''
+    return 'Hour Interval' if minutes == 60 else f'{minutes} Min Interval'
+
+def local_times(timestamps):
+    '''Local wall-clock times : timezone-aware timestamps are binned on their local date and time.'''
+    timestamps = pd.Series(timestamps)
+    if isinstance(timestamps.dtype, pd.DatetimeTZDtype):
+        return timestamps.dt.tz_localize(None)
+    return timestamps
+
+def time_bins(timestamps, minutes):
+    '''
+    Start of the interval of each timestamp, with a single vectorized floor.
+
+    Args:
+        timestamps: Series of crossing timestamps
+        minutes: Interval size, among BIN_MINUTES
+
+    Returns:
+        pd.Series: Interval start of each timestamp (local wall-clock time)
+    '''
+    if minutes not in BIN_MINUTES:
+        raise ValueError(f'Unsupported interval of {minutes} minutes, expected one of {BIN_MINUTES}.')
+    return local_times(timestamps).dt.floor(f'{minutes}min')
+
+def day_start(timestamps):
+    return local_times(timestamps).dt.normalize()
+
+def week_start(timestamps):
+    '''First day (Monday) of the week of each timestamp.'''
+    day = day_start(timestamps)
+    return day - pd.to_timedelta(day.dt.weekday, unit='D')
+
+def report_label(start, minutes):
+    '''Interval label of the counting report : '8:45' (15 minutes), '8:00' (hour).'''
+    return f'{start.hour}:{start.minute:02d}'
+
+def bin_labels(starts, minutes, formatter=report_label):
+    '''
+    Formats interval labels : each distinct interval is formatted once, then broadcast to its rows.
+
+    Args:
+        starts: Series of interval starts, as returned by time_bins
+        minutes: Interval size, passed on to formatter
+        formatter: Function (interval start, minutes) -> label
+
+    Returns:
+        pd.Series: Label of each row
+    '''
+    codes, uniques = pd.factorize(starts)
+    labels = np.asarray([formatter(start, minutes) for start in uniques] + [None], dtype=object)
+    return pd.Series(labels[codes], index=starts.index) # Missing timestamps (code -1) get None
+
+def interval_labels(timestamps, minutes, formatter=report_label):
+    '''Interval label of each timestamp (time_bins then bin_labels).'''
+    return bin_labels(time_bins(timestamps, minutes), minutes, formatter)
+
+def aggregate(frame, keys, timestamp='Timestamp', minutes=(15, 60), rollups=('day', 'week')):
+    '''
+    Counts rows per keys and time interval, for several interval sizes in a single grouping pass.
+
+    Rows are grouped once on the finest interval : coarser intervals, days and weeks are then
+    derived from the (few) grouped rows, as finer intervals nest into coarser ones.
+
+    Args:
+        frame: DataFrame with the keys columns and a timestamp column
+        keys: Columns to count by (e.g. site, class, direction)
+        timestamp: Name of the timestamp column
+        minutes: Interval sizes among BIN_MINUTES, the finest one must divide the others
+        rollups: Periods among 'day' (Date column) and 'week' (First day of Week column)
+
+    Returns:
+        pd.DataFrame: keys, 'Date' and/or 'First day of Week', one interval start column per size
+        (see interval_column) and 'Count', one row per keys and finest interval
+    '''
+    minutes = sorted(minutes)
+    finest = minutes[0]
+    if any(size % finest for size in minutes):
+        raise ValueError(f'Intervals {minutes} do not nest into {finest} minutes intervals.')
+    bins = time_bins(frame[timestamp], finest).rename(interval_column(finest))
+    counts = (frame[list(keys)].assign(**{bins.name: bins})
+              .groupby(list(keys) + [bins.name], sort=True, dropna=True).size()
+              .rename('Count').reset_index())
+
+    starts = counts[interval_column(finest)]
+    for size in minutes[1:]:
+        counts[interval_column(size)] = starts.dt.floor(f'{size}min')
+    if 'week' in rollups:
+        counts.insert(len(keys), 'First day of Week', week_start(starts))
+    if 'day' in rollups:
+        counts.insert(len(keys), 'Date', day_start(starts))
+    return counts
+
+def rollup(counts, keys, period='day'):
+    '''
+    Sums interval counts (as returned by aggregate) per day or week.
+
+    Returns:
+        pd.DataFrame: keys, 'Date' or 'First day of Week' and 'Count'
+    '''
+    column = {'day': 'Date', 'week': 'First day of Week'}[period]
+    return counts.groupby(list(keys) + [column], sort=True)['Count'].sum().reset_index()
+
+def peak_hours(counts, keys, minutes=15):
+    '''
+    Finds the peak hour of each day : the 60-minute window, starting on an interval boundary,
+    with the highest count. Window sums are computed for all groups at once with cumulative sums.
+
+    Args:
+        counts: Interval counts as returned by aggregate, with the interval_column(minutes) column
+        keys: Columns defining the groups (an empty list for one peak hour per day overall)
+        minutes: Size of the intervals of counts
+
+    Returns:
+        pd.DataFrame: keys, 'Date', 'Peak Hour Start', 'Peak Hour End' and 'Peak Hour Count', one row per group and day
+    '''
+    start_column = interval_column(minutes)
+    per_interval = counts.assign(Date=day_start(counts[start_column])).groupby(list(keys) + ['Date', start_column], sort=True)['Count'].sum().reset_index()
+    if per_interval.empty:
+        return pd.DataFrame(columns=list(keys) + ['Date', 'Peak Hour Start', 'Peak Hour End', 'Peak Hour Count'])
+
+    group = per_interval.groupby(list(keys) + ['Date'], sort=False).ngroup().to_numpy(np.int64)
+    minute_of_day = ((per_interval[start_column] - per_interval['Date']) // pd.Timedelta(minutes=1)).to_numpy(np.int64)
+    # Windows never span two groups : group positions are spaced further apart than a day plus an hour
+    position = group * (2 * 24 * 60) + minute_of_day
+    cumulative = np.concatenate([[0], np.cumsum(per_interval['Count'].to_numpy(np.int64))])
+    window_end = np.searchsorted(position, position + 60, side='left')
+    per_interval['Peak Hour Count'] = cumulative[window_end] - cumulative[np.arange(len(position))]
+
+    peaks = per_interval.loc[per_interval.groupby(group, sort=False)['Peak Hour Count'].idxmax()]
+    peaks = peaks.rename(columns={start_column: 'Peak Hour Start'})
+    peaks.insert(peaks.columns.get_loc('Peak Hour Start') + 1, 'Peak Hour End', peaks['Peak Hour Start'] + pd.Timedelta(minutes=60))
+    return peaks[list(keys) + ['Date', 'Peak Hour Start', 'Peak Hour End', 'Peak Hour Count']].reset_index(drop=True)
+
+def count_by(frame, keys, name='Total Count'):
+    '''Number of rows per distinct keys.'''
+    return frame.groupby(list(keys), sort=False, dropna=False).size().rename(name).reset_index()
+
+def sum_counts(partials, keys, name='Total Count'):
+    '''Sums partial counts sharing the same keys (exact, as counts are additive).'''
+    partials = [partial for partial in partials if not partial.empty]
+    if not partials:
+        return pd.DataFrame(columns=list(keys) + [name])
+    return pd.concat(partials, ignore_index=True).groupby(list(keys), dropna=False)[name].sum().reset_index()
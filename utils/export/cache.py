@@ -0,0 +1,94 @@
+import os
+import hashlib
+import logging
+import tempfile
+import pandas as pd
+
+class CompileCache:
+    '''
+    On-disk cache of per-report partial counts, keyed by report content hash.
+
+    A compile only aggregates new or changed reports and merges the cached partial counts
+    of the others, which is exact since counts are summed.
+    Entries are Parquet files (plain data : unlike pickles, loading them cannot execute code).
+    Least recently used entries are evicted by prune once the cache exceeds its size limit.
+    '''
+    # Bump when the partial counts computation changes, so stale entries are not reused
+    VERSION = 2
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024):
+        '''
+        Args:
+            cache_dir: Folder holding the cached partial counts (created if missing)
+            max_bytes: Maximum total size of the cache, in bytes
+        '''
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def file_hash(file_path, chunk_size=1024 * 1024):
+        '''
+        Returns:
+            str: SHA-256 hex digest of the file contents
+        '''
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            while chunk := f.read(chunk_size):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}_v{self.VERSION}.parquet')
+
+    def get(self, key):
+        '''
+        Returns:
+            pd.DataFrame: The cached partial counts, or None on a cache miss
+        '''
+        path = self.entry_path(key)
+        try:
+            partial = pd.read_parquet(path)
+            os.utime(path) # Mark as recently used
+            return partial
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f'Discarding unreadable compile cache entry {path}: {str(e)}')
+            self.remove(path)
+            return None
+
+    def put(self, key, partial):
+        '''
+        Stores partial counts atomically. Call prune once the batch of entries is stored.
+        '''
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            partial.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, self.entry_path(key))
+        except Exception as e:
+            logging.warning(f'Could not write compile cache entry: {str(e)}')
+            self.remove(tmp_path)
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def prune(self):
+        '''Evicts least recently used entries until the cache fits in max_bytes.'''
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith('.pkl'): # Entries of the former pickle format are never read again
+                self.remove(entry.path)
+            elif entry.is_file() and entry.name.endswith('.parquet'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self.remove(path)
+            total -= size
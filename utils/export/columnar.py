@@ -0,0 +1,122 @@
+import logging
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from tqdm.contrib.logging import logging_redirect_tqdm
+from utils import DESC_WIDTH
+from .xlsx import xlsxWriter
+from .crossings import CROSSING_SCHEMA, TRACK_SCHEMA, crossing_table, report_frame
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # Parquet export is skipped without pyarrow, CSV is always available
+    pa, pq = None, None
+
+class ColumnarWriter:
+    '''
+    Exports traffic counting results to columnar formats alongside the Excel report.
+
+    Writes, with typed columns and a stable schema :
+    - The crossing table (same columns as the Excel report, plus timestamp, frame, tripline and class ID)
+    - Optionally, the raw per-detection tracks
+
+    Supported formats are Parquet (requires pyarrow) and CSV, both written in batches.
+    '''
+    FORMATS = ('parquet', 'csv')
+    BATCH_SIZE = xlsxWriter.BATCH_SIZE
+
+    def __init__(self, formats=FORMATS, progress_callback=None):
+        '''
+        Args:
+            formats: Iterable of output formats among FORMATS
+            progress_callback: Optional callback function to report export progress
+        '''
+        self.progress_callback = progress_callback
+        self.formats = [fmt for fmt in formats if fmt in self.FORMATS]
+        if 'parquet' in self.formats and pq is None:
+            logging.warning('pyarrow is not installed : Parquet export skipped.')
+            self.formats.remove('parquet')
+
+    def crossing_batches(self, data_manager, table):
+        for batch_start in range(0, len(table), self.BATCH_SIZE):
+            yield report_frame(data_manager, table.iloc[batch_start:batch_start + self.BATCH_SIZE], time_format='%H:%M:%S.%f')
+
+    def track_batches(self, data_manager):
+        batch = []
+        for track_id, track_data in data_manager.TRACK_DATA.items():
+            for frame, box, conf, cls in track_data:
+                x, y, w, h = np.asarray(box, dtype=np.float32)
+                batch.append((frame, track_id, x, y, w, h, float(conf), cls))
+                if len(batch) >= self.BATCH_SIZE:
+                    yield pd.DataFrame.from_records(batch, columns=list(TRACK_SCHEMA))
+                    batch = []
+        if batch:
+            yield pd.DataFrame.from_records(batch, columns=list(TRACK_SCHEMA))
+
+    def write_table(self, export_base_path, batches, schema, total=None, desc='Writing columnar export'):
+        '''
+        Streams batches of a table to every selected format.
+
+        Args:
+            export_base_path: Output path without extension
+            batches: Iterable of DataFrames holding the schema columns
+            schema: Dict {column : dtype} the batches are cast to
+            total: Optional total row count for progress reporting
+
+        Returns:
+            list: Paths of the written files
+        '''
+        paths = {fmt: f'{export_base_path}.{fmt}' for fmt in self.formats}
+        parquet_writer = None
+        arrow_schema = None
+        written = 0
+        console_progress = tqdm(total=total, desc=f'{desc:<{DESC_WIDTH}}', unit='rows', dynamic_ncols=True)
+        with logging_redirect_tqdm():
+            for batch in batches:
+                batch = batch[list(schema)].astype(schema)
+                if 'csv' in paths:
+                    batch.to_csv(paths['csv'], mode='w' if written == 0 else 'a', header=written == 0, index=False)
+                if 'parquet' in paths:
+                    table = pa.Table.from_pandas(batch, schema=arrow_schema, preserve_index=False)
+                    if parquet_writer is None:
+                        arrow_schema = table.schema
+                        parquet_writer = pq.ParquetWriter(paths['parquet'], arrow_schema)
+                    parquet_writer.write_table(table)
+                written += len(batch)
+                console_progress.update(len(batch))
+                if self.progress_callback and total:
+                    self.progress_callback(int((written / total) * 100))
+        console_progress.close()
+
+        if written == 0: # Still write the (empty) schema
+            empty = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in schema.items()})
+            if 'csv' in paths:
+                empty.to_csv(paths['csv'], index=False)
+            if 'parquet' in paths:
+                empty.to_parquet(paths['parquet'], index=False)
+        if parquet_writer is not None:
+            parquet_writer.close()
+        return list(paths.values())
+
+    def write(self, export_base_path, data_manager, include_tracks=False, table=None):
+        '''
+        Writes the crossing table, and optionally the tracks, to every selected format.
+
+        Args:
+            export_base_path: Output path without extension ('_tracks' is appended for tracks)
+            data_manager: DataManager instance containing counting results
+            include_tracks: Whether to also export the raw per-detection tracks
+            table: Optional table returned by crossing_table, built from data_manager if None
+
+        Returns:
+            list: Paths of the written files
+        '''
+        if table is None:
+            table = crossing_table(data_manager)
+        paths = self.write_table(export_base_path, self.crossing_batches(data_manager, table), CROSSING_SCHEMA, total=len(table), desc='Writing crossings table')
+        if include_tracks:
+            total = sum(len(track_data) for track_data in data_manager.TRACK_DATA.values())
+            paths += self.write_table(f'{export_base_path}_tracks', self.track_batches(data_manager), TRACK_SCHEMA, total=total, desc='Writing tracks table')
+        logging.info(f'Columnar exports saved at {', '.join(paths)}.')
+        return paths
@@ -0,0 +1,62 @@
+import pandas as pd
+from .crossings import read_crossings
+from .aggregation import count_by, sum_counts
+
+COMPILED_HEADERS = ['Site/Location', 'Date', 'Vehicle Type', 'Direction', '15 Min Interval', 'Hour Interval', 'Total Count']
+
+# Report columns needed to compile counts
+COMPILE_COLUMNS = ['ID', 'Site', 'Date', 'Class', 'Direction', '15 Min Interval', 'Hour Interval']
+
+def join_directions(df):
+    '''
+    Direction of each tracked object : its distinct crossing directions, sorted and joined with ' - '.
+
+    Args:
+        df: Crossings with 'ID' and 'Direction' columns
+
+    Returns:
+        pd.Series: Joined direction, indexed by ID
+    '''
+    # Objects crossing in a single direction keep it as is, only the others need a (slower) string join
+    directions = df[['ID', 'Direction']].astype({'Direction': str}).drop_duplicates().sort_values(['ID', 'Direction'])
+    multiple = directions['ID'].duplicated(keep=False)
+    joined = directions[~multiple].set_index('ID')['Direction']
+    if multiple.any():
+        joined = pd.concat([joined, directions[multiple].groupby('ID')['Direction'].agg(' - '.join)])
+    return joined
+
+def extract_report_counts(file_path):
+    '''
+    Aggregates one report into partial counts, with vectorized groupby operations.
+
+    Each tracked object (ID) of a sheet is counted once : its site, date and class are taken from
+    its first crossing, its intervals from its last crossing and its directions are joined.
+    Module-level, in a module importing only pandas, so it can run in a light worker process.
+
+    Args:
+        file_path: Path to an .xlsx report or a .parquet/.csv crossings export
+
+    Returns:
+        pd.DataFrame: COMPILED_HEADERS columns, one row per distinct key
+    '''
+    partials = []
+    for df in read_crossings(file_path, columns=COMPILE_COLUMNS):
+        if df.empty:
+            continue
+        objects = df.groupby('ID', sort=False).agg(**{
+            'Site/Location': ('Site', 'first'),
+            'Date': ('Date', 'first'),
+            'Vehicle Type': ('Class', 'first'),
+            '15 Min Interval': ('15 Min Interval', 'last'),
+            'Hour Interval': ('Hour Interval', 'last'),
+        })
+        objects.insert(3, 'Direction', join_directions(df).reindex(objects.index))
+        objects['Date'] = objects['Date'].dt.strftime('%Y-%m-%d')
+        partials.append(count_by(objects, COMPILED_HEADERS[:-1]))
+    if not partials:
+        return pd.DataFrame(columns=COMPILED_HEADERS)
+    return merge_counts(partials)
+
+def merge_counts(partials):
+    '''Sums partial counts sharing the same key (exact, as counts are additive).'''
+    return sum_counts(partials, COMPILED_HEADERS[:-1])
@@ -0,0 +1,167 @@
+import os
+import logging
+from collections import defaultdict
+import numpy as np
+import pandas as pd
+from .aggregation import day_start, week_start, interval_labels
+
+# Stable column schemas of the columnar exports : column name -> pandas dtype
+CROSSING_SCHEMA = {
+    'Site': 'string',
+    'Date': 'datetime64[ns]',
+    'First day of Week': 'datetime64[ns]',
+    'Week day': 'string',
+    'Time of crossing': 'string',
+    '15 Min Interval': 'string',
+    'Hour Interval': 'string',
+    'Direction': 'string',
+    'Class': 'string',
+    'ID': 'int64',
+    'Track Confidence': 'float64',
+    'Frame Count': 'int64',
+    'Average Confidence': 'float64',
+    'Max Consecutive Frames': 'int64',
+    'Timestamp': 'datetime64[ns]',
+    'Frame': 'int64',
+    'Tripline': 'int64',
+    'Class ID': 'int64',
+}
+
+TRACK_SCHEMA = {
+    'Frame': 'int64',
+    'ID': 'int64',
+    'X': 'float32', # Box center
+    'Y': 'float32',
+    'Width': 'float32',
+    'Height': 'float32',
+    'Confidence': 'float32',
+    'Class ID': 'int64',
+}
+
+def crossing_table(data_manager):
+    '''
+    Flattens CROSSED into a typed, columnar table (one row per crossing).
+    Built once per job and shared by the Excel and columnar writers.
+
+    Args:
+        data_manager: DataManager instance containing counting results
+
+    Returns:
+        pd.DataFrame: Columns frame, ID, class_id, Direction, tripline, Track Confidence,
+        Frame Count, Average Confidence, Max Consecutive Frames
+    '''
+    columns = defaultdict(list)
+    for obj_id, crossings in data_manager.CROSSED.items():
+        for (frame, cls, direction, tripline_idx, final_conf, stats) in crossings:
+            cls_stats = stats[cls] if stats else None
+            columns['frame'].append(frame)
+            columns['ID'].append(obj_id)
+            columns['class_id'].append(cls)
+            columns['Direction'].append(direction)
+            columns['tripline'].append(tripline_idx)
+            columns['Track Confidence'].append(final_conf)
+            columns['Frame Count'].append(cls_stats['count'] if cls_stats else 0) # Number of frames as this class
+            columns['Average Confidence'].append(cls_stats['total_conf'] / cls_stats['count'] if cls_stats else 0.0)
+            columns['Max Consecutive Frames'].append(cls_stats['max_consecutive'] if cls_stats else 0) # Longest consecutive detection
+
+    return pd.DataFrame({
+        'frame': np.asarray(columns['frame'], dtype=np.int64),
+        'ID': np.asarray(columns['ID'], dtype=np.int64),
+        'class_id': np.asarray(columns['class_id'], dtype=np.int64),
+        'Direction': pd.Series(columns['Direction'], dtype=object),
+        'tripline': np.asarray(columns['tripline'], dtype=np.int64),
+        'Track Confidence': np.asarray(columns['Track Confidence'], dtype=np.float64),
+        'Frame Count': np.asarray(columns['Frame Count'], dtype=np.int64),
+        'Average Confidence': np.asarray(columns['Average Confidence'], dtype=np.float64),
+        'Max Consecutive Frames': np.asarray(columns['Max Consecutive Frames'], dtype=np.int64),
+    })
+
+def report_frame(data_manager, table, time_format=None):
+    '''
+    Builds the typed report columns for a slice of the crossing table, with vectorized datetime operations.
+
+    Args:
+        data_manager: DataManager instance containing site, timing and class names
+        table: Slice of the table returned by crossing_table
+        time_format: Optional strftime format of 'Time of crossing', kept as native time values if None
+
+    Returns:
+        pd.DataFrame: CROSSING_SCHEMA columns
+    '''
+    crossing_time = pd.Series(data_manager.start_datetime + pd.to_timedelta(table['frame'].to_numpy() / data_manager.fps, unit='s'))
+    # Text formatting is only paid for by text outputs, Excel cells keep native time values
+    time_of_crossing = crossing_time.dt.time if time_format is None else crossing_time.dt.strftime(time_format)
+    return pd.DataFrame({
+        'Site': pd.Series([data_manager.site_location] * len(table), dtype=object),
+        'Date': day_start(crossing_time),
+        'First day of Week': week_start(crossing_time),
+        'Week day': crossing_time.dt.day_name(),
+        'Time of crossing': time_of_crossing,
+        '15 Min Interval': interval_labels(crossing_time, 15),
+        'Hour Interval': interval_labels(crossing_time, 60),
+        'Direction': table['Direction'].to_numpy(),
+        'Class': table['class_id'].map(data_manager.names).to_numpy(),
+        'ID': table['ID'].to_numpy(),
+        'Track Confidence': table['Track Confidence'].round(3).to_numpy(), # Overall confidence
+        'Frame Count': table['Frame Count'].to_numpy(),
+        'Average Confidence': table['Average Confidence'].round(3).to_numpy(),
+        'Max Consecutive Frames': table['Max Consecutive Frames'].to_numpy(),
+        'Timestamp': crossing_time,
+        'Frame': table['frame'].to_numpy(),
+        'Tripline': table['tripline'].to_numpy(),
+        'Class ID': table['class_id'].to_numpy(),
+    })
+
+def read_crossings(file_path, columns=None):
+    '''
+    Reads the crossing tables of a report with the CROSSING_SCHEMA dtypes :
+    every sheet of an .xlsx report, or the single table of a .parquet/.csv crossings export.
+
+    Args:
+        file_path: Path to an .xlsx report or a .parquet/.csv crossings export
+        columns: Optional subset of CROSSING_SCHEMA columns to read (all by default)
+
+    Returns:
+        list: One pd.DataFrame per crossing table
+
+    Raises:
+        ValueError: If a table lacks some of the requested columns (e.g. a '_tracks' export)
+    '''
+    columns = list(columns or CROSSING_SCHEMA)
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.parquet':
+        import pyarrow.parquet as pq # Only needed (and required) to read Parquet
+        check_crossing_columns(file_path, pq.read_schema(file_path).names, columns)
+        tables = [pd.read_parquet(file_path, columns=columns)]
+    elif extension == '.csv':
+        check_crossing_columns(file_path, pd.read_csv(file_path, nrows=0).columns, columns)
+        tables = [pd.read_csv(file_path, usecols=columns, dtype={column: dtype for column, dtype in CROSSING_SCHEMA.items()
+                                                                  if column in columns and not dtype.startswith('datetime')})]
+    else:
+        # Extra sheets of a workbook (e.g. notes or pivots) are skipped, but at least one must be a crossing table
+        tables, skipped = [], []
+        xls = pd.ExcelFile(file_path)
+        for sheet_name in xls.sheet_names:
+            df = pd.read_excel(xls, sheet_name=sheet_name)
+            try:
+                check_crossing_columns(f'{file_path} [{sheet_name}]', df.columns, columns)
+            except ValueError as e:
+                skipped.append(str(e))
+                continue
+            tables.append(df[columns])
+        if not tables:
+            raise ValueError(' '.join(skipped))
+        for message in skipped:
+            logging.warning(f'Skipped sheet : {message}')
+
+    for i, df in enumerate(tables):
+        if 'ID' in columns:
+            df = df.dropna(subset=['ID']) # Blank rows of edited reports
+        dates = {column: pd.to_datetime(df[column]) for column in columns if CROSSING_SCHEMA[column].startswith('datetime')}
+        tables[i] = df.assign(**dates).astype({column: CROSSING_SCHEMA[column] for column in columns})
+    return tables
+
+def check_crossing_columns(source, available, columns):
+    missing = [column for column in columns if column not in set(available)]
+    if missing:
+        raise ValueError(f'{source} is not a crossings table (missing columns : {', '.join(missing)}).')
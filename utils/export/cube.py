@@ -0,0 +1,165 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+import pandas as pd
+from .aggregation import aggregate, peak_hours
+from .counts import join_directions
+
+class CountCube:
+    '''
+    Precomputed count aggregate of counting jobs, queried across sessions without parsing reports.
+
+    Each job writes one small Parquet cube : counts per site, direction, class and 15-minute interval,
+    with hourly, daily and weekly starts, counted like the compiled report (each tracked object once,
+    in its joined directions, at its last crossing).
+    Queries filter and group any number of cubes, kept in memory (by path and modification time)
+    so repeated dashboard queries do not read the files again.
+    '''
+    FILENAME = 'count_cube.parquet'
+    DIMENSIONS = ('Session', 'Site', 'Direction', 'Class')
+    PERIODS = {'15min': '15 Min Interval', 'hour': 'Hour Interval', 'day': 'Date', 'week': 'First day of Week'}
+    CACHE_SIZE = 256 # Cubes kept in memory
+
+    def __init__(self):
+        self.cubes = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def build(data_manager, table, session_id):
+        '''
+        Args:
+            data_manager: DataManager instance containing site, timing and class names
+            table: Table returned by crossing_table
+            session_id: Session the counts belong to
+
+        Returns:
+            pd.DataFrame: DIMENSIONS, period start columns and 'Count', one row per 15-minute interval
+        '''
+        crossings = pd.DataFrame({
+            'ID': table['ID'].to_numpy(),
+            'Class': table['class_id'].map(data_manager.names).to_numpy(),
+            'Direction': table['Direction'].to_numpy(),
+            'Timestamp': data_manager.start_datetime + pd.to_timedelta(table['frame'].to_numpy() / data_manager.fps, unit='s'),
+        })
+        objects = crossings.groupby('ID', sort=False).agg(Class=('Class', 'first'), Timestamp=('Timestamp', 'last'))
+        objects['Direction'] = join_directions(crossings).reindex(objects.index)
+        objects['Session'] = session_id
+        objects['Site'] = data_manager.site_location
+        cube = aggregate(objects, list(CountCube.DIMENSIONS), timestamp='Timestamp', minutes=(15, 60))
+        return cube.astype({dimension: 'category' for dimension in CountCube.DIMENSIONS})
+
+    def write(self, path, data_manager, table, session_id):
+        '''
+        Builds and saves the cube of a job.
+
+        Returns:
+            str: Path of the saved cube, None if it could not be written (e.g. without pyarrow)
+        '''
+        try:
+            self.build(data_manager, table, session_id).to_parquet(path, index=False)
+        except ImportError as e:
+            logging.warning(f'Count cube skipped : {str(e)}')
+            return None
+        logging.info(f'Count cube saved at {path}.')
+        return path
+
+    def relabel(self, source_path, path, session_id):
+        '''Saves a copy of a cube under another session (e.g. a job reusing previous results).'''
+        cube = pd.read_parquet(source_path)
+        cube['Session'] = pd.Categorical([session_id] * len(cube))
+        cube.to_parquet(path, index=False)
+        return path
+
+    def load(self, path):
+        mtime = os.path.getmtime(path)
+        with self.lock:
+            cached = self.cubes.get(path)
+            if cached is not None and cached[0] == mtime:
+                self.cubes.move_to_end(path)
+                return cached[1]
+        cube = pd.read_parquet(path)
+        with self.lock:
+            self.cubes[path] = (mtime, cube)
+            self.cubes.move_to_end(path)
+            while len(self.cubes) > self.CACHE_SIZE:
+                self.cubes.popitem(last=False)
+        return cube
+
+    def query(self, paths, filters=None, group_by=(), period=None, date_from=None, date_to=None):
+        '''
+        Filtered and grouped counts across cubes.
+
+        Args:
+            paths: Paths of the cubes to query
+            filters: Optional dict {dimension : list of accepted values}
+            group_by: Dimensions to group by, among DIMENSIONS
+            period: Optional period to group by, among PERIODS keys
+            date_from, date_to: Optional ISO dates (inclusive) bounding the counted days
+
+        Returns:
+            list: Dicts of the group_by dimensions, the period start (ISO format) and 'Count'
+
+        Raises:
+            ValueError: On unknown dimensions or period
+        '''
+        filters = filters or {}
+        self.check(filters, group_by)
+        if period is not None and period not in self.PERIODS:
+            raise ValueError(f'Unknown period {period!r}, expected among {list(self.PERIODS)}.')
+
+        columns = list(group_by) + ([self.PERIODS[period]] if period else [])
+        partials = []
+        for cube in self.select(paths, filters, date_from, date_to):
+            if columns:
+                partials.append(cube.groupby(columns, observed=True)['Count'].sum().reset_index())
+            else:
+                partials.append(pd.DataFrame({'Count': [cube['Count'].sum()]}))
+        if not partials:
+            return []
+
+        counts = pd.concat(partials, ignore_index=True)
+        if columns:
+            counts = counts.astype({column: str for column in group_by}).groupby(columns)['Count'].sum().reset_index()
+        else:
+            counts = pd.DataFrame({'Count': [counts['Count'].sum()]})
+        if period:
+            counts[self.PERIODS[period]] = counts[self.PERIODS[period]].dt.strftime('%Y-%m-%dT%H:%M:%S')
+        counts['Count'] = counts['Count'].astype(int)
+        return counts.to_dict(orient='records')
+
+    def peak_hours(self, paths, filters=None, group_by=(), date_from=None, date_to=None):
+        '''
+        Peak hour of each day across cubes, per group_by dimensions (see query for the arguments).
+
+        Returns:
+            list: Dicts of the group_by dimensions, 'Date', 'Peak Hour Start', 'Peak Hour End' and 'Peak Hour Count'
+        '''
+        self.check(filters or {}, group_by)
+        cubes = list(self.select(paths, filters or {}, date_from, date_to))
+        if not cubes:
+            return []
+        counts = pd.concat(cubes, ignore_index=True).astype({column: str for column in group_by})
+        peaks = peak_hours(counts, list(group_by), minutes=15)
+        for column in ['Date', 'Peak Hour Start', 'Peak Hour End']:
+            peaks[column] = peaks[column].dt.strftime('%Y-%m-%dT%H:%M:%S')
+        peaks['Peak Hour Count'] = peaks['Peak Hour Count'].astype(int)
+        return peaks.to_dict(orient='records')
+
+    def check(self, filters, group_by):
+        unknown = [dimension for dimension in list(filters) + list(group_by) if dimension not in self.DIMENSIONS]
+        if unknown:
+            raise ValueError(f'Unknown dimensions {unknown}, expected among {list(self.DIMENSIONS)}.')
+
+    def select(self, paths, filters, date_from=None, date_to=None):
+        '''Yields the rows of each cube matching the filters.'''
+        for path in paths:
+            cube = self.load(path)
+            mask = pd.Series(True, index=cube.index)
+            for dimension, values in filters.items():
+                mask &= cube[dimension].isin(values)
+            if date_from:
+                mask &= cube['Date'] >= pd.Timestamp(date_from)
+            if date_to:
+                mask &= cube['Date'] <= pd.Timestamp(date_to)
+            yield cube[mask]
@@ -6,7 +6,13 @@ from collections import defaultdict
 import logging
 import os
 import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from utils import DESC_WIDTH
+from .crossings import crossing_table, report_frame
+from .counts import COMPILED_HEADERS, extract_report_counts, merge_counts
+from .aggregation import aggregate, bin_labels, interval_column
+from .cube import CountCube
 
 class xlsxWriter:
     '''
@@ -17,77 +23,61 @@ class xlsxWriter:
     - Vehicle classifications
     - Direction information
     - Confidence scores
+
+    The crossing table is flattened once into typed columns, then report rows are built
+    in vectorized batches and streamed to a write-only workbook : only the row objects
+    of a single batch (not of the whole report) are held in memory at once.
     '''
+    HEADERS = [
+        'Site', 'Date', 'First day of Week', 'Week day',
+        'Time of crossing', '15 Min Interval', 'Hour Interval',
+        'Direction', 'Class', 'ID', 'Track Confidence',
+        'Frame Count', 'Average Confidence', 'Max Consecutive Frames'
+    ]
+    BATCH_SIZE = 10000 # Rows built and written at once
+
     def __init__(self, progress_callback=None):
         '''
         Args:
             progress_callback: Optional callback function to report export progress
         '''
         self.progress_callback = progress_callback
-        # Create a new workbook
-        self.workbook = Workbook()
+        # Create a new write-only (streaming) workbook
+        self.workbook = Workbook(write_only=True)
         # Create a new sheet
-        self.sheet = self.workbook.active
-
-    def __prepare_data(self, data_manager):
-        self.write_data = []
-
-        for obj_id, crossings in data_manager.CROSSED.items():
-            track_analysis = data_manager.TRACK_ANALYSIS.get(obj_id, {})
-            
-            for (frame, cls, direction, _, final_conf, stats) in crossings:
-                timestamp = frame / data_manager.fps
-                crossing_time = data_manager.start_datetime + datetime.timedelta(seconds=timestamp)
-                
-                # Basic data
-                row_data = [
-                    data_manager.site_location,
-                    crossing_time.date(),
-                    crossing_time.date() - datetime.timedelta(days=crossing_time.date().weekday()),
-                    crossing_time.strftime('%A'),
-                    crossing_time.time(),
-                    f'{crossing_time.hour}:{(crossing_time.minute // 15) * 15:02d}',
-                    f'{crossing_time.hour}:00',
-                    direction,
-                    data_manager.names[cls],
-                    obj_id,
-                    f'{final_conf:.3f}'  # Overall confidence
-                ]
-
-                # Add class statistics
-                if stats:
-                    cls_stats = stats[cls]
-                    row_data.extend([
-                        cls_stats['count'],  # Number of frames as this class
-                        f'{cls_stats['total_conf']/cls_stats['count']:.3f}',  # Avg confidence
-                        cls_stats['max_consecutive']  # Longest consecutive detection
-                    ])
-                else:
-                    row_data.extend([0, '0.000', 0])
-
-                self.write_data.append(row_data)
-
-    def write_to_excel(self, export_path_excel, data_manager, progress_var=None):
+        self.sheet = self.workbook.create_sheet()
+
+    def __prepare_batches(self, data_manager, table):
+        '''Yields lists of report rows, BATCH_SIZE crossings at a time.'''
+        for batch_start in range(0, len(table), self.BATCH_SIZE):
+            report = report_frame(data_manager, table.iloc[batch_start:batch_start + self.BATCH_SIZE])
+            # Excel cells keep native date values
+            report['Date'] = report['Date'].dt.date
+            report['First day of Week'] = report['First day of Week'].dt.date
+            yield list(zip(*[report[column].tolist() for column in self.HEADERS]))
+
+    def write_to_excel(self, export_path_excel, data_manager, progress_var=None, table=None):
+        '''
+        Args:
+            export_path_excel: Output path, enumerated if a file already exists
+            data_manager: DataManager instance containing counting results
+            table: Optional table returned by crossing_table, built from data_manager if None
+        '''
         self.progress = progress_var
-        self.__prepare_data(data_manager)
+        if table is None:
+            table = crossing_table(data_manager)
         # Write the headers into the columns
-        headers = [
-            'Site', 'Date', 'First day of Week', 'Week day',
-            'Time of crossing', '15 Min Interval', 'Hour Interval',
-            'Direction', 'Class', 'ID', 'Track Confidence',
-            'Frame Count', 'Average Confidence', 'Max Consecutive Frames'
-        ]
-        
-        self.sheet.append(headers)
+        self.sheet.append(self.HEADERS)
 
         # Write the data
-        length, prog_count = len(self.write_data), 0
+        length, prog_count = len(table), 0
         self.console_progress = tqdm(total=length, desc=f'{'Writing xlsx report':<{DESC_WIDTH}}', unit='rows', dynamic_ncols=True)
         with logging_redirect_tqdm():
-            for row in self.write_data:
-                self.sheet.append(row)
-                self.console_progress.update(1)
-                prog_count += 1 
+            for rows in self.__prepare_batches(data_manager, table):
+                for row in rows:
+                    self.sheet.append(row)
+                self.console_progress.update(len(rows))
+                prog_count += len(rows)
                 if self.progress is not None : self.progress = prog_count// length
                 if self.progress_callback:
                         progress_percentage = int((prog_count / length) * 100)
@@ -119,76 +109,115 @@ class xlsxCompiler:
     - Time intervals
     - Vehicle classifications
     - Directional data
+
+    Each file is aggregated with vectorized operations into partial counts, in parallel worker
+    processes when there are enough files, and the partial counts are then summed.
     '''
-    def __init__(self, folder_path=None, file_paths=None):
+    INPUT_EXTENSIONS = ('.xlsx', '.parquet', '.csv') # Reports and their columnar crossing exports
+    PARALLEL_MIN_FILES = 4 # Below this, worker process startup costs more than it saves
+    MAX_WORKERS = 4 # Default cap, the compile shares the machine with video processing jobs
+
+    def __init__(self, folder_path=None, file_paths=None, max_workers=None, cache=None, progress_callback=None):
+        '''
+        Args:
+            folder_path: Optional folder whose reports are all compiled
+            file_paths: Optional list of report paths (used if no folder_path)
+            max_workers: Optional number of worker processes, defaults to MAX_WORKERS (at most the CPU count)
+            cache: Optional CompileCache, so only new or changed reports are aggregated
+            progress_callback: Optional callback function to report progress
+        '''
+        self.progress_callback = progress_callback
         self.folder_path = folder_path
         self.file_paths = file_paths if file_paths else []
-        self.object_data = {} 
+        self.max_workers = max_workers or min(self.MAX_WORKERS, os.cpu_count() or 1)
+        self.cache = cache
+        self.partial_counts = []
         self.compiled_data = {} 
 
-    def read_files(self):
+    def list_files(self):
         if self.folder_path:
-            files = [os.path.join(self.folder_path, f) for f in os.listdir(self.folder_path) if f.endswith('.xlsx')]
+            files = [os.path.join(self.folder_path, f) for f in os.listdir(self.folder_path) if f.lower().endswith(self.INPUT_EXTENSIONS)]
         else:
             files = self.file_paths
+        return self.select_formats(files)
 
-        for file in files:
-            self.extract_data(file)
+    def select_formats(self, files):
+        '''
+        Keeps a single format of each report, so a session exported as several formats
+        (report_<site>.xlsx, crossings_<site>.parquet, crossings_<site>.csv) is only counted once.
+        The .xlsx report takes precedence, as it may have been edited, then Parquet, then CSV.
+        Raw tracks exports (crossings_<site>_tracks.*) hold no crossings and are left out.
+        '''
+        rank = {extension: i for i, extension in enumerate(self.INPUT_EXTENSIONS)}
+        selected = {}
+        for file in sorted(files, key=lambda f: rank.get(os.path.splitext(f)[1].lower(), len(rank))):
+            folder, name = os.path.split(file)
+            stem = os.path.splitext(name)[0]
+            if stem.startswith('crossings_') and stem.endswith('_tracks'):
+                logging.warning(f'Skipped {name} : raw tracks exports are not compiled.')
+                continue
+            if name == CountCube.FILENAME:
+                continue # Aggregated counts of a job, its report is compiled instead
+            key = (folder, stem.removeprefix('report_').removeprefix('crossings_'))
+            if key in selected:
+                logging.info(f'Skipped {name} : same report as {os.path.basename(selected[key])}.')
+                continue
+            selected[key] = file
+        if files and not selected:
+            raise ValueError('No crossing reports to compile : raw tracks exports only hold detections.')
+        selected = set(selected.values())
+        return [file for file in files if file in selected]
+
+    def read_files(self):
+        files = self.list_files()
+        keys = {}
+        if self.cache:
+            # Reuse the partial counts of reports already compiled with the same content
+            pending = []
+            for file in files:
+                keys[file] = self.cache.file_hash(file)
+                partial = self.cache.get(keys[file])
+                if partial is None:
+                    pending.append(file)
+                else:
+                    self.partial_counts.append(partial)
+            logging.info(f'Compile cache : {len(files) - len(pending)}/{len(files)} reports reused.')
+            files = pending
+
+        workers = min(self.max_workers, len(files))
+        if workers > 1 and len(files) >= self.PARALLEL_MIN_FILES:
+            # Spawned (not forked) workers : the compile runs next to threads using torch, which a fork could deadlock.
+            # Workers only import the light counts module (pandas), not the models and video libraries.
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+                self.collect_partials(files, executor.map(extract_report_counts, files), keys)
+        else:
+            self.collect_partials(files, (extract_report_counts(file) for file in files), keys)
+        if self.cache:
+            self.cache.prune() # Once per compile, not per stored entry
+
+    def collect_partials(self, files, partials, keys):
+        for done, (file, partial) in enumerate(zip(files, partials), start=1):
+            if self.cache:
+                self.cache.put(keys[file], partial)
+            self.partial_counts.append(partial)
+            if self.progress_callback:
+                self.progress_callback(int((done / len(files)) * 90)) # Last 10% for writing
 
     def extract_data(self, file_path):
-        xls = pd.ExcelFile(file_path)
-        for sheet_name in xls.sheet_names:
-            df = pd.read_excel(xls, sheet_name=sheet_name)
-            for _, row in df.iterrows():
-                obj_id = row['ID']
-                site_location = row['Site']
-                date = row['Date']
-                vehicle_type = row['Class']
-                direction = row['Direction']
-                time = row['Time of crossing']
-                interval_15_min = row['15 Min Interval']
-                interval_hr = row['Hour Interval']
-
-                if obj_id not in self.object_data:
-                    self.object_data[obj_id] = {
-                        'Site': site_location,
-                        'Date': date,
-                        'Vehicle Type': vehicle_type,
-                        'Directions': set(),
-                        'Time of last Crossing': time,
-                        '15 Min Interval': interval_15_min,
-                        'Hour Interval': interval_hr
-                    }
-                self.object_data[obj_id]['Directions'].add(direction)
-                self.object_data[obj_id]['Time of Crossing'] = time
-                self.object_data[obj_id]['15 Min Interval'] = interval_15_min
-                self.object_data[obj_id]['Hour Interval'] = interval_hr
+        self.partial_counts.append(extract_report_counts(file_path))
 
     def precompile(self):
-        # Process object_data to concatenate directions
-        for obj_id, data in self.object_data.items():
-            site_location = data['Site']
-            date = data['Date'].strftime('%Y-%m-%d')
-            vehicle_type = data['Vehicle Type']
-            directions = ' - '.join(sorted(str(data['Directions'])))
-            interval_15_min = data['15 Min Interval']
-            interval_hr = data['Hour Interval']
-            time = data['Time of last Crossing']
-
-            key = (site_location, date, vehicle_type, directions, interval_15_min, interval_hr)
-            if key not in self.compiled_data:
-                self.compiled_data[key] = 0
-            self.compiled_data[key] += 1
+        compiled = merge_counts(self.partial_counts)
+        self.compiled_data = {tuple(key): count for *key, count in compiled.itertuples(index=False, name=None)}
 
     def write_compiled_data(self, output_path):
-        workbook = Workbook()
-        sheet = workbook.active
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
 
-        headers = ['Site/Location', 'Date', 'Vehicle Type', 'Direction', '15 Min Interval', 'Hour Interval', 'Total Count']
-        sheet.append(headers)
+        sheet.append(COMPILED_HEADERS)
 
         for key, count in self.compiled_data.items():
-            sheet.append(list(key) + [count])
+            sheet.append(list(key) + [int(count)])
 
         workbook.save(output_path)
 
@@ -198,59 +227,78 @@ class xlsxCompiler:
         self.write_compiled_data(output_path)
 
 class StreetCountCompiler:
-    def __init__(self, file_paths, site_location, timezone):
+    '''
+    Compiles Street Count app .csv exports to the compiled report format.
+
+    Files are streamed in chunks of CHUNK_SIZE records, binned into 15-minute and hourly intervals
+    by the shared aggregation engine and counted on the fly : memory does not grow with the number of records.
+    '''
+    CHUNK_SIZE = 100000 # Records read and aggregated at once
+
+    def __init__(self, file_paths, site_location, timezone, progress_callback=None):
+        self.progress_callback = progress_callback
         self.file_paths = file_paths
         self.site_location = site_location
         self.timezone = timezone
-        self.object_data = defaultdict(list)  # To store raw data
         self.compiled_data = defaultdict(int)  # To store aggregated counts
         
-    def extract_data(self):
+    def read_chunks(self, file_path):
         '''
-        Extracts data from each CSV file and stores it in object_data.
+        Streams one CSV file in chunks, with timestamps parsed and adjusted for timezone.
+        Records with an unparseable timestamp or a missing direction or vehicle type are dropped.
+
+        Yields:
+            tuple: (pd.DataFrame with columns Timestamp, Direction and Vehicle Type, number of dropped records)
         '''
-        for file_path in self.file_paths:
-            try:
-                df = pd.read_csv(file_path, header=None, names=['Timestamp', 'Direction', 'Vehicle Type'])
-                
-                # Parse the Timestamp to datetime objects and adjust for timezone
-                df['Timestamp'] = pd.to_datetime(df['Timestamp'], format='%Y-%m-%dT%H:%M:%S.%fZ').dt.tz_localize('UTC').dt.tz_convert(self.timezone)
-                
-                # Append to object_data
-                for _, row in df.iterrows():
-                    self.object_data['records'].append({
-                        'timestamp': row['Timestamp'],
-                        'direction': row['Direction'],
-                        'vehicle_type': row['Vehicle Type']
-                    })
-            except Exception as e:
-                logging.error(f'Error processing file {file_path}: {e}')
-    
-    def precompile(self):
+        for chunk in pd.read_csv(file_path, header=None, names=['Timestamp', 'Direction', 'Vehicle Type'], chunksize=self.CHUNK_SIZE):
+            # Parse the Timestamp to datetime objects and adjust for timezone
+            chunk['Timestamp'] = pd.to_datetime(chunk['Timestamp'], format='%Y-%m-%dT%H:%M:%S.%fZ', errors='coerce').dt.tz_localize('UTC').dt.tz_convert(self.timezone)
+            valid = chunk.notna().all(axis=1)
+            yield chunk[valid], int((~valid).sum())
+
+    @staticmethod
+    def interval_label(start, minutes):
+        # Street Count labels : '45:00 - 60:00' (15 minutes), '08:00 - 08:59' (hour)
+        if minutes == 60:
+            return f'{start.hour:02d}:00 - {start.hour:02d}:59'
+        return f'{start.minute:02d}:00 - {start.minute + minutes:02d}:00'
+
+    def count_chunk(self, chunk, counts):
         '''
-        Aggregates the extracted data into compiled_data.
+        Adds the records of a chunk to counts, a dict {compiled key : count}.
+        '''
+        # Grouped once on 15-minute intervals, labels are only formatted once per distinct interval
+        grouped = aggregate(chunk, ['Vehicle Type', 'Direction'], timestamp='Timestamp', minutes=(15, 60), rollups=('day',))
+        grouped['Date'] = grouped['Date'].dt.strftime('%Y-%m-%d')
+        for minutes in (15, 60):
+            grouped[interval_column(minutes)] = bin_labels(grouped[interval_column(minutes)], minutes, self.interval_label)
+
+        columns = ['Date', 'Vehicle Type', 'Direction', '15 Min Interval', 'Hour Interval', 'Count']
+        for date, vehicle_type, direction, interval_15_str, interval_hour_str, count in grouped[columns].itertuples(index=False, name=None):
+            counts[(self.site_location, date, vehicle_type, direction, interval_15_str, interval_hour_str)] += int(count)
+
+    def precompile(self):
         '''
+        Aggregates the streamed records into compiled_data.
 
-        for record in self.object_data['records']:
-            date = record['timestamp'].date()
-            hour = record['timestamp'].hour
-            minute = record['timestamp'].minute
-            # Calculate 15-minute interval
-            interval_15 = (minute // 15) * 15
-            # Format interval strings
-            interval_15_str = f'{interval_15:02d}:00 - {interval_15 + 15:02d}:00'
-            interval_hour_str = f'{hour:02d}:00 - {hour:02d}:59'
-
-            key = (
-                self.site_location,
-                date.strftime('%Y-%m-%d'),
-                record['vehicle_type'],
-                record['direction'],
-                interval_15_str,
-                interval_hour_str
-            )
-
-            self.compiled_data[key] += 1
+        Each file is counted as a unit : its counts are only added once the whole file is read,
+        so a file failing partway through is skipped entirely rather than partially counted.
+        '''
+        for file_nb, file_path in enumerate(self.file_paths):
+            if self.progress_callback:
+                self.progress_callback(int((file_nb / len(self.file_paths)) * 90)) # Last 10% for writing
+            file_counts, dropped = defaultdict(int), 0
+            try:
+                for chunk, chunk_dropped in self.read_chunks(file_path):
+                    self.count_chunk(chunk, file_counts)
+                    dropped += chunk_dropped
+            except Exception as e:
+                logging.error(f'Error processing file {file_path}, file skipped: {e}')
+                continue
+            if dropped:
+                logging.warning(f'{file_path} : {dropped} invalid records dropped (unparseable timestamp or missing field).')
+            for key, count in file_counts.items():
+                self.compiled_data[key] += count
 
     def write_compiled_data(self, export_path_excel):
         '''
@@ -299,6 +347,5 @@ class StreetCountCompiler:
         Returns:
             str: Path to the saved Excel file.
         '''
-        self.extract_data()
         self.precompile()
         return self.write_compiled_data(output_path)
@@ -0,0 +1,93 @@
+import os
+import numpy as np
+
+# One object present on a frame : its track ID and how many detections its track has up to this frame
+ENTRY_DTYPE = np.dtype([('id', np.int64), ('length', np.int32)])
+
+class FrameIndex:
+    '''
+    Objects present on each frame, as compact CSR-style arrays : the entries of frame f are
+    entries[offsets[f]:offsets[f + 1]], each entry being (track ID, track length at this frame), so
+    TRACK_DATA[id][length - 1] is the detection of the object on this frame.
+
+    Frames are appended in order while tracking (arrays grow by doubling). The index can be saved as two
+    .npy files and loaded back memory-mapped, so annotation can run later or in another process without
+    holding the index in RAM.
+    '''
+    OFFSETS_FILE = 'offsets.npy'
+    ENTRIES_FILE = 'entries.npy'
+
+    def __init__(self, offsets=None, entries=None):
+        '''
+        Args:
+            offsets: Optional int64 array of frames + 1 offsets, starting with 0
+            entries: Optional ENTRY_DTYPE array of the packed entries
+        '''
+        self.offsets = np.zeros(1024, dtype=np.int64) if offsets is None else offsets
+        self.entries = np.zeros(1024, dtype=ENTRY_DTYPE) if entries is None else entries
+        self.frames = 0 if offsets is None else len(offsets) - 1
+
+    @classmethod
+    def from_detections(cls, frames, ids, lengths, frame_count):
+        '''
+        Builds the index of detections sorted by frame.
+
+        Args:
+            frames, ids, lengths: Frame number, track ID and track length of each detection
+            frame_count: Number of frames of the index
+        '''
+        offsets = np.zeros(frame_count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(np.asarray(frames, dtype=np.int64), minlength=frame_count)[:frame_count], out=offsets[1:])
+        entries = np.empty(len(ids), dtype=ENTRY_DTYPE)
+        entries['id'], entries['length'] = ids, lengths
+        return cls(offsets, entries)
+
+    def __len__(self):
+        return self.frames
+
+    def __getitem__(self, frame):
+        '''
+        Returns:
+            list: (track ID, track length) of each object present on the frame
+        '''
+        if not 0 <= frame < self.frames:
+            raise IndexError(f'Frame {frame} out of range ({self.frames} frames indexed).')
+        return self.entries[self.offsets[frame]:self.offsets[frame + 1]].tolist()
+
+    def reserve(self, frames, entries):
+        '''Grows the arrays (by doubling) to hold the given number of frames and entries.'''
+        if frames + 1 > len(self.offsets):
+            self.offsets = np.resize(self.offsets, max(frames + 1, 2 * len(self.offsets)))
+        if entries > len(self.entries):
+            self.entries = np.resize(self.entries, max(entries, 2 * len(self.entries)))
+
+    def append(self, frame_entries):
+        '''Appends the next frame, given its list of (track ID, track length).'''
+        start = self.offsets[self.frames]
+        self.reserve(self.frames + 1, start + len(frame_entries))
+        if frame_entries:
+            self.entries[start:start + len(frame_entries)] = frame_entries
+        self.frames += 1
+        self.offsets[self.frames] = start + len(frame_entries)
+
+    def pad(self, frame_count):
+        '''Appends empty frames (e.g. skipped outside of time windows) up to frame_count frames.'''
+        if frame_count > self.frames:
+            self.reserve(frame_count, 0)
+            self.offsets[self.frames + 1:frame_count + 1] = self.offsets[self.frames]
+            self.frames = frame_count
+
+    def save(self, folder):
+        '''Saves the index as two .npy files in a folder.'''
+        os.makedirs(folder, exist_ok=True)
+        np.save(os.path.join(folder, self.OFFSETS_FILE), self.offsets[:self.frames + 1], allow_pickle=False)
+        np.save(os.path.join(folder, self.ENTRIES_FILE), self.entries[:self.offsets[self.frames]], allow_pickle=False)
+
+    @classmethod
+    def load(cls, folder, mmap=True):
+        '''
+        Loads an index saved with save, read-only memory-mapped by default : only the pages of the frames read are loaded.
+        '''
+        mmap_mode = 'r' if mmap else None
+        return cls(np.load(os.path.join(folder, cls.OFFSETS_FILE), mmap_mode=mmap_mode, allow_pickle=False),
+                   np.load(os.path.join(folder, cls.ENTRIES_FILE), mmap_mode=mmap_mode, allow_pickle=False))
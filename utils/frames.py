@@ -0,0 +1,134 @@
+import logging
+import tempfile
+import subprocess
+import cv2
+import numpy as np
+
+class FFmpegFrameSource:
+    '''
+    Video frame source decoding with an ffmpeg subprocess, as a drop-in for the cv2.VideoCapture calls of Tracker.
+
+    ffmpeg decodes (with hardware acceleration when available), scales and letterboxes the frames to the model
+    input size and converts them to BGR, so a 4K source is never copied at full resolution into Python. Frames
+    are NumPy views over a buffer read from the pipe, overwritten by the next read : use or copy a frame before
+    reading the next one. Detections on these frames are mapped back to source pixels with to_source.
+    '''
+    PAD_COLOR = '0x727272' # Same gray (114) as the Ultralytics letterbox
+    ERROR_TAIL = 2000 # Characters of the ffmpeg error output logged on failure
+
+    def __init__(self, video_path, size, ffmpeg_path='ffmpeg', hwaccel='auto'):
+        '''
+        Args:
+            video_path: Source video
+            size: Side of the square frames given to the model (e.g. 640)
+            ffmpeg_path: Path to FFmpeg executable
+            hwaccel: ffmpeg hardware decoding method ('auto', 'cuda', 'qsv', ...), None for software decoding
+        '''
+        self.video_path = video_path
+        self.size = size
+        self.ffmpeg_path = ffmpeg_path
+        self.hwaccel = hwaccel
+
+        cap = cv2.VideoCapture(video_path)
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        self.frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.source_width, self.source_height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        cap.release()
+        if not self.source_width or not self.source_height:
+            raise ValueError(f'Could not read video {video_path}.')
+
+        self.scale = min(size / self.source_width, size / self.source_height)
+        self.width, self.height = round(self.source_width * self.scale), round(self.source_height * self.scale)
+        self.pad_x, self.pad_y = (size - self.width) // 2, (size - self.height) // 2
+        self.buffer = bytearray(size * size * 3)
+        self.frame = np.frombuffer(self.buffer, dtype=np.uint8).reshape(size, size, 3)
+        self.process = None
+        self.stderr = None
+        self.start(0)
+
+    def command(self, frame_nb):
+        command = [self.ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-nostdin']
+        if self.hwaccel:
+            command += ['-hwaccel', self.hwaccel]
+        if frame_nb:
+            command += ['-ss', f'{frame_nb / self.fps:.6f}'] # Input seeking, frame accurate since the frames are decoded
+        command += ['-i', self.video_path, '-an', '-sn',
+                    '-vf', f'scale={self.width}:{self.height}:flags=area,pad={self.size}:{self.size}:{self.pad_x}:{self.pad_y}:color={self.PAD_COLOR}',
+                    '-pix_fmt', 'bgr24', '-vsync', 'passthrough', '-f', 'rawvideo', 'pipe:1']
+        return command
+
+    def start(self, frame_nb):
+        self.release()
+        # Errors go to a file : an undrained pipe would block ffmpeg once its buffer is full
+        self.stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(self.command(frame_nb), stdout=subprocess.PIPE, stderr=self.stderr, bufsize=len(self.buffer))
+        self.position = frame_nb
+
+    def read(self):
+        '''
+        Returns:
+            tuple: (success, frame) like cv2.VideoCapture.read, frame being letterboxed to size x size
+        '''
+        if self.process is None:
+            return False, None
+        view, read = memoryview(self.buffer), 0
+        while read < len(self.buffer):
+            count = self.process.stdout.readinto(view[read:])
+            if not count:
+                break
+            read += count
+        if read < len(self.buffer):
+            try:
+                returncode = self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                returncode = None
+            if returncode:
+                logging.error(f'FFmpeg exited with code {returncode}: {self.error_tail()}')
+            return False, None
+        self.position += 1
+        return True, self.frame
+
+    def error_tail(self):
+        '''
+        Returns:
+            str: Last ERROR_TAIL characters of the ffmpeg error output
+        '''
+        self.stderr.seek(0)
+        return self.stderr.read().decode(errors='replace').strip()[-self.ERROR_TAIL:]
+
+    def set(self, prop_id, value):
+        '''Seeks to a frame (cv2.CAP_PROP_POS_FRAMES only), by restarting ffmpeg unless already there.'''
+        if prop_id != cv2.CAP_PROP_POS_FRAMES:
+            return False
+        if int(value) != self.position:
+            self.start(int(value))
+        return True
+
+    def get(self, prop_id):
+        return {cv2.CAP_PROP_FRAME_COUNT: self.frame_count, cv2.CAP_PROP_FPS: self.fps, cv2.CAP_PROP_POS_FRAMES: self.position,
+                cv2.CAP_PROP_FRAME_WIDTH: self.size, cv2.CAP_PROP_FRAME_HEIGHT: self.size}.get(prop_id, 0)
+
+    def isOpened(self):
+        return self.process is not None
+
+    def release(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process.stdout.close()
+            self.stderr.close()
+            self.process, self.stderr = None, None
+
+    def to_source(self, xywh):
+        '''
+        Args:
+            xywh: Boxes (center x, center y, width, height) in letterboxed frame pixels
+
+        Returns:
+            numpy.ndarray: The boxes in source video pixels
+        '''
+        boxes = np.array(xywh, dtype=np.float32).reshape(-1, 4)
+        boxes[:, 0] = (boxes[:, 0] - self.pad_x) / self.scale
+        boxes[:, 1] = (boxes[:, 1] - self.pad_y) / self.scale
+        boxes[:, 2:] /= self.scale
+        return boxes
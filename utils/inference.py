@@ -0,0 +1,99 @@
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+import torch
+from ultralytics import YOLO
+
+class InferenceServer:
+    '''
+    Shared detection model server : one model instance per model and settings for all sessions, instead of
+    one per Tracker, and frames of concurrent sessions are grouped into batches.
+
+    Each model and settings combination gets a worker thread. A worker waits for a first frame, then for
+    more frames during at most max_wait_ms (or until max_batch), and runs them as one batch. Only .pt models
+    are batched, Tracker only sends those : exported ONNX and OpenVINO models usually have a fixed batch size
+    of 1, sharing them would run the frames of all sessions one by one on a single worker.
+    Each batch runs on the CPU threads of the sessions it serves (the sum of their CpuBudget shares).
+    Tracking is not done here, it stays per session (see Tracker).
+    '''
+    def __init__(self, max_batch=8, max_wait_ms=5):
+        '''
+        Args:
+            max_batch: Maximum number of frames per batch
+            max_wait_ms: Maximum time a frame waits for others to fill its batch, in milliseconds
+        '''
+        self.max_batch = max_batch
+        self.max_wait_s = max_wait_ms / 1000
+        self.queues = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def predict(self, model_path, frame, threads=None, **args):
+        '''
+        Runs detection on one frame, batched with the frames other sessions submit meanwhile.
+
+        Args:
+            model_path: Detection model
+            frame: BGR frame
+            threads: Optional CPU threads of the submitting session (its CpuBudget share)
+            args: Ultralytics predict arguments (imgsz, conf, iou, device, ...)
+
+        Returns:
+            ultralytics.engine.results.Results: Detections of the frame
+        '''
+        key = (model_path, repr(sorted(args.items())))
+        with self.lock:
+            if key not in self.queues:
+                self.queues[key] = queue.Queue()
+                self.stats[key] = {'model': model_path, 'batches': 0, 'frames': 0, 'threads': None}
+                threading.Thread(target=self.serve, args=(key, args), name='inference-server', daemon=True).start()
+        future = Future()
+        self.queues[key].put((frame, threads, future))
+        return future.result()
+
+    def serve(self, key, args):
+        model_path = key[0]
+        requests = self.queues[key]
+        max_batch = self.max_batch if model_path.endswith('.pt') else 1
+        try:
+            model = YOLO(model_path, task='detect')
+        except Exception as e:
+            logging.error(f'Inference server could not load {model_path}: {str(e)}', exc_info=True)
+            model = None
+        while True:
+            batch = [requests.get()]
+            deadline = time.perf_counter() + self.max_wait_s
+            while len(batch) < max_batch:
+                try:
+                    batch.append(requests.get(timeout=max(0, deadline - time.perf_counter())))
+                except queue.Empty:
+                    break
+            # Each frame comes from a different session (predict waits for its result), the batch gets their shares
+            shares = [threads for _, threads, _ in batch if threads]
+            threads = sum(shares) if shares else None
+            try:
+                if model is None:
+                    raise RuntimeError(f'Model {model_path} could not be loaded.')
+                if threads and threads != torch.get_num_threads():
+                    torch.set_num_threads(threads)
+                results = model.predict([frame for frame, _, _ in batch], **args)
+                for (_, _, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+            with self.lock:
+                self.stats[key]['batches'] += 1
+                self.stats[key]['frames'] += len(batch)
+                self.stats[key]['threads'] = threads
+
+    def status(self):
+        '''
+        Returns:
+            list: Model, batches, frames, mean batch size, threads of the last batch and queued frames of each model and settings combination served
+        '''
+        with self.lock:
+            return [{**stats, 'mean_batch': stats['frames'] / stats['batches'] if stats['batches'] else 0.0, 'queued': self.queues[key].qsize()}
+                    for key, stats in self.stats.items()]
@@ -0,0 +1,117 @@
+import numpy as np
+
+class IoUTracker:
+    '''
+    Minimal vectorized IoU/centroid tracker, a lightweight alternative to ByteTrack/BoT-SORT for CPU deployments.
+
+    Each frame, detections are matched to the predicted boxes of the live tracks (last box moved by the
+    track velocity) greedily by decreasing IoU, then remaining pairs by centroid distance relative to the
+    box size. Unmatched detections start new tracks, tracks unmatched for more than max_age frames end.
+    It only needs to keep identities over consecutive frames, which is all tripline counting uses.
+    '''
+    NAME = 'iou' # inference_tracker value selecting this tracker
+
+    def __init__(self, iou_threshold=0.3, centroid_ratio=0.5, max_age=30, min_hits=2):
+        '''
+        Args:
+            iou_threshold: Minimum IoU between a track and a detection to match them
+            centroid_ratio: Maximum centroid distance of a match without overlap, relative to the track box size
+            max_age: Number of frames a track is kept without detections
+            min_hits: Number of matched frames before a track is reported (filters one-frame false positives)
+        '''
+        self.iou_threshold = iou_threshold
+        self.centroid_ratio = centroid_ratio
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.next_id = 1
+        self.ids = np.empty(0, dtype=np.int64)
+        self.boxes = np.empty((0, 4), dtype=np.float32) # xywh
+        self.velocities = np.empty((0, 2), dtype=np.float32) # Center displacement per frame
+        self.ages = np.empty(0, dtype=np.int64) # Frames since last matched
+        self.hits = np.empty(0, dtype=np.int64)
+
+    @staticmethod
+    def iou(a, b):
+        '''
+        Returns:
+            np.ndarray: IoU matrix of two sets of xywh boxes, shape (len(a), len(b))
+        '''
+        a_min, a_max = a[:, None, :2] - a[:, None, 2:] / 2, a[:, None, :2] + a[:, None, 2:] / 2
+        b_min, b_max = b[None, :, :2] - b[None, :, 2:] / 2, b[None, :, :2] + b[None, :, 2:] / 2
+        intersection = np.prod(np.clip(np.minimum(a_max, b_max) - np.maximum(a_min, b_min), 0, None), axis=2)
+        union = np.prod(a[:, None, 2:], axis=2) + np.prod(b[None, :, 2:], axis=2) - intersection
+        return intersection / np.maximum(union, 1e-9)
+
+    @staticmethod
+    def greedy_match(scores, valid):
+        '''
+        One-to-one matching by decreasing score among the valid pairs.
+
+        Returns:
+            tuple: (row indices, column indices) of the matched pairs
+        '''
+        rows, cols = np.nonzero(valid)
+        order = np.argsort(-scores[rows, cols], kind='stable')
+        matched_rows, matched_cols = [], []
+        used_rows, used_cols = set(), set()
+        for row, col in zip(rows[order], cols[order]):
+            if row not in used_rows and col not in used_cols:
+                used_rows.add(row)
+                used_cols.add(col)
+                matched_rows.append(row)
+                matched_cols.append(col)
+        return np.asarray(matched_rows, dtype=np.int64), np.asarray(matched_cols, dtype=np.int64)
+
+    def update(self, boxes):
+        '''
+        Matches the detections of a new frame to the tracks.
+
+        Args:
+            boxes: Detected xywh boxes of the frame, shape (n, 4)
+
+        Returns:
+            tuple: (detection indices, track IDs) of the reported detections
+        '''
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        predicted = self.boxes.copy()
+        predicted[:, :2] += self.velocities * (self.ages[:, None] + 1)
+        track_of = np.full(len(boxes), -1, dtype=np.int64) # Detection -> track index
+
+        if len(predicted) and len(boxes):
+            iou = self.iou(predicted, boxes)
+            rows, cols = self.greedy_match(iou, iou >= self.iou_threshold)
+            track_of[cols] = rows
+            # Fast or small objects may not overlap their prediction : match the rest by centroid distance
+            free_tracks = np.setdiff1d(np.arange(len(predicted)), rows)
+            free_boxes = np.flatnonzero(track_of < 0)
+            if len(free_tracks) and len(free_boxes):
+                distance = np.linalg.norm(predicted[free_tracks, None, :2] - boxes[None, free_boxes, :2], axis=2)
+                limit = self.centroid_ratio * predicted[free_tracks, 2:].max(axis=1)[:, None]
+                rows, cols = self.greedy_match(-distance, distance <= limit)
+                track_of[free_boxes[cols]] = free_tracks[rows]
+
+        matched = track_of >= 0
+        tracks = track_of[matched]
+        self.velocities[tracks] = 0.5 * self.velocities[tracks] + 0.5 * (boxes[matched, :2] - self.boxes[tracks, :2]) / (self.ages[tracks, None] + 1)
+        self.boxes[tracks] = boxes[matched]
+        self.hits[tracks] += 1
+        self.ages += 1
+        self.ages[tracks] = 0
+
+        # Unmatched detections start new tracks, stale tracks end
+        new = np.flatnonzero(~matched)
+        track_of[new] = np.arange(len(self.ids), len(self.ids) + len(new))
+        self.ids = np.concatenate([self.ids, np.arange(self.next_id, self.next_id + len(new))])
+        self.next_id += len(new)
+        self.boxes = np.concatenate([self.boxes, boxes[new]])
+        self.velocities = np.concatenate([self.velocities, np.zeros((len(new), 2), dtype=np.float32)])
+        self.ages = np.concatenate([self.ages, np.zeros(len(new), dtype=np.int64)])
+        self.hits = np.concatenate([self.hits, np.ones(len(new), dtype=np.int64)])
+
+        reported = np.flatnonzero(self.hits[track_of] >= self.min_hits)
+        ids = self.ids[track_of[reported]]
+        alive = self.ages <= self.max_age
+        if not alive.all():
+            self.ids, self.boxes, self.velocities = self.ids[alive], self.boxes[alive], self.velocities[alive]
+            self.ages, self.hits = self.ages[alive], self.hits[alive]
+        return reported, ids
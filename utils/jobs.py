@@ -0,0 +1,84 @@
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+class JobManager:
+    '''
+    Runs background jobs (video processing, compiling, ...) in bounded worker pools.
+
+    Each job kind gets its own pool, so a burst of one kind of job (e.g. large compiles)
+    queues behind its own workers instead of starving the others (e.g. video processing).
+    Exclusive jobs (e.g. benchmarks) wait until no other job of their kind is running, and no other job
+    of their kind starts until they finish.
+    '''
+
+    def __init__(self, max_workers):
+        '''
+        Args:
+            max_workers: Dict {job kind : number of concurrent jobs of this kind}
+        '''
+        self.max_workers = dict(max_workers)
+        self.executors = {kind: ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'{kind}-job')
+                          for kind, workers in self.max_workers.items()}
+        self.queued = defaultdict(int)
+        self.running = defaultdict(int)
+        self.exclusive = defaultdict(bool) # Kind -> an exclusive job is waiting or running
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+
+    def submit(self, kind, fn, *args, **kwargs):
+        '''
+        Queues fn(*args, **kwargs) in the pool of the given job kind.
+
+        Returns:
+            concurrent.futures.Future: Future of the job result
+        '''
+        with self.lock:
+            self.queued[kind] += 1
+        return self.executors[kind].submit(self._run, kind, False, fn, *args, **kwargs)
+
+    def submit_exclusive(self, kind, fn, *args, **kwargs):
+        '''
+        Queues fn(*args, **kwargs) in the pool of the given job kind, to run alone : it starts once the
+        running jobs of its kind have finished, and the other jobs of its kind wait until it finishes.
+
+        Returns:
+            concurrent.futures.Future: Future of the job result
+        '''
+        with self.lock:
+            self.queued[kind] += 1
+        return self.executors[kind].submit(self._run, kind, True, fn, *args, **kwargs)
+
+    def _run(self, kind, exclusive, fn, *args, **kwargs):
+        with self.condition:
+            self.condition.wait_for(lambda: not self.exclusive[kind])
+            if exclusive:
+                self.exclusive[kind] = True # Holds back the jobs starting meanwhile
+                self.condition.wait_for(lambda: self.running[kind] == 0)
+            self.queued[kind] -= 1
+            self.running[kind] += 1
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            # Jobs report their own errors through progress/results, this only guards the worker
+            logging.error(f'Unhandled error in {kind} job: {str(e)}', exc_info=True)
+        finally:
+            with self.condition:
+                self.running[kind] -= 1
+                if exclusive:
+                    self.exclusive[kind] = False
+                self.condition.notify_all()
+
+    def status(self):
+        '''
+        Returns:
+            dict: {job kind : {'workers', 'running', 'queued'}}
+        '''
+        with self.lock:
+            return {kind: {'workers': workers, 'running': self.running[kind], 'queued': self.queued[kind]}
+                    for kind, workers in self.max_workers.items()}
+
+    def shutdown(self, wait=True):
+        for executor in self.executors.values():
+            executor.shutdown(wait=wait)
@@ -0,0 +1,175 @@
+import os
+import json
+import sqlite3
+import logging
+import datetime
+from contextlib import closing
+
+class SessionLog:
+    '''
+    Append-only, indexed log of processing and compiling sessions.
+
+    Replaces the rewrite-on-write JSON logs with a SQLite database :
+    - Each session is a single row, written in its own transaction (no full-file rewrite)
+    - Concurrent writers are serialized by SQLite instead of racing on a shared file
+    - History is queried by page and filters instead of loading every session in memory
+    '''
+    SESSION_TYPES = ('Counting', 'Compiling')
+    STATUSES = ('submitted', 'success', 'error') # Shared by both session types
+    COLUMNS = 'session_type, session_id, timestamp, status, site_location, data'
+
+    def __init__(self, db_path, legacy_logs=None):
+        '''
+        Args:
+            db_path: Path to the SQLite database file (created if missing)
+            legacy_logs: Optional dict {session_type : json_path} of legacy JSON logs to import once
+        '''
+        self.db_path = db_path
+        with closing(self.connect()) as conn, conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS sessions (
+                                session_type TEXT NOT NULL,
+                                session_id TEXT NOT NULL,
+                                timestamp TEXT NOT NULL,
+                                status TEXT,
+                                site_location TEXT,
+                                data TEXT NOT NULL,
+                                PRIMARY KEY (session_type, session_id))''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_time ON sessions (session_type, timestamp)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_site ON sessions (session_type, site_location)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_status ON sessions (session_type, status)')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            # Fingerprint of the job configuration, to reuse the results of identical jobs (added to older databases)
+            if 'fingerprint' not in [column[1] for column in conn.execute('PRAGMA table_info(sessions)')]:
+                conn.execute('ALTER TABLE sessions ADD COLUMN fingerprint TEXT')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_fingerprint ON sessions (session_type, fingerprint)')
+        if legacy_logs:
+            self.import_legacy(legacy_logs)
+
+    def connect(self):
+        # One short-lived connection per operation keeps the log safe to use from any thread
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def import_legacy(self, legacy_logs):
+        '''
+        Imports the sessions of legacy JSON logs, once per file.
+
+        Args:
+            legacy_logs: Dict {session_type : json_path}
+        '''
+        for session_type, json_path in legacy_logs.items():
+            key = f'imported:{os.path.abspath(json_path)}'
+            with closing(self.connect()) as conn:
+                if conn.execute('SELECT 1 FROM meta WHERE key = ?', (key,)).fetchone():
+                    continue
+            if not os.path.exists(json_path):
+                continue
+            try:
+                with open(json_path, 'r') as f:
+                    sessions = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning(f'Could not import legacy session log {json_path}: {str(e)}')
+                continue
+            # Legacy processing logs carry no timestamp : fall back on the file modification time
+            fallback_time = datetime.datetime.fromtimestamp(os.path.getmtime(json_path), datetime.UTC).isoformat()
+            with closing(self.connect()) as conn, conn:
+                for session_id, data in sessions.items():
+                    conn.execute(f'INSERT OR IGNORE INTO sessions ({self.COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)',
+                                 self._row(session_type, session_id, data, timestamp=data.get('timestamp', fallback_time)))
+                conn.execute('INSERT INTO meta VALUES (?, ?)', (key, str(len(sessions))))
+            logging.info(f'Imported {len(sessions)} sessions from legacy log {json_path}.')
+
+    def _row(self, session_type, session_id, data, timestamp=None, status=None):
+        if timestamp is None:
+            timestamp = datetime.datetime.now(datetime.UTC)
+        if isinstance(timestamp, datetime.datetime):
+            timestamp = timestamp.isoformat()
+        form_data = data.get('form_data') or {}
+        site_location = data.get('site_location') or form_data.get('site_location')
+        status = status or data.get('status')
+        return (session_type, session_id, str(timestamp), status, site_location, json.dumps(data, default=str))
+
+    def log(self, session_type, session_id, data, status=None):
+        '''
+        Records a session, replacing any previous record with the same type and ID.
+
+        Args:
+            session_type: 'Counting' or 'Compiling'
+            session_id: Unique identifier of the session
+            data: JSON-serializable dict of session details
+            status: Optional status, defaults to data['status'] if present
+        '''
+        row = self._row(session_type, session_id, data, timestamp=data.get('timestamp'), status=status)
+        with closing(self.connect()) as conn, conn:
+            conn.execute(f'INSERT OR REPLACE INTO sessions ({self.COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)', row)
+
+    def set_status(self, session_type, session_id, status):
+        with closing(self.connect()) as conn, conn:
+            conn.execute('UPDATE sessions SET status = ? WHERE session_type = ? AND session_id = ?',
+                         (status, session_type, session_id))
+
+    def set_fingerprint(self, session_type, session_id, fingerprint):
+        with closing(self.connect()) as conn, conn:
+            conn.execute('UPDATE sessions SET fingerprint = ? WHERE session_type = ? AND session_id = ?',
+                         (fingerprint, session_type, session_id))
+
+    def find_fingerprint(self, session_type, fingerprint, exclude=None):
+        '''
+        Returns:
+            str: ID of the most recent successful session with this fingerprint (other than exclude), or None
+        '''
+        with closing(self.connect()) as conn:
+            row = conn.execute('''SELECT session_id FROM sessions
+                                  WHERE session_type = ? AND fingerprint = ? AND status = 'success' AND session_id != ?
+                                  ORDER BY timestamp DESC LIMIT 1''',
+                               (session_type, fingerprint, exclude or '')).fetchone()
+        return row[0] if row else None
+
+    def get(self, session_type, session_id):
+        '''
+        Returns:
+            dict: The logged session data, or None if the session is unknown
+        '''
+        with closing(self.connect()) as conn:
+            row = conn.execute('SELECT data FROM sessions WHERE session_type = ? AND session_id = ?',
+                               (session_type, session_id)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def query(self, session_type, search=None, status=None, date_from=None, date_to=None, page=1, per_page=50):
+        '''
+        Paginated and filtered listing of logged sessions, most recent first.
+
+        Args:
+            session_type: 'Counting' or 'Compiling'
+            search: Optional substring matched against the session ID and site location
+            status: Optional exact status filter
+            date_from, date_to: Optional ISO dates (inclusive) bounding the session timestamp
+            page: 1-based page number
+            per_page: Number of sessions per page
+
+        Returns:
+            tuple: (list of dicts with session_id, timestamp, status and site_location, total matching count)
+        '''
+        clauses, args = ['session_type = ?'], [session_type]
+        if search:
+            clauses.append('(session_id LIKE ? OR site_location LIKE ?)')
+            args.extend([f'%{search}%', f'%{search}%'])
+        if status:
+            clauses.append('status = ?')
+            args.append(status)
+        if date_from:
+            clauses.append('timestamp >= ?')
+            args.append(str(date_from))
+        if date_to:
+            clauses.append('timestamp < ?')
+            args.append(str(datetime.date.fromisoformat(str(date_to)) + datetime.timedelta(days=1)))
+        where = ' AND '.join(clauses)
+        page = max(1, int(page))
+        with closing(self.connect()) as conn:
+            total = conn.execute(f'SELECT COUNT(*) FROM sessions WHERE {where}', args).fetchone()[0]
+            rows = conn.execute(f'''SELECT session_id, timestamp, status, site_location FROM sessions
+                                    WHERE {where} ORDER BY timestamp DESC LIMIT ? OFFSET ?''',
+                                args + [per_page, (page - 1) * per_page]).fetchall()
+        sessions = [{'session_id': session_id, 'timestamp': timestamp, 'status': status, 'site_location': site_location}
+                    for session_id, timestamp, status, site_location in rows]
+        return sessions, total
@@ -0,0 +1,246 @@
+import os
+import sys
+import json
+import time
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+import psutil
+
+def rss():
+    '''
+    Returns:
+        int: Current resident memory of the process, in bytes
+    '''
+    return psutil.Process().memory_info().rss
+
+def peak_rss():
+    '''
+    Returns:
+        int: Peak resident memory of the process so far, in bytes (current resident memory if the platform has no peak)
+    '''
+    memory = psutil.Process().memory_info()
+    if hasattr(memory, 'peak_wset'): # Windows
+        return memory.peak_wset
+    try:
+        import resource
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024 # Bytes on macOS, KiB on Linux
+    except ImportError:
+        return memory.rss
+
+class StageProfiler:
+    '''
+    Wall time, job thread CPU time, processed items and memory growth of each stage of one job.
+
+    Whole stages (counting, Excel write, ...) are timed with the stage context manager, per-frame stages
+    (decode, inference, tracker association) accumulate their time with add. Job queue depths can be sampled
+    with sample_queues. The result is saved as JSON in the session folder and added to a MetricsRegistry.
+
+    CPU time is that of the job thread only : the intra-op threads of the inference runtime and the shared
+    inference server thread are not included, so it understates inference. Memory growth is the change of the
+    process resident memory during a whole stage (largest over its runs, not measured for per-frame stages),
+    concurrent jobs included.
+    '''
+    FILENAME = 'profile.json'
+
+    def __init__(self):
+        self.stages = defaultdict(lambda: {'wall_s': 0.0, 'thread_cpu_s': 0.0, 'items': 0, 'runs': 0})
+        self.queues = {}
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name, items=0):
+        '''Times the enclosed block as one run of the stage, with the given number of processed items (frames, tracks, ...).'''
+        wall, cpu, memory = time.perf_counter(), time.thread_time(), rss()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, time.thread_time() - cpu, items)
+            delta = rss() - memory
+            self.stages[name]['rss_delta_bytes'] = max(self.stages[name].get('rss_delta_bytes', delta), delta)
+
+    def add(self, name, wall_s, thread_cpu_s, items=1):
+        '''Adds one run of a stage, thread_cpu_s being the CPU time of the job thread (time.thread_time).'''
+        stats = self.stages[name]
+        stats['wall_s'] += wall_s
+        stats['thread_cpu_s'] += thread_cpu_s
+        stats['items'] += items
+        stats['runs'] += 1
+
+    def set_items(self, name, items):
+        self.stages[name]['items'] = items
+
+    def sample_queues(self, job_status):
+        '''Keeps the maximum queued jobs per kind, given JobManager.status().'''
+        for kind, status in job_status.items():
+            self.queues[kind] = max(self.queues.get(kind, 0), status['queued'])
+
+    def summary(self):
+        '''
+        Returns:
+            dict: Per stage wall/job thread CPU seconds, items, items per second and RSS growth, total wall time, process peak RSS and max queue depths
+        '''
+        return {
+            'wall_s': time.perf_counter() - self.start,
+            'peak_rss_bytes': peak_rss(),
+            'max_queued_jobs': dict(self.queues),
+            'stages': {name: {**stats, 'items_per_s': stats['items'] / stats['wall_s'] if stats['wall_s'] else 0.0}
+                       for name, stats in self.stages.items()},
+        }
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=4)
+
+class MetricsRegistry:
+    '''
+    Process-wide totals of the finished jobs' stages, rendered in the Prometheus text format for /metrics.
+    '''
+    PREFIX = 'mva'
+
+    def __init__(self):
+        self.totals = defaultdict(lambda: defaultdict(float))
+        self.jobs = 0
+        self.lock = threading.Lock()
+
+    def record(self, profiler):
+        with self.lock:
+            self.jobs += 1
+            for name, stats in profiler.stages.items():
+                for key in ('wall_s', 'thread_cpu_s', 'items', 'runs'):
+                    self.totals[name][key] += stats[key]
+
+    def render(self, gauges=()):
+        '''
+        Args:
+            gauges: Current values to expose as (name, help, {label tuple: value}), e.g. queue depths
+
+        Returns:
+            str: Metrics in the Prometheus text exposition format
+        '''
+        lines = []
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {self.PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {self.PREFIX}_{name} {kind}')
+            for labels, value in samples.items():
+                label_text = ','.join(f'{key}="{str(label).replace('"', '')}"' for key, label in labels)
+                lines.append(f'{self.PREFIX}_{name}{{{label_text}}} {value}' if label_text else f'{self.PREFIX}_{name} {value}')
+
+        with self.lock:
+            metric('jobs_profiled_total', 'counter', 'Processing jobs finished with a profile.', {(): self.jobs})
+            for key, name, help_text in (('wall_s', 'stage_seconds_total', 'Wall time spent in each processing stage.'),
+                                         ('thread_cpu_s', 'stage_thread_cpu_seconds_total', 'CPU time of the job threads in each processing stage, without inference runtime and server threads.'),
+                                         ('items', 'stage_items_total', 'Items (frames, tracks, crossings) processed by each stage.'),
+                                         ('runs', 'stage_runs_total', 'Runs of each stage (frames for per-frame stages).')):
+                metric(name, 'counter', help_text, {(('stage', stage),): totals[key] for stage, totals in sorted(self.totals.items())})
+        metric('process_peak_rss_bytes', 'gauge', 'Peak resident memory of the server process.', {(): peak_rss()})
+        metric('process_rss_bytes', 'gauge', 'Resident memory of the server process.', {(): rss()})
+        for name, help_text, samples in gauges:
+            metric(name, 'gauge', help_text, samples)
+        return '\n'.join(lines) + '\n'
+
+class SamplingProfiler:
+    '''
+    Statistical profiler of one thread (the job worker by default) : a daemon thread records the Python call stack
+    of the target thread every interval_s, so the job runs unmodified and the overhead stays in the sampling thread.
+
+    Stacks are saved in the collapsed format ('outer;inner;leaf count' per line) read by flamegraph.pl, speedscope
+    and inferno, with a JSON summary of the functions most often running (self) or on the stack (total).
+    Native code (inference runtimes, OpenCV) shows as the Python call into it.
+    '''
+    FOLDED_FILENAME = 'sampling_profile.folded'
+    SUMMARY_FILENAME = 'sampling_profile.json'
+
+    def __init__(self, interval_s=0.01, max_depth=128):
+        '''
+        Args:
+            interval_s: Time between two samples, in seconds
+            max_depth: Deepest frames kept per stack (outermost frames are dropped beyond)
+        '''
+        self.interval_s = interval_s
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self.sampling_s = 0.0 # Time spent taking samples, i.e. the overhead
+        self.duration_s = 0.0
+        self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self, thread_id=None):
+        '''
+        Args:
+            thread_id: Identifier of the thread to sample, the calling thread if None
+        '''
+        self.target = thread_id or threading.get_ident()
+        self.stopped = threading.Event()
+        self.started = time.perf_counter()
+        self.thread = threading.Thread(target=self.sample_loop, name='sampling-profiler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+        self.duration_s += time.perf_counter() - self.started
+
+    def sample_loop(self):
+        while not self.stopped.wait(self.interval_s):
+            start = time.perf_counter()
+            frame = sys._current_frames().get(self.target)
+            if frame is None: # Target thread finished
+                break
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f'{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            del frame
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+            self.sampling_s += time.perf_counter() - start
+
+    def summary(self, top=30):
+        '''
+        Returns:
+            dict: Sampling settings, number of samples, overhead and the top functions by self and total samples
+        '''
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            functions = stack.split(';')
+            own[functions[-1]] += count
+            for function in set(functions): # Once per stack, recursion is not counted twice
+                total[function] += count
+        def ranked(counts):
+            return [{'function': function, 'samples': count, 'share': count / self.samples} for function, count in counts.most_common(top)]
+        return {
+            'interval_s': self.interval_s,
+            'duration_s': self.duration_s,
+            'samples': self.samples,
+            'sampling_overhead_s': self.sampling_s,
+            'self': ranked(own),
+            'total': ranked(total),
+        }
+
+    def save(self, folder):
+        '''
+        Writes the collapsed stacks and the JSON summary in a folder.
+
+        Returns:
+            list: Paths of the written files
+        '''
+        os.makedirs(folder, exist_ok=True)
+        folded_path, summary_path = os.path.join(folder, self.FOLDED_FILENAME), os.path.join(folder, self.SUMMARY_FILENAME)
+        with open(folded_path, 'w', encoding='utf-8') as f:
+            f.writelines(f'{stack} {count}\n' for stack, count in sorted(self.stacks.items()))
+        with open(summary_path, 'w') as f:
+            json.dump(self.summary(), f, indent=4)
+        return [folded_path, summary_path]
@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import shutil
+import logging
+import importlib.util
+import cv2
+import yaml
+import numpy as np
+from ultralytics import YOLO
+from utils.tracking import Tracker, Counter
+from utils.reuse import file_digest
+
+class ModelQuantizer:
+    '''
+    Prepares quantized CPU variants of a .pt model, calibrated on site footage.
+
+    Calibration frames are sampled from the site's own videos, except a held-out clip (the end of the first
+    video). The model is exported to INT8 OpenVINO (NNCF post-training quantization), FP16 OpenVINO and
+    INT8 ONNX (ONNX Runtime static quantization). Each variant, and the FP32 model, then tracks and counts
+    the held-out clip : the report gives their speed and count agreement with the FP32 model, so a faster
+    variant can be approved with confidence (see approve).
+    '''
+    REPORT_FILE = 'quantization.json'
+
+    def __init__(self, export_dir, imgsz=640, calibration_frames=300, holdout_s=120):
+        '''
+        Args:
+            export_dir: Folder receiving the variants, calibration frames and reports (one sub-folder per model)
+            imgsz: Image size of the exported variants
+            calibration_frames: Number of calibration frames sampled across the videos
+            holdout_s: Duration of the held-out evaluation clip, in seconds
+        '''
+        self.export_dir = export_dir
+        self.imgsz = imgsz
+        self.calibration_frames = calibration_frames
+        self.holdout_s = holdout_s
+
+    def model_dir(self, model_path):
+        return os.path.join(self.export_dir, file_digest(model_path)[:16])
+
+    def sample_frames(self, video_paths, folder, holdout):
+        '''
+        Saves evenly spaced frames of the videos as calibration images.
+
+        Args:
+            video_paths: Site videos
+            folder: Folder receiving the images
+            holdout: (video path, start frame) : frames of this video from start frame on are not sampled
+
+        Returns:
+            list: Paths of the saved images
+        '''
+        os.makedirs(folder, exist_ok=True)
+        ranges = []
+        for video_path in video_paths:
+            cap = cv2.VideoCapture(video_path)
+            frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            cap.release()
+            ranges.append((video_path, holdout[1] if video_path == holdout[0] else frame_count))
+        total = sum(end for _, end in ranges)
+        if not total:
+            raise ValueError('No calibration frames available outside of the held-out clip.')
+
+        image_paths = []
+        for index, (video_path, end) in enumerate(ranges):
+            cap = cv2.VideoCapture(video_path)
+            for frame_nb in np.linspace(0, end, max(1, round(self.calibration_frames * end / total)), endpoint=False).astype(int):
+                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_nb)
+                success, frame = cap.read()
+                if success:
+                    image_paths.append(os.path.join(folder, f'{index:03d}_{frame_nb:08d}.jpg'))
+                    cv2.imwrite(image_paths[-1], frame)
+            cap.release()
+        return image_paths
+
+    def write_dataset(self, folder, names):
+        '''Writes the dataset YAML Ultralytics uses to calibrate INT8 exports (images only, no labels are needed).'''
+        data_path = os.path.join(folder, 'calibration.yaml')
+        with open(data_path, 'w') as f:
+            yaml.safe_dump({'path': folder, 'train': 'images', 'val': 'images', 'names': names}, f)
+        return data_path
+
+    def export_openvino(self, model_path, data_path, int8):
+        exported = YOLO(model_path, task='detect').export(format='openvino', imgsz=self.imgsz, int8=int8, half=not int8, data=data_path)
+        return self.move(exported, model_path, f'{"int8" if int8 else "fp16"}_openvino_model')
+
+    def export_onnx_int8(self, model_path, image_paths):
+        from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+        fp32_path = self.move(YOLO(model_path, task='detect').export(format='onnx', imgsz=self.imgsz), model_path, 'fp32.onnx')
+        imgsz = self.imgsz
+
+        class FrameReader(CalibrationDataReader):
+            def __init__(self, input_name):
+                self.batches = ({input_name: ModelQuantizer.preprocess(cv2.imread(path), imgsz)} for path in image_paths)
+            def get_next(self):
+                return next(self.batches, None)
+
+        import onnx
+        input_name = onnx.load(fp32_path).graph.input[0].name
+        int8_path = fp32_path.replace('_fp32.onnx', '_int8.onnx')
+        quantize_static(fp32_path, int8_path, FrameReader(input_name), quant_format=QuantFormat.QDQ,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, per_channel=True)
+        # Ultralytics reads the class names and image size from the model metadata
+        model, source = onnx.load(int8_path), onnx.load(fp32_path)
+        del model.metadata_props[:]
+        model.metadata_props.extend(source.metadata_props)
+        onnx.save(model, int8_path)
+        return int8_path
+
+    @staticmethod
+    def preprocess(frame, imgsz):
+        '''Letterboxes a BGR frame like Ultralytics : RGB, NCHW, float32 in [0, 1].'''
+        height, width = frame.shape[:2]
+        scale = min(imgsz / height, imgsz / width)
+        resized = cv2.resize(frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_LINEAR)
+        canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+        top, left = (imgsz - resized.shape[0]) // 2, (imgsz - resized.shape[1]) // 2
+        canvas[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+        return np.ascontiguousarray(canvas[:, :, ::-1].transpose(2, 0, 1)[None], dtype=np.float32) / 255
+
+    def move(self, exported, model_path, suffix):
+        stem = os.path.splitext(os.path.basename(model_path))[0]
+        target = os.path.join(self.model_dir(model_path), f'{stem}_{self.imgsz}_{suffix}')
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(target):
+            shutil.rmtree(target) if os.path.isdir(target) else os.remove(target)
+        shutil.move(exported, target)
+        return target
+
+    def evaluate(self, variant_path, data_manager):
+        '''
+        Tracks and counts the held-out clip (data_manager.time_windows) with a model variant.
+
+        Returns:
+            dict: frames_per_s and counts per direction and class
+        '''
+        data_manager.clear_tracking()
+        data_manager.inference_config = {'model_path': variant_path, 'imgsz': self.imgsz}
+        start = time.perf_counter()
+        Tracker(data_manager).process_video(data_manager)
+        elapsed = time.perf_counter() - start
+        Counter(data_manager).count(data_manager)
+        frames = sum(end - start for start, end in data_manager.time_windows)
+        return {'frames_per_s': frames / elapsed, 'counts': Counter.totals(data_manager)}
+
+    def prepare(self, model_path, data_manager, video_paths, progress_callback=None):
+        '''
+        Exports and evaluates the quantized variants of a model.
+
+        Args:
+            model_path: Uploaded .pt model
+            data_manager: DataManager configured like a counting job of the site (first video, triplines, directions, names)
+            video_paths: Site videos to sample calibration frames from (including data_manager.video_path)
+            progress_callback: Optional callback function to report progress
+
+        Returns:
+            dict: Report with the FP32 reference and each variant's path, speedup and count agreement
+        '''
+        if not model_path.endswith('.pt'):
+            raise ValueError('Quantized variants are exported from .pt models only.')
+        folder = self.model_dir(model_path)
+        holdout_start = max(0, data_manager.frame_count - int(self.holdout_s * data_manager.fps))
+        data_manager.time_windows = [(holdout_start, data_manager.frame_count)]
+
+        calibration_dir = os.path.join(folder, 'calibration')
+        shutil.rmtree(calibration_dir, ignore_errors=True)
+        image_paths = self.sample_frames(video_paths, os.path.join(calibration_dir, 'images'), (data_manager.video_path, holdout_start))
+        data_path = self.write_dataset(calibration_dir, data_manager.names)
+        logging.info(f'Sampled {len(image_paths)} calibration frames from {len(video_paths)} videos.')
+
+        exports = {}
+        if importlib.util.find_spec('openvino') and importlib.util.find_spec('nncf'):
+            exports['openvino-int8'] = lambda: self.export_openvino(model_path, data_path, int8=True)
+        if importlib.util.find_spec('openvino'):
+            exports['openvino-fp16'] = lambda: self.export_openvino(model_path, data_path, int8=False)
+        if importlib.util.find_spec('onnxruntime') and importlib.util.find_spec('onnx'):
+            exports['onnx-int8'] = lambda: self.export_onnx_int8(model_path, image_paths)
+        if not exports:
+            raise ValueError('No quantization backend installed (openvino with nncf, or onnxruntime).')
+
+        steps = len(exports) + 1
+        reference = self.evaluate(model_path, data_manager)
+        report = {'model_path': model_path, 'imgsz': self.imgsz, 'calibration_frames': len(image_paths),
+                  'holdout': {'video_path': data_manager.video_path, 'start_frame': holdout_start, 'end_frame': data_manager.frame_count},
+                  'reference': reference, 'variants': {}}
+        if progress_callback:
+            progress_callback(int(100 / steps))
+        for step, (name, export) in enumerate(exports.items(), start=2):
+            try:
+                variant_path = export()
+                result = self.evaluate(variant_path, data_manager)
+                result.update({'model_path': variant_path, 'speedup': result['frames_per_s'] / reference['frames_per_s'],
+                               'count_agreement': Counter.agreement(result['counts'], reference['counts'])})
+            except Exception as e:
+                logging.warning(f'Quantized variant {name} failed: {str(e)}', exc_info=True)
+                result = {'error': str(e)}
+            report['variants'][name] = result
+            if progress_callback:
+                progress_callback(int(step / steps * 100))
+
+        with open(os.path.join(folder, self.REPORT_FILE), 'w') as f:
+            json.dump(report, f, indent=4)
+        return report
+
+    def load_report(self, model_path):
+        try:
+            with open(os.path.join(self.model_dir(model_path), self.REPORT_FILE), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def approve(self, model_path, variant, backend_tuner):
+        '''
+        Makes later jobs with the model run one of its evaluated variants.
+
+        Args:
+            model_path: Uploaded .pt model
+            variant: Name of the variant in the report (e.g. 'openvino-int8')
+            backend_tuner: BackendTuner whose configuration of the model is replaced
+
+        Returns:
+            dict: The saved configuration
+
+        Raises:
+            ValueError: If the variant was not prepared successfully
+        '''
+        result = (self.load_report(model_path) or {}).get('variants', {}).get(variant)
+        if not result or 'error' in result:
+            raise ValueError(f'No prepared variant {variant!r} for this model.')
+        config = {'runtime': variant, 'model_path': result['model_path'], 'imgsz': self.imgsz, 'threads': None,
+                  'frames_per_s': result['frames_per_s'], 'count_agreement': result['count_agreement'], 'approved': True}
+        backend_tuner.save(model_path, config)
+        return config
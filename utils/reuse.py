@@ -0,0 +1,99 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from utils import DETECTION_MODEL_CONST
+
+# Bump when a change of the processing pipeline changes its results, so older results are not reused
+PIPELINE_VERSION = 1
+
+_digests = {} # (path, size, mtime) -> digest, so unchanged uploads are only hashed once per server
+_digests_lock = threading.Lock()
+
+def file_digest(path, chunk_size=4 * 1024 * 1024):
+    '''
+    Returns:
+        str: SHA-256 hex digest of a file, or of every file of a folder (e.g. an OpenVINO model)
+    '''
+    if os.path.isdir(path):
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for filename in sorted(files):
+                file_path = os.path.join(root, filename)
+                digest.update(os.path.relpath(file_path, path).encode())
+                digest.update(file_digest(file_path).encode())
+        return digest.hexdigest()
+
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _digests_lock:
+        if key in _digests:
+            return _digests[key]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    with _digests_lock:
+        _digests[key] = digest.hexdigest()
+    return _digests[key]
+
+def job_fingerprint(data_manager):
+    '''
+    Fingerprint of everything that determines the results of a counting job : video and model contents,
+    tracker, detection thresholds, triplines, directions, site, timing and export settings.
+
+    Args:
+        data_manager: Configured DataManager of the job
+
+    Returns:
+        str: SHA-256 hex digest of the job configuration
+    '''
+    config = {
+        'pipeline_version': PIPELINE_VERSION,
+        'video': file_digest(data_manager.video_path),
+        'model': file_digest(data_manager.selected_model),
+        'inference_tracker': data_manager.inference_tracker,
+        'inference_config': {key: value for key, value in (data_manager.inference_config or {}).items() if key in ('runtime', 'imgsz', 'threads')},
+        'thresholds': vars(DETECTION_MODEL_CONST),
+        'triplines': data_manager.triplines,
+        'directions': data_manager.directions,
+        'site_location': data_manager.site_location,
+        'start_datetime': data_manager.start_datetime.isoformat(),
+        'time_windows': data_manager.time_windows,
+        'ffmpeg_decoder': bool(data_manager.ffmpeg_decoder),
+        'do_video_export': data_manager.do_video_export,
+        'export_formats': sorted(data_manager.export_formats),
+        'do_tracks_export': data_manager.do_tracks_export,
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+def link_results(source_dir, target_dir, required, skip=()):
+    '''
+    Links the result files of a previous job into a new session folder (hard links, copies as a fallback).
+    Files already in the target folder (e.g. its first frame) and sub-folders are left as is.
+
+    Args:
+        source_dir: Session folder of the previous job
+        target_dir: Session folder of the new job
+        required: File names that must exist in source_dir (e.g. the report)
+        skip: File names not to link
+
+    Returns:
+        bool: True if the results were linked, False if some required file is missing
+    '''
+    if not all(os.path.isfile(os.path.join(source_dir, filename)) for filename in required):
+        return False
+    os.makedirs(target_dir, exist_ok=True)
+    for filename in os.listdir(source_dir):
+        source_path, target_path = os.path.join(source_dir, filename), os.path.join(target_dir, filename)
+        if filename in skip or not os.path.isfile(source_path) or os.path.exists(target_path):
+            continue
+        try:
+            os.link(source_path, target_path)
+        except OSError: # e.g. file system without hard links
+            shutil.copy2(source_path, target_path)
+    logging.info(f'Reused the results of {source_dir} in {target_dir}.')
+    return True
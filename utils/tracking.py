@@ -1,11 +1,17 @@
 from collections import defaultdict
+import os
+import time
 import logging
 from tqdm import tqdm
 from tqdm.contrib.logging import logging_redirect_tqdm
 from ultralytics import YOLO
+import torch
 import cv2
 import numpy as np
 from utils import DESC_WIDTH, DETECTION_MODEL_CONST
+from utils.checkpoint import match_track_ids
+from utils.iou_tracker import IoUTracker
+from utils.frames import FFmpegFrameSource
 
 class Counter:
     '''
@@ -136,6 +142,27 @@ class Counter:
                 obj_count += 1 
         console_progress.close()
 
+    @staticmethod
+    def totals(data_manager):
+        '''
+        Returns:
+            dict: Number of counted objects per 'direction / class', each object counted once at its last crossing
+        '''
+        totals = defaultdict(int)
+        for crossings in data_manager.CROSSED.values():
+            if crossings:
+                totals[f'{crossings[-1][2]} / {data_manager.names[crossings[-1][1]]}'] += 1
+        return dict(sorted(totals.items()))
+
+    @staticmethod
+    def agreement(totals, reference):
+        '''Share of the reference counts matched per direction and class (1.0 for identical counts), see totals.'''
+        total = sum(reference.values())
+        if not total:
+            return 1.0 if not totals else 0.0
+        keys = set(totals) | set(reference)
+        return 1 - sum(abs(totals.get(key, 0) - reference.get(key, 0)) for key in keys) / total
+
     def CP(self, START, END, A, B): #Cross Product (Positive means B is on left side of S-E, negative B is on the right and 0 is S-E and A-B colinear)
         # Visualise right-hand rule : index is Start-End(tripline), middle finger is A-B and thumb is CP. 
         return (B['x'] - A['x']) * (END['y'] - START['y']) - (B['y'] - A['y']) * (END['x'] - START['x'])
@@ -153,14 +180,25 @@ class Tracker:
     Processes video frames to detect and track objects, maintaining their
     position and class information throughout the video.
     '''
-    def __init__(self, data_manager, progress_callback=None, verbose=False):
+    def __init__(self, data_manager, progress_callback=None, verbose=False, cpu_lease=None, inference_server=None, profiler=None, model=None):
         '''
         Args:
             data_manager: DataManager instance containing video and model settings
             progress_callback: Optional callback function to report progress (for flask client calls)
             verbose: Boolean to control logging verbosity
+            cpu_lease: Optional CpuLease, share of the cores given to this job's inference runtime (see CpuBudget)
+            inference_server: Optional InferenceServer running detection on a model shared with other sessions,
+                tracking then runs here on its detections instead of within the model. Only used for .pt models,
+                exported models run on their own instance
+            profiler: Optional StageProfiler receiving the decode, inference and association time of each frame
+            model: Optional detection model used instead of loading data_manager.selected_model, with the predict and
+                track methods of an Ultralytics YOLO (e.g. the deterministic stub of the benchmarks), reused as is when tracks reset
         '''
+        self.profiler = profiler
+        self.inference_time = (0.0, 0.0) # Wall and job thread CPU seconds of the last detection
         self.progress_callback = progress_callback
+        self.cpu_lease = cpu_lease
+        self.applied_lease = None # (lease generation, inference backend) last configured
         self.video_path = data_manager.video_path
         self.selected_model = data_manager.selected_model
         self.inference_tracker = data_manager.inference_tracker
@@ -169,57 +207,262 @@ class Tracker:
         if DETECTION_MODEL_CONST.ALLOW_RESIZE and data_manager.model_type =='.pt': #Only pt models support resizing
             self.image_size = [32 * (data_manager.width//32) + 32 * min (1,data_manager.width%32), 32 * (data_manager.height//32) + 32 * min (1,data_manager.height%32)] # Input size must be a multiple of max stride 32
         else : self.image_size = [640, 640]
-        # Load YOLO model
-        self.model = YOLO(self.selected_model, task='detect')
+        # Runtime, image size and threads measured fastest for this model (see BackendTuner)
+        self.tuned_threads = None
+        if data_manager.inference_config:
+            self.selected_model = data_manager.inference_config['model_path']
+            self.image_size = data_manager.inference_config['imgsz']
+            self.tuned_threads = data_manager.inference_config.get('threads')
+            if self.tuned_threads and cpu_lease is None: # Otherwise capped by the lease, see apply_cpu_lease
+                torch.set_num_threads(self.tuned_threads)
+        # Load YOLO model, unless given or detection is served by the shared inference server (batchable .pt models only)
+        self.inference_server = inference_server if self.selected_model.endswith('.pt') else None
+        self.given_model = model
+        self.model = model if model is not None else YOLO(self.selected_model, task='detect') if self.inference_server is None else None
+        # The built-in IoU tracker only needs detections, other trackers run within Ultralytics or on served detections
+        self.iou_tracker = IoUTracker() if self.inference_tracker == IoUTracker.NAME else None
+        self.session_tracker = self.new_session_tracker() if self.inference_server is not None and self.iou_tracker is None else None
+        self.inference_args = dict(imgsz=self.image_size, verbose=self.verbose, device=self.device_name, save=False, conf=DETECTION_MODEL_CONST.CONF_THRESHOLD, iou=DETECTION_MODEL_CONST.IOU_THRESHOLD, agnostic_nms=DETECTION_MODEL_CONST.AGNOSTIC_NMS)
 
         self.current_frame = None
         self.current_frame_nb = 0
+        self.id_map = {} # Tracker ID -> recorded ID, set when resuming from a checkpoint
+        self.id_offset = 0
+        self.detection_log = None
+
+    def apply_cpu_lease(self):
+        '''
+        Configures the threads of the inference runtime to the current share of the job, capped by the tuned
+        thread count, once the model has run (Ultralytics only creates its backend on the first inference) and
+        again after each rebalance. OpenVINO models are recompiled with one stream, ONNX Runtime sessions are recreated.
+        '''
+        backend = getattr(getattr(self.model, 'predictor', None), 'model', None)
+        if self.cpu_lease is None or backend is None or self.applied_lease == (self.cpu_lease.generation, id(backend)):
+            return
+        threads = self.lease_threads()
+        torch.set_num_threads(threads) # Process wide, each job sets its own share when it is (re)configured
+        if getattr(backend, 'ov_compiled_model', None) is not None and hasattr(backend, 'core') and hasattr(backend, 'ov_model'):
+            backend.ov_compiled_model = backend.core.compile_model(backend.ov_model, device_name='CPU', config={
+                'PERFORMANCE_HINT': 'LATENCY', 'NUM_STREAMS': 1, 'INFERENCE_NUM_THREADS': threads})
+        elif getattr(backend, 'session', None) is not None and hasattr(backend.session, 'get_providers'):
+            import onnxruntime
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+            backend.session = onnxruntime.InferenceSession(backend.session._model_path, options, providers=backend.session.get_providers())
+        self.applied_lease = (self.cpu_lease.generation, id(backend))
+        logging.info(f'Inference of {os.path.basename(self.video_path)} set to {threads} threads.')
+
+    def lease_threads(self):
+        '''
+        Returns:
+            int: Current share of the job, capped by the tuned thread count, None without a CPU lease
+        '''
+        if self.cpu_lease is None:
+            return None
+        return min(self.cpu_lease.threads, self.tuned_threads or self.cpu_lease.threads)
+
+    def new_session_tracker(self):
+        '''Creates the Ultralytics tracker (ByteTrack, BoT-SORT) of inference_tracker, as model.track does.'''
+        from ultralytics.trackers.track import TRACKER_MAP
+        from ultralytics.utils import IterableSimpleNamespace, yaml_load
+        from ultralytics.utils.checks import check_yaml
+        config = IterableSimpleNamespace(**yaml_load(check_yaml(self.inference_tracker)))
+        return TRACKER_MAP[config.tracker_type](args=config, frame_rate=30)
 
     def read_next_frame(self):
         self.success, self.current_frame = self.cap.read()
 
+    def open_video(self, data_manager):
+        '''
+        Returns:
+            FFmpegFrameSource if data_manager.ffmpeg_decoder is set (frames pre-scaled to the model input size), else cv2.VideoCapture
+        '''
+        if not data_manager.ffmpeg_decoder:
+            return cv2.VideoCapture(self.video_path)
+        source = FFmpegFrameSource(self.video_path, max(np.atleast_1d(self.image_size)), ffmpeg_path=data_manager.ffmpeg_decoder)
+        self.inference_args['imgsz'] = source.size # Frames already have the model input size
+        return source
+
+    def track(self):
+        '''
+        Runs detection and tracking on the current frame.
+
+        Returns:
+            tuple: (xywh boxes in source video pixels, list of track IDs or None, classes, confidences) of the tracked detections
+        '''
+        boxes, track_ids, classes, confidences = self.track_frame()
+        if track_ids is not None and isinstance(self.cap, FFmpegFrameSource):
+            boxes = self.cap.to_source(boxes)
+        return boxes, track_ids, classes, confidences
+
+    def track_frame(self):
+        '''Runs detection and tracking on the current frame, boxes are in current frame pixels.'''
+        wall, cpu = time.perf_counter(), time.thread_time()
+        if self.inference_server is not None:
+            boxes = self.inference_server.predict(self.selected_model, self.current_frame, threads=self.lease_threads(), **self.inference_args).boxes
+        elif self.iou_tracker is not None:
+            boxes = self.model.predict(self.current_frame, **self.inference_args)[0].boxes
+        self.inference_time = (time.perf_counter() - wall, time.thread_time() - cpu)
+        if self.session_tracker is not None:
+            tracks = self.session_tracker.update(boxes.cpu().numpy(), self.current_frame) # x1, y1, x2, y2, id, conf, cls, index
+            if not len(tracks):
+                return np.empty((0, 4)), None, [], []
+            xywh = np.column_stack(((tracks[:, 0] + tracks[:, 2]) / 2, (tracks[:, 1] + tracks[:, 3]) / 2, tracks[:, 2] - tracks[:, 0], tracks[:, 3] - tracks[:, 1]))
+            return xywh, tracks[:, 4].astype(int).tolist(), tracks[:, 6], tracks[:, 5]
+        if self.iou_tracker is not None:
+            xywh = boxes.xywh.cpu().numpy()
+            kept, track_ids = self.iou_tracker.update(xywh)
+            return xywh[kept], track_ids.tolist() if len(kept) else None, boxes.cls.cpu().numpy()[kept], boxes.conf.cpu().numpy()[kept]
+        result = self.model.track(self.current_frame, persist=True, tracker=self.inference_tracker, **self.inference_args)[0]
+        # Detection and association run together, Ultralytics times the detection steps (in ms)
+        wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+        speed = getattr(result, 'speed', None)
+        inference_wall = min(wall, sum(speed.values()) / 1000) if speed else wall
+        self.inference_time = (inference_wall, cpu * inference_wall / wall if wall else 0.0)
+        boxes = result.boxes
+        track_ids = boxes.id.int().cpu().tolist() if boxes.id is not None else None
+        return boxes.xywh.cpu(), track_ids, boxes.cls, boxes.conf
+
     def process_frame(self, data_manager):
-        results = self.model.track(self.current_frame, imgsz=self.image_size, persist=True, verbose=self.verbose, tracker=self.inference_tracker, device=self.device_name, save=False, conf=DETECTION_MODEL_CONST.CONF_THRESHOLD, iou=DETECTION_MODEL_CONST.IOU_THRESHOLD, agnostic_nms=DETECTION_MODEL_CONST.AGNOSTIC_NMS)
-        boxes = results[0].boxes.xywh.cpu()
-        track_ids = results[0].boxes.id
-        classes = results[0].boxes.cls
-        confidences = results[0].boxes.conf
+        boxes, track_ids, classes, confidences = self.track()
 
         track_inf = []
+        logged = []
         if track_ids is not None:
-            track_ids = results[0].boxes.id.int().cpu().tolist() 
             for box, track_id, clss, confidence in zip(boxes, track_ids, classes, confidences):
+                track_id = self.id_map.get(track_id, track_id + self.id_offset) # IDs of a resumed job continue the recorded ones
                 track_dat = data_manager.TRACK_DATA[track_id] #track_data is indexed by track_id : for a given object, see which frames it's been tracked on, where it is and what it is
                 clss = int(clss)
                 track_dat.append((int(self.current_frame_nb), box, confidence, clss))
                 track_inf.append((track_id, len(track_dat)))
+                logged.append((track_id, box, confidence, clss))
 
+        if self.detection_log is not None:
+            self.detection_log.append_frame(int(self.current_frame_nb), logged)
         data_manager.TRACK_INFO.append(track_inf) #TRACK_INFO is indexed by frame : for a given frame, see which objects are where, and how long they've been tracked
 
-    def process_video(self, data_manager): 
+    def resume(self, data_manager, checkpoint):
+        '''
+        Restores the tracking data of a checkpoint and seeks the video to resume after it.
+
+        The tracker state itself is not saved : the frames just before the checkpoint are tracked again
+        (without being recorded) so the tracker converges, and the IDs it gives are matched to the
+        recorded ones by box overlap, so objects present across the interruption keep their ID.
+        Other new IDs are offset past the recorded ones.
+
+        Args:
+            data_manager: DataManager instance receiving the restored tracking data
+            checkpoint: Checkpoint to resume from
+        '''
+        resume_frame = checkpoint.restore(data_manager)
+        warmup_start = max(0, resume_frame - checkpoint.warmup_frames)
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, warmup_start)
+
+        votes = defaultdict(lambda: defaultdict(int)) # New ID -> recorded ID -> number of frames matched
+        for frame_nb in range(warmup_start, resume_frame):
+            self.read_next_frame()
+            if not self.success:
+                break
+            boxes, track_ids, _, _ = self.track()
+            if track_ids is None:
+                continue
+            detected = list(zip(track_ids, np.asarray(boxes)))
+            recorded = [(track_id, data_manager.TRACK_DATA[track_id][length - 1][1]) for track_id, length in data_manager.TRACK_INFO[frame_nb]]
+            for detected_id, recorded_id in match_track_ids(recorded, detected):
+                votes[detected_id][recorded_id] += 1
+
+        self.id_offset = max(data_manager.TRACK_DATA, default=0)
+        self.id_map = {}
+        for _, detected_id, recorded_id in sorted(((n, detected_id, recorded_id) for detected_id, matches in votes.items()
+                                                   for recorded_id, n in matches.items()), reverse=True):
+            if detected_id not in self.id_map and recorded_id not in self.id_map.values():
+                self.id_map[detected_id] = recorded_id
+        self.current_frame_nb = resume_frame
+        logging.info(f'Resuming at frame {resume_frame}, {len(self.id_map)} tracks continued after {resume_frame - warmup_start} warm-up frames.')
+
+    def reset_tracking(self, data_manager):
+        '''Starts new tracks (e.g. after a gap between time windows), with IDs following the recorded ones.'''
+        if self.iou_tracker is not None:
+            self.iou_tracker = IoUTracker()
+        elif self.session_tracker is not None:
+            self.session_tracker = self.new_session_tracker()
+        elif self.given_model is None:
+            self.model = YOLO(self.selected_model, task='detect') # The tracker state lives in the model predictor
+        self.id_map = {}
+        self.id_offset = max(data_manager.TRACK_DATA, default=0)
+
+    def process_video(self, data_manager, checkpoint=None, detection_log=None):
+        '''
+        Tracks the whole video, or only the frames of data_manager.time_windows : the video is seeked to
+        each window and frames outside of them are neither decoded nor inferred. Frame numbers stay absolute.
+
+        Args:
+            data_manager: DataManager instance receiving the tracking data
+            checkpoint: Optional Checkpoint, saved periodically and resumed from if it exists
+            detection_log: Optional DetectionLog receiving every detection (continued from the checkpoint when resuming)
+        '''
         # Open video to process
-        self.cap = cv2.VideoCapture(self.video_path)
+        self.cap = self.open_video(data_manager)
         self.frame_count = data_manager.frame_count
+        if checkpoint is not None and checkpoint.exists():
+            self.resume(data_manager, checkpoint)
+        self.detection_log = detection_log
+        if detection_log is not None:
+            detection_log.open(data_manager, resume_frame=self.current_frame_nb)
 
-        self.console_progress = tqdm(total=self.frame_count, desc=f'{'YOLO is working':<{DESC_WIDTH}}', unit='frames', dynamic_ncols=True)
+        windows = data_manager.time_windows or [(0, None)]
+        total_frames = sum(end - start for start, end in data_manager.time_windows) if data_manager.time_windows else int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        processed_frames = sum(min(end, self.current_frame_nb) - start for start, end in windows if start < self.current_frame_nb) if data_manager.time_windows else self.current_frame_nb
+        self.console_progress = tqdm(total=total_frames, initial=processed_frames, desc=f'{'YOLO is working':<{DESC_WIDTH}}', unit='frames', dynamic_ncols=True)
         # Run inference and tracking
-        total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        current_frame = 0
         with logging_redirect_tqdm():
-            while self.cap.isOpened():
-                self.read_next_frame()
-                if self.success:
-                    self.process_frame(data_manager)
+            for start, end in windows:
+                if end is not None and end <= self.current_frame_nb:
+                    continue # Already processed before resuming
+                if start > self.current_frame_nb:
+                    if self.current_frame_nb > 0: # Tracks do not continue across the gap
+                        self.reset_tracking(data_manager)
+                    # Skipped frames are recorded empty, so TRACK_INFO stays indexed by absolute frame number
+                    data_manager.TRACK_INFO.pad(start)
+                    self.current_frame_nb = start
+                    self.cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+                while self.cap.isOpened() and (end is None or self.current_frame_nb < end):
+                    if self.profiler is None:
+                        self.read_next_frame()
+                        if not self.success:
+                            break
+                        self.process_frame(data_manager)
+                    else:
+                        wall, cpu = time.perf_counter(), time.thread_time()
+                        self.read_next_frame()
+                        decoded_wall, decoded_cpu = time.perf_counter(), time.thread_time()
+                        self.profiler.add('decode', decoded_wall - wall, decoded_cpu - cpu)
+                        if not self.success:
+                            break
+                        self.process_frame(data_manager)
+                        inference_wall, inference_cpu = self.inference_time
+                        self.profiler.add('inference', inference_wall, inference_cpu)
+                        self.profiler.add('association', time.perf_counter() - decoded_wall - inference_wall, time.thread_time() - decoded_cpu - inference_cpu)
+                    if self.cpu_lease is not None:
+                        self.cpu_lease.frames += 1
+                        self.apply_cpu_lease()
                     self.current_frame_nb += 1
+                    processed_frames += 1
                     self.console_progress.update(1)
-                    current_frame += 1
+                    if checkpoint is not None and checkpoint.due():
+                        if detection_log is not None:
+                            detection_log.flush() # The log covers every frame of the checkpoint it resumes from
+                        checkpoint.save(data_manager, self.current_frame_nb)
                     # Update progress
                     if self.progress_callback:
-                        progress_percentage = int((current_frame / total_frames) * 100)
+                        progress_percentage = int((processed_frames / total_frames) * 100)
                         self.progress_callback(progress_percentage)
-                else:
-                    break
+        if data_manager.time_windows:
+            data_manager.TRACK_INFO.pad(self.frame_count)
 
+        if detection_log is not None:
+            detection_log.close(len(data_manager.TRACK_INFO), data_manager.TRACK_INFO)
         self.console_progress.close()
         self.cap.release()
         pass